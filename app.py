@@ -1,34 +1,101 @@
 from flask import Flask, jsonify
 from flask_cors import CORS
-from services.supabase_service import SupabaseService
+from werkzeug.middleware.proxy_fix import ProxyFix
 from dotenv import load_dotenv
+import math
 import os
 
 # 1. Load your credentials from .env
+# (before importing routes, which create their services at import time)
 load_dotenv()
 
+from services.supabase_service import SupabaseService
+from services.patient_index import patient_index
+from services.request_limits import request_limiter
+from services.http_cache import http_cache
+from services.archive_service import archive_service
+from services.profiling import profiler
+from services.resilience import DependencyUnavailable
+from routes.health import health_bp
+from routes.stream import stream_bp
+from routes.alert import alert_bp
+from routes.profiling import profiling_bp
+from routes.patient import patient_bp, get_patient
+from routes.reading import reading_bp
+from routes.rook import rook_bp
+from routes.webhook import webhook_bp
+
 app = Flask(__name__)
 CORS(app)
 
+# Slow-request call trees and X-Profile captures (both opt-in); registered
+# first so their timing covers the other request hooks
+profiler.init_app(app)
+
+# Behind N reverse proxies, take the client IP from X-Forwarded-For (only the
+# hops those proxies appended are trusted; rate limits key on this address)
+trusted_proxies = int(os.getenv("TRUSTED_PROXY_COUNT", "0"))
+if trusted_proxies:
+    app.wsgi_app = ProxyFix(app.wsgi_app, x_for=trusted_proxies, x_proto=trusted_proxies)
+
+# Token buckets per caller and route class, answered with 429 + Retry-After
+request_limiter.init_app(app)
+
+@app.errorhandler(DependencyUnavailable)
+def dependency_unavailable(error):
+    """A dependency's circuit is open, its bulkhead is full or it timed out: 503, not 404/500"""
+    response = jsonify({'error': 'Service temporarily unavailable', 'reason': str(error)})
+    response.status_code = 503
+    response.headers['Retry-After'] = str(max(1, math.ceil(error.retry_after)))
+    return response
+
 # 2. Initialize your Service
 # This happens once when the app starts
 db_service = SupabaseService()
 
+# Load the rook_user_id -> patient map without holding up startup
+if os.getenv("PATIENT_INDEX_WARM", "true").lower() == "true":
+    patient_index.warm_in_background()
+
+# Dependency health and circuit breaker metrics
+app.register_blueprint(health_bp, url_prefix='/api/health')
+
+# Server-Sent Events push of new readings and alerts to clinician dashboards
+app.register_blueprint(stream_bp, url_prefix='/api/stream')
+
+# Alert acknowledge/resolve lifecycle
+app.register_blueprint(alert_bp, url_prefix='/api/alert')
+
+# Admin-only sampling profiles and captured request profiles (PROFILING_ENABLED)
+app.register_blueprint(profiling_bp, url_prefix='/api/debug')
+
+def _dashboard_version_key(rook_id):
+    """Version key for the dashboard, resolved from the in-memory Rook ID index"""
+    patient = patient_index.get(rook_id)
+    return f"patient:{patient['id']}" if patient else None
+
+
 @app.route('/api/patient/<rook_id>', methods=['GET'])
+@http_cache.conditional(_dashboard_version_key)
 def get_patient_dashboard(rook_id):
     print(f"--- Request received for Patient: {rook_id} ---")
     
     # Step A: Find the patient record using that Rook ID string
-    patient = db_service.get_patient_by_rook_id(rook_id)
+    patient = patient_index.get(rook_id)
     
     if not patient:
-        print(f"Error: No patient found with ID {rook_id}")
-        return jsonify({"error": "Patient not found"}), 404
+        # Not a Rook ID: this URL is shared with patient_bp's lookup by patient ID
+        return get_patient(patient_id=rook_id)
 
     # Step B: Use the internal UUID to get their history
     patient_uuid = patient['id']
-    readings = db_service.get_patient_readings(patient_uuid)
-    alerts = db_service.get_patient_alerts(patient_uuid)
+    readings = archive_service.get_patient_readings(patient_uuid)
+    # Only open alerts are fetched; the total is a count, not a full scan
+    active_alerts = db_service.get_active_alerts(patient_uuid)
+    total_alerts = db_service.count_patient_alerts(patient_uuid)
+    if readings is None or active_alerts is None or total_alerts is None:
+        # Never a 200: the cache would pin this partial dashboard to the current ETag
+        return jsonify({'error': 'Failed to load dashboard'}), 503
 
     # Step C: Combine and return
     return jsonify({
@@ -42,12 +109,26 @@ def get_patient_dashboard(rook_id):
         },
         "stats": {
             "total_readings": len(readings),
-            "total_alerts": len(alerts)
+            "total_alerts": total_alerts,
+            "open_alerts": len(active_alerts)
         },
         "history": readings,
-        "active_alerts": alerts
+        "active_alerts": active_alerts
     })
 
+# Registered after the dashboard so GET /api/patient/<id> reaches it first
+# (it hands anything that isn't a Rook ID on to patient_bp)
+app.register_blueprint(patient_bp, url_prefix='/api/patient')
+
+# Manual readings
+app.register_blueprint(reading_bp, url_prefix='/api/reading')
+
+# Rook provisioning, sync, backfill and the (optionally fast-ack) data webhook
+app.register_blueprint(rook_bp, url_prefix='/api/rook')
+
+# Legacy Rook data webhook
+app.register_blueprint(webhook_bp, url_prefix='/api/webhook')
+
 if __name__ == '__main__':
     # Force it to port 5000 and enable debug to see those logs!
     app.run(debug=True, port=5000)
\ No newline at end of file
@@ -0,0 +1,68 @@
+-- Insert a reading, check it against the patient's thresholds and create the
+-- alert in one round trip and one transaction.
+--
+-- Returns {"patient": {...}, "reading": {...}, "alert": {...} | null}, or
+-- {"patient": null} when the patient does not exist.
+-- Called from SupabaseService.insert_reading_and_maybe_alert.
+
+create or replace function insert_reading_and_maybe_alert(
+    p_patient_id uuid,
+    p_systolic integer,
+    p_diastolic integer,
+    p_heart_rate integer,
+    p_source text default 'manual',
+    p_alert_message text default null
+)
+returns jsonb
+language plpgsql
+as $$
+declare
+    v_patient patients%rowtype;
+    v_reading readings%rowtype;
+    v_alert alerts%rowtype;
+    v_alert_type text;
+begin
+    select * into v_patient from patients where id = p_patient_id;
+    if not found then
+        return jsonb_build_object('patient', null, 'reading', null, 'alert', null);
+    end if;
+
+    insert into readings (id, patient_id, systolic, diastolic, heart_rate, source)
+    values (gen_random_uuid(), p_patient_id, p_systolic, p_diastolic, p_heart_rate, p_source)
+    returning * into v_reading;
+
+    if p_systolic > v_patient.systolic_threshold or p_diastolic > v_patient.diastolic_threshold then
+        v_alert_type := case
+            when p_systolic > v_patient.systolic_threshold then 'high_systolic'
+            else 'high_diastolic'
+        end;
+
+        insert into alerts (id, patient_id, reading_id, alert_type, message, resolved)
+        values (
+            gen_random_uuid(),
+            p_patient_id,
+            v_reading.id,
+            v_alert_type,
+            coalesce(p_alert_message, format(
+                E'🚨 High Blood Pressure Alert!\nPatient: %s\nSystolic: %s mmHg\nDiastolic: %s mmHg\nHeart Rate: %s bpm\nTime: %s',
+                v_patient.name, p_systolic, p_diastolic, p_heart_rate,
+                to_char(now(), 'YYYY-MM-DD HH24:MI:SS')
+            )),
+            false
+        )
+        returning * into v_alert;
+
+        return jsonb_build_object(
+            'patient', to_jsonb(v_patient),
+            'reading', to_jsonb(v_reading),
+            'alert', to_jsonb(v_alert)
+        );
+    end if;
+
+    return jsonb_build_object(
+        'patient', to_jsonb(v_patient),
+        'reading', to_jsonb(v_reading),
+        'alert', null
+    );
+end;
+$$;
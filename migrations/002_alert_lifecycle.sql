@@ -0,0 +1,29 @@
+-- Alert acknowledge/resolve lifecycle and unresolved-alert indexes.
+
+alter table alerts
+    add column if not exists acknowledged boolean not null default false,
+    add column if not exists acknowledged_at timestamptz,
+    add column if not exists acknowledged_by text,
+    add column if not exists resolved_at timestamptz,
+    add column if not exists resolved_by text;
+
+-- Only open alerts are indexed, so active-alert queries cost O(open alerts)
+create index if not exists alerts_unresolved_patient_idx
+    on alerts (patient_id, created_at desc)
+    where resolved = false;
+
+create index if not exists patients_clinician_idx on patients (clinician_id);
+
+-- Open alert counts per patient for one clinician's panel
+create or replace function unresolved_alert_counts(p_clinician_id text)
+returns table (patient_id uuid, open_alerts bigint)
+language sql
+stable
+as $$
+    select a.patient_id, count(*) as open_alerts
+    from alerts a
+    join patients p on p.id = a.patient_id
+    where p.clinician_id = p_clinician_id
+      and a.resolved = false
+    group by a.patient_id;
+$$;
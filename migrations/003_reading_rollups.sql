@@ -0,0 +1,59 @@
+-- Hourly and daily blood pressure rollups for long-range charts.
+
+create index if not exists readings_patient_created_idx
+    on readings (patient_id, created_at);
+
+create table if not exists reading_rollups (
+    patient_id uuid not null references patients(id) on delete cascade,
+    resolution text not null check (resolution in ('hour', 'day')),
+    bucket_start timestamptz not null,
+    count integer not null,
+    systolic_min integer,
+    systolic_max integer,
+    systolic_sum bigint,
+    diastolic_min integer,
+    diastolic_max integer,
+    diastolic_sum bigint,
+    heart_rate_min integer,
+    heart_rate_max integer,
+    heart_rate_sum bigint,
+    heart_rate_count integer not null default 0,
+    primary key (patient_id, resolution, bucket_start)
+);
+
+-- Merge pre-aggregated buckets in one call. With p_replace the buckets are
+-- overwritten (backfill); otherwise they are combined (incremental ingest).
+create or replace function merge_reading_rollups(p_rows jsonb, p_replace boolean default false)
+returns void
+language sql
+as $$
+    insert into reading_rollups as r (
+        patient_id, resolution, bucket_start, count,
+        systolic_min, systolic_max, systolic_sum,
+        diastolic_min, diastolic_max, diastolic_sum,
+        heart_rate_min, heart_rate_max, heart_rate_sum, heart_rate_count
+    )
+    select
+        patient_id, resolution, bucket_start, count,
+        systolic_min, systolic_max, systolic_sum,
+        diastolic_min, diastolic_max, diastolic_sum,
+        heart_rate_min, heart_rate_max, heart_rate_sum, heart_rate_count
+    from jsonb_to_recordset(p_rows) as x(
+        patient_id uuid, resolution text, bucket_start timestamptz, count integer,
+        systolic_min integer, systolic_max integer, systolic_sum bigint,
+        diastolic_min integer, diastolic_max integer, diastolic_sum bigint,
+        heart_rate_min integer, heart_rate_max integer, heart_rate_sum bigint, heart_rate_count integer
+    )
+    on conflict (patient_id, resolution, bucket_start) do update set
+        count = case when p_replace then excluded.count else r.count + excluded.count end,
+        systolic_min = case when p_replace then excluded.systolic_min else least(r.systolic_min, excluded.systolic_min) end,
+        systolic_max = case when p_replace then excluded.systolic_max else greatest(r.systolic_max, excluded.systolic_max) end,
+        systolic_sum = case when p_replace then excluded.systolic_sum else r.systolic_sum + excluded.systolic_sum end,
+        diastolic_min = case when p_replace then excluded.diastolic_min else least(r.diastolic_min, excluded.diastolic_min) end,
+        diastolic_max = case when p_replace then excluded.diastolic_max else greatest(r.diastolic_max, excluded.diastolic_max) end,
+        diastolic_sum = case when p_replace then excluded.diastolic_sum else r.diastolic_sum + excluded.diastolic_sum end,
+        heart_rate_min = case when p_replace then excluded.heart_rate_min else least(r.heart_rate_min, excluded.heart_rate_min) end,
+        heart_rate_max = case when p_replace then excluded.heart_rate_max else greatest(r.heart_rate_max, excluded.heart_rate_max) end,
+        heart_rate_sum = case when p_replace then excluded.heart_rate_sum else coalesce(r.heart_rate_sum, 0) + coalesce(excluded.heart_rate_sum, 0) end,
+        heart_rate_count = case when p_replace then excluded.heart_rate_count else r.heart_rate_count + excluded.heart_rate_count end;
+$$;
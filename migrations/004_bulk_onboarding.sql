@@ -0,0 +1,20 @@
+-- Bulk patient onboarding support.
+
+-- Onboarding matches rows to existing patients by email to skip duplicates
+create index if not exists patients_email_idx on patients (email);
+
+-- Set many patients' rook_user_id in one statement.
+-- p_rows: [{"id": "<patient uuid>", "rook_user_id": "<rook id>"}, ...]
+create or replace function set_patient_rook_ids(p_rows jsonb)
+returns integer
+language sql
+as $$
+    with updated as (
+        update patients p
+        set rook_user_id = x.rook_user_id
+        from jsonb_to_recordset(p_rows) as x(id uuid, rook_user_id text)
+        where p.id = x.id
+        returning 1
+    )
+    select count(*)::integer from updated;
+$$;
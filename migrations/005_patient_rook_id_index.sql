@@ -0,0 +1,5 @@
+-- Webhook routing looks patients up by Rook user ID.
+-- Partial, since patients who haven't been provisioned with Rook have none.
+create index if not exists patients_rook_user_id_idx
+    on patients (rook_user_id)
+    where rook_user_id is not null;
@@ -0,0 +1,99 @@
+-- Generic time series store for Rook metrics other than blood pressure
+-- (heart rate, SpO2, weight, glucose, steps). One narrow row per sample,
+-- keyed by (patient, metric, timestamp) so re-delivered samples are no-ops.
+
+create table if not exists measurements (
+    patient_id uuid not null references patients(id) on delete cascade,
+    metric text not null,
+    recorded_at timestamptz not null,
+    value double precision not null,
+    source text not null default 'rook',
+    primary key (patient_id, metric, recorded_at)
+);
+
+-- Retention deletes scan by metric and age
+create index if not exists measurements_metric_recorded_idx
+    on measurements (metric, recorded_at);
+
+-- Bulk insert from parallel arrays: one round trip and one statement for a
+-- whole batch, without building a JSON object per sample.
+create or replace function insert_measurements(
+    p_patient_ids uuid[],
+    p_metrics text[],
+    p_recorded_at timestamptz[],
+    p_values double precision[],
+    p_source text default 'rook'
+)
+returns integer
+language sql
+as $$
+    with inserted as (
+        insert into measurements (patient_id, metric, recorded_at, value, source)
+        select patient_id, metric, recorded_at, value, p_source
+        from unnest(p_patient_ids, p_metrics, p_recorded_at, p_values)
+            as x(patient_id, metric, recorded_at, value)
+        on conflict (patient_id, metric, recorded_at) do nothing
+        returning 1
+    )
+    select count(*)::integer from inserted;
+$$;
+
+-- Fixed-width buckets for charting high-frequency streams
+create or replace function measurement_buckets(
+    p_patient_id uuid,
+    p_metric text,
+    p_start timestamptz,
+    p_end timestamptz,
+    p_bucket interval
+)
+returns table (
+    bucket_start timestamptz,
+    count bigint,
+    value_min double precision,
+    value_max double precision,
+    value_avg double precision,
+    value_sum double precision
+)
+language sql
+stable
+as $$
+    select
+        date_bin(p_bucket, recorded_at, timestamptz '2000-01-01') as bucket_start,
+        count(*),
+        min(value),
+        max(value),
+        avg(value),
+        sum(value)
+    from measurements
+    where patient_id = p_patient_id
+      and metric = p_metric
+      and recorded_at >= p_start
+      and recorded_at < p_end
+    group by 1
+    order by 1;
+$$;
+
+-- Delete one metric's samples older than a cutoff, in batches so a large
+-- backlog doesn't hold one long lock. Returns the number of rows deleted.
+create or replace function prune_measurements(p_metric text, p_before timestamptz, p_batch integer default 10000)
+returns integer
+language plpgsql
+as $$
+declare
+    v_deleted integer;
+    v_total integer := 0;
+begin
+    loop
+        delete from measurements
+        where ctid in (
+            select ctid from measurements
+            where metric = p_metric and recorded_at < p_before
+            limit p_batch
+        );
+        get diagnostics v_deleted = row_count;
+        v_total := v_total + v_deleted;
+        exit when v_deleted < p_batch;
+    end loop;
+    return v_total;
+end;
+$$;
@@ -0,0 +1,25 @@
+-- Historical import of Rook blood pressure readings.
+
+-- Insert readings whose (patient_id, created_at) isn't stored yet and return
+-- the new rows. Backfills can overlap webhook deliveries and earlier,
+-- interrupted runs; the readings_patient_created_idx index from 003 keeps the
+-- existence check cheap.
+-- p_rows: [{"patient_id", "systolic", "diastolic", "heart_rate", "source", "created_at"}, ...]
+create or replace function insert_readings_if_new(p_rows jsonb)
+returns setof readings
+language sql
+as $$
+    insert into readings (id, patient_id, systolic, diastolic, heart_rate, source, created_at)
+    select distinct on (x.patient_id, x.created_at)
+        gen_random_uuid(), x.patient_id, x.systolic, x.diastolic, coalesce(x.heart_rate, 0),
+        coalesce(x.source, 'rook'), x.created_at
+    from jsonb_to_recordset(p_rows) as x(
+        patient_id uuid, systolic integer, diastolic integer, heart_rate integer,
+        source text, created_at timestamptz
+    )
+    where not exists (
+        select 1 from readings r
+        where r.patient_id = x.patient_id and r.created_at = x.created_at
+    )
+    returning *;
+$$;
@@ -0,0 +1,65 @@
+-- Retention: old readings and resolved alerts move to archive files.
+-- Called from services/archive_service.py.
+
+create index if not exists alerts_patient_created_idx
+    on alerts (patient_id, created_at);
+
+create index if not exists alerts_reading_idx
+    on alerts (reading_id);
+
+-- A patient's readings older than p_before that no remaining alert points at,
+-- oldest first. Readings behind open (or not yet archived) alerts stay hot.
+create or replace function archivable_readings(p_patient_id uuid, p_before timestamptz, p_offset integer, p_limit integer)
+returns setof readings
+language sql
+stable
+as $$
+    select r.* from readings r
+    where r.patient_id = p_patient_id
+      and r.created_at < p_before
+      and not exists (select 1 from alerts a where a.reading_id = r.id)
+    order by r.created_at, r.id
+    offset p_offset
+    limit p_limit;
+$$;
+
+-- A patient's resolved alerts older than p_before, oldest first
+create or replace function archivable_alerts(p_patient_id uuid, p_before timestamptz, p_offset integer, p_limit integer)
+returns setof alerts
+language sql
+stable
+as $$
+    select * from alerts
+    where patient_id = p_patient_id
+      and resolved = true
+      and created_at < p_before
+    order by created_at, id
+    offset p_offset
+    limit p_limit;
+$$;
+
+-- Delete one batch of archived rows; returns the number deleted.
+-- Readings an alert still references are kept.
+create or replace function delete_archived_readings(p_ids uuid[])
+returns integer
+language sql
+as $$
+    with deleted as (
+        delete from readings r
+        where r.id = any(p_ids)
+          and not exists (select 1 from alerts a where a.reading_id = r.id)
+        returning 1
+    )
+    select count(*)::integer from deleted;
+$$;
+
+create or replace function delete_archived_alerts(p_ids uuid[])
+returns integer
+language sql
+as $$
+    with deleted as (
+        delete from alerts where id = any(p_ids) and resolved = true
+        returning 1
+    )
+    select count(*)::integer from deleted;
+$$;
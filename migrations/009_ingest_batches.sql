@@ -0,0 +1,39 @@
+-- Store a micro-batch of webhook readings and the alerts they triggered in one
+-- transaction, so a failed batch leaves nothing behind and can be retried
+-- without duplicating readings or losing alerts.
+-- Called from SupabaseService.insert_readings_with_alerts.
+--
+-- p_readings: [{"id", "patient_id", "systolic", "diastolic", "heart_rate", "source"}, ...]
+-- p_alerts:   [{"id", "patient_id", "reading_id", "alert_type", "message"}, ...]
+-- Returns {"readings": [...], "alerts": [...]} with the stored rows.
+create or replace function insert_readings_with_alerts(p_readings jsonb, p_alerts jsonb default '[]')
+returns jsonb
+language plpgsql
+as $$
+declare
+    v_readings jsonb;
+    v_alerts jsonb;
+begin
+    with inserted as (
+        insert into readings (id, patient_id, systolic, diastolic, heart_rate, source)
+        select x.id, x.patient_id, x.systolic, x.diastolic, x.heart_rate, coalesce(x.source, 'rook')
+        from jsonb_to_recordset(p_readings) as x(
+            id uuid, patient_id uuid, systolic integer, diastolic integer, heart_rate integer, source text
+        )
+        returning *
+    )
+    select coalesce(jsonb_agg(to_jsonb(inserted)), '[]'::jsonb) into v_readings from inserted;
+
+    with inserted as (
+        insert into alerts (id, patient_id, reading_id, alert_type, message, acknowledged, resolved)
+        select x.id, x.patient_id, x.reading_id, x.alert_type, x.message, false, false
+        from jsonb_to_recordset(coalesce(p_alerts, '[]'::jsonb)) as x(
+            id uuid, patient_id uuid, reading_id uuid, alert_type text, message text
+        )
+        returning *
+    )
+    select coalesce(jsonb_agg(to_jsonb(inserted)), '[]'::jsonb) into v_alerts from inserted;
+
+    return jsonb_build_object('readings', v_readings, 'alerts', v_alerts);
+end;
+$$;
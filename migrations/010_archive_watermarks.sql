@@ -0,0 +1,52 @@
+-- Per-patient archive watermark: readings older than readings_archived_before
+-- may have been moved to archive files (services/archive_service.py) and are
+-- then only in the archive and in reading_rollups.
+
+create table if not exists archive_watermarks (
+    patient_id uuid primary key references patients(id) on delete cascade,
+    readings_archived_before timestamptz not null,
+    updated_at timestamptz not null default now()
+);
+
+-- Raise watermarks (never lower them) for many patients in one call.
+-- p_rows: [{"patient_id": "<uuid>", "readings_archived_before": "<timestamp>"}, ...]
+create or replace function set_archive_watermarks(p_rows jsonb)
+returns integer
+language sql
+as $$
+    with upserted as (
+        insert into archive_watermarks as w (patient_id, readings_archived_before)
+        select x.patient_id, x.readings_archived_before
+        from jsonb_to_recordset(p_rows) as x(patient_id uuid, readings_archived_before timestamptz)
+        on conflict (patient_id) do update
+            set readings_archived_before = greatest(w.readings_archived_before, excluded.readings_archived_before),
+                updated_at = now()
+        returning 1
+    )
+    select count(*)::integer from upserted;
+$$;
+
+-- Replaces the 007 version: history older than the patient's watermark has
+-- been archived (and rolled up), so a re-run backfill must not import it again.
+create or replace function insert_readings_if_new(p_rows jsonb)
+returns setof readings
+language sql
+as $$
+    insert into readings (id, patient_id, systolic, diastolic, heart_rate, source, created_at)
+    select distinct on (x.patient_id, x.created_at)
+        gen_random_uuid(), x.patient_id, x.systolic, x.diastolic, coalesce(x.heart_rate, 0),
+        coalesce(x.source, 'rook'), x.created_at
+    from jsonb_to_recordset(p_rows) as x(
+        patient_id uuid, systolic integer, diastolic integer, heart_rate integer,
+        source text, created_at timestamptz
+    )
+    where not exists (
+        select 1 from readings r
+        where r.patient_id = x.patient_id and r.created_at = x.created_at
+    )
+    and not exists (
+        select 1 from archive_watermarks w
+        where w.patient_id = x.patient_id and x.created_at < w.readings_archived_before
+    )
+    returning *;
+$$;
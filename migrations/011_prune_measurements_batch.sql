@@ -0,0 +1,22 @@
+-- prune_measurements from 006 looped inside one function call, so all of its
+-- batches ran in a single transaction and held their locks until the end.
+-- It now deletes one batch per call; the caller
+-- (services/measurement_service.py) repeats the call until a short batch
+-- comes back, so each batch commits on its own.
+create or replace function prune_measurements(p_metric text, p_before timestamptz, p_batch integer default 10000)
+returns integer
+language plpgsql
+as $$
+declare
+    v_deleted integer;
+begin
+    delete from measurements
+    where ctid in (
+        select ctid from measurements
+        where metric = p_metric and recorded_at < p_before
+        limit p_batch
+    );
+    get diagnostics v_deleted = row_count;
+    return v_deleted;
+end;
+$$;
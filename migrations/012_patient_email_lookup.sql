@@ -0,0 +1,14 @@
+-- Onboarding normalizes emails to lower case, but patients registered by
+-- other paths may be stored with mixed case or padding, which an exact
+-- match (patients_email_idx from 004) misses. Match on the normalized form.
+create index if not exists patients_email_normalized_idx on patients (lower(btrim(email)));
+
+create or replace function get_patients_by_emails(p_emails text[])
+returns setof patients
+language sql
+stable
+as $$
+    select p.*
+    from patients p
+    where lower(btrim(p.email)) in (select lower(btrim(e)) from unnest(p_emails) as e);
+$$;
@@ -0,0 +1,141 @@
+-- When Rook says a reading was taken. Live webhook readings are stored with
+-- created_at = now(), so backfill deduplication on (patient_id, created_at)
+-- never matched them and a backfill overlapping live data re-imported every
+-- reading. Live Rook readings now record measured_at, backfilled ones set it
+-- from their Rook timestamp, and backfill deduplicates on it.
+
+alter table readings add column if not exists measured_at timestamptz;
+
+create index if not exists readings_patient_measured_idx
+    on readings (patient_id, measured_at) where measured_at is not null;
+
+-- Replaces the 001 version with a p_measured_at argument. Dropped first: an
+-- extra argument would otherwise leave both overloads and make calls ambiguous.
+drop function if exists insert_reading_and_maybe_alert(uuid, integer, integer, integer, text, text);
+
+create or replace function insert_reading_and_maybe_alert(
+    p_patient_id uuid,
+    p_systolic integer,
+    p_diastolic integer,
+    p_heart_rate integer,
+    p_source text default 'manual',
+    p_alert_message text default null,
+    p_measured_at timestamptz default null
+)
+returns jsonb
+language plpgsql
+as $$
+declare
+    v_patient patients%rowtype;
+    v_reading readings%rowtype;
+    v_alert alerts%rowtype;
+    v_alert_type text;
+begin
+    select * into v_patient from patients where id = p_patient_id;
+    if not found then
+        return jsonb_build_object('patient', null, 'reading', null, 'alert', null);
+    end if;
+
+    insert into readings (id, patient_id, systolic, diastolic, heart_rate, source, measured_at)
+    values (gen_random_uuid(), p_patient_id, p_systolic, p_diastolic, p_heart_rate, p_source, p_measured_at)
+    returning * into v_reading;
+
+    if p_systolic > v_patient.systolic_threshold or p_diastolic > v_patient.diastolic_threshold then
+        v_alert_type := case
+            when p_systolic > v_patient.systolic_threshold then 'high_systolic'
+            else 'high_diastolic'
+        end;
+
+        insert into alerts (id, patient_id, reading_id, alert_type, message, resolved)
+        values (
+            gen_random_uuid(),
+            p_patient_id,
+            v_reading.id,
+            v_alert_type,
+            coalesce(p_alert_message, format(
+                E'🚨 High Blood Pressure Alert!\nPatient: %s\nSystolic: %s mmHg\nDiastolic: %s mmHg\nHeart Rate: %s bpm\nTime: %s',
+                v_patient.name, p_systolic, p_diastolic, p_heart_rate,
+                to_char(now(), 'YYYY-MM-DD HH24:MI:SS')
+            )),
+            false
+        )
+        returning * into v_alert;
+
+        return jsonb_build_object(
+            'patient', to_jsonb(v_patient),
+            'reading', to_jsonb(v_reading),
+            'alert', to_jsonb(v_alert)
+        );
+    end if;
+
+    return jsonb_build_object(
+        'patient', to_jsonb(v_patient),
+        'reading', to_jsonb(v_reading),
+        'alert', null
+    );
+end;
+$$;
+
+-- Replaces the 009 version: readings carry measured_at.
+create or replace function insert_readings_with_alerts(p_readings jsonb, p_alerts jsonb default '[]')
+returns jsonb
+language plpgsql
+as $$
+declare
+    v_readings jsonb;
+    v_alerts jsonb;
+begin
+    with inserted as (
+        insert into readings (id, patient_id, systolic, diastolic, heart_rate, source, measured_at)
+        select x.id, x.patient_id, x.systolic, x.diastolic, x.heart_rate, coalesce(x.source, 'rook'), x.measured_at
+        from jsonb_to_recordset(p_readings) as x(
+            id uuid, patient_id uuid, systolic integer, diastolic integer, heart_rate integer, source text,
+            measured_at timestamptz
+        )
+        returning *
+    )
+    select coalesce(jsonb_agg(to_jsonb(inserted)), '[]'::jsonb) into v_readings from inserted;
+
+    with inserted as (
+        insert into alerts (id, patient_id, reading_id, alert_type, message, acknowledged, resolved)
+        select x.id, x.patient_id, x.reading_id, x.alert_type, x.message, false, false
+        from jsonb_to_recordset(coalesce(p_alerts, '[]'::jsonb)) as x(
+            id uuid, patient_id uuid, reading_id uuid, alert_type text, message text
+        )
+        returning *
+    )
+    select coalesce(jsonb_agg(to_jsonb(inserted)), '[]'::jsonb) into v_alerts from inserted;
+
+    return jsonb_build_object('readings', v_readings, 'alerts', v_alerts);
+end;
+$$;
+
+-- Replaces the 010 version. p_rows' created_at is the Rook timestamp; it is
+-- matched against measured_at (live and newer backfilled rows) and against
+-- created_at (rows backfilled before this migration).
+create or replace function insert_readings_if_new(p_rows jsonb)
+returns setof readings
+language sql
+as $$
+    insert into readings (id, patient_id, systolic, diastolic, heart_rate, source, created_at, measured_at)
+    select distinct on (x.patient_id, x.created_at)
+        gen_random_uuid(), x.patient_id, x.systolic, x.diastolic, coalesce(x.heart_rate, 0),
+        coalesce(x.source, 'rook'), x.created_at, x.created_at
+    from jsonb_to_recordset(p_rows) as x(
+        patient_id uuid, systolic integer, diastolic integer, heart_rate integer,
+        source text, created_at timestamptz
+    )
+    where not exists (
+        select 1 from readings r
+        where r.patient_id = x.patient_id and r.measured_at = x.created_at
+    )
+    and not exists (
+        select 1 from readings r
+        where r.patient_id = x.patient_id and r.created_at = x.created_at
+    )
+    and not exists (
+        select 1 from archive_watermarks w
+        where w.patient_id = x.patient_id and x.created_at < w.readings_archived_before
+    )
+    returning *;
+$$;
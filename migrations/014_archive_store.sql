@@ -0,0 +1,24 @@
+-- Which archive directory holds the archived rows (services/archive_service.py).
+-- Archive files are only in ARCHIVE_DIR, so every host that archives or serves
+-- ?include_archived must see the same directory (shared storage, or a single
+-- host). The first archive run records the ID stored in that directory here;
+-- processes whose ARCHIVE_DIR has another (or no) ID refuse to archive, and
+-- answer archive reads with 503 instead of silently leaving rows out.
+
+create table if not exists archive_store (
+    singleton boolean primary key default true check (singleton),
+    store_id text not null,
+    created_at timestamptz not null default now()
+);
+
+-- Record p_store_id unless a store is already registered; returns the registered ID.
+create or replace function claim_archive_store(p_store_id text)
+returns text
+language plpgsql
+as $$
+begin
+    insert into archive_store (store_id) values (p_store_id)
+    on conflict (singleton) do nothing;
+    return (select store_id from archive_store);
+end;
+$$;
@@ -27,21 +27,26 @@ class Patient:
 
 class Reading:
     def __init__(self, patient_id: str, systolic: int, diastolic: int, 
-                 heart_rate: int, source: str = "manual"):
+                 heart_rate: int, source: str = "manual", measured_at: Optional[str] = None):
         self.patient_id = patient_id
         self.systolic = systolic
         self.diastolic = diastolic
         self.heart_rate = heart_rate
         self.source = source
+        # When the device took it (Rook's timestamp); created_at is when we stored it
+        self.measured_at = measured_at
     
     def to_dict(self):
-        return {
+        data = {
             'patient_id': self.patient_id,
             'systolic': self.systolic,
             'diastolic': self.diastolic,
             'heart_rate': self.heart_rate,
             'source': self.source,
         }
+        if self.measured_at:
+            data['measured_at'] = self.measured_at
+        return data
 
 
 class Alert:
@@ -50,6 +55,7 @@ class Alert:
         self.reading_id = reading_id
         self.alert_type = alert_type
         self.message = message
+        self.acknowledged = False
         self.resolved = False
     
     def to_dict(self):
@@ -58,5 +64,6 @@ class Alert:
             'reading_id': self.reading_id,
             'alert_type': self.alert_type,
             'message': self.message,
+            'acknowledged': self.acknowledged,
             'resolved': self.resolved,
         }
\ No newline at end of file
@@ -0,0 +1,127 @@
+from flask import Blueprint, request, jsonify
+from services.supabase_service import SupabaseService
+from services.alert_counts import alert_count_cache
+from services.http_cache import http_cache
+from services.resilience import DependencyUnavailable
+
+alert_bp = Blueprint('alert', __name__)
+supabase_service = SupabaseService()
+
+@alert_bp.route('/<alert_id>/acknowledge', methods=['POST'])
+def acknowledge_alert(alert_id):
+    """Mark an alert as seen"""
+    try:
+        data = request.get_json(silent=True) or {}
+        alert = supabase_service.acknowledge_alert(alert_id, data.get('clinician_id'))
+        
+        if alert:
+            http_cache.bump_patient(alert['patient_id'])
+            return jsonify({
+                'message': 'Alert acknowledged',
+                'alert': alert
+            }), 200
+        else:
+            return jsonify({'error': 'Alert not found'}), 404
+    
+    except DependencyUnavailable:
+        raise
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+
+@alert_bp.route('/<alert_id>/resolve', methods=['POST'])
+def resolve_alert(alert_id):
+    """Resolve a single alert"""
+    try:
+        data = request.get_json(silent=True) or {}
+        alerts = supabase_service.resolve_alerts([alert_id], data.get('clinician_id'))
+        
+        if alerts is None:
+            return jsonify({'error': 'Failed to resolve alert'}), 500
+        if not alerts:
+            return jsonify({'error': 'Alert not found or already resolved'}), 404
+        
+        alert_count_cache.invalidate_patients([alerts[0]['patient_id']])
+        http_cache.bump_patient(alerts[0]['patient_id'])
+        return jsonify({
+            'message': 'Alert resolved',
+            'alert': alerts[0]
+        }), 200
+    
+    except DependencyUnavailable:
+        raise
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+
+@alert_bp.route('/resolve', methods=['POST'])
+def resolve_alerts():
+    """Resolve a set of alerts in one update"""
+    try:
+        data = request.get_json(silent=True) or {}
+        alert_ids = data.get('alert_ids')
+        
+        if not isinstance(alert_ids, list) or not alert_ids:
+            return jsonify({'error': 'alert_ids must be a non-empty list'}), 400
+        
+        alerts = supabase_service.resolve_alerts(alert_ids, data.get('clinician_id'))
+        if alerts is None:
+            return jsonify({'error': 'Failed to resolve alerts'}), 500
+        
+        alert_count_cache.invalidate_patients({alert['patient_id'] for alert in alerts})
+        http_cache.bump_patients(alert['patient_id'] for alert in alerts)
+        resolved_ids = {alert['id'] for alert in alerts}
+        return jsonify({
+            'message': 'Alerts resolved',
+            'resolved_count': len(resolved_ids),
+            'resolved': sorted(resolved_ids),
+            'skipped': [alert_id for alert_id in alert_ids if alert_id not in resolved_ids]
+        }), 200
+    
+    except DependencyUnavailable:
+        raise
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+
+@alert_bp.route('/patient/<patient_id>/active', methods=['GET'])
+@http_cache.conditional(lambda patient_id: f"patient:{patient_id}")
+def get_active_alerts(patient_id):
+    """Get a patient's unresolved alerts"""
+    try:
+        limit = request.args.get('limit', type=int)
+        alerts = supabase_service.get_active_alerts(patient_id, limit)
+        if alerts is None:
+            return jsonify({'error': 'Failed to load alerts'}), 503
+        
+        return jsonify({
+            'message': 'Active alerts retrieved successfully',
+            'count': len(alerts),
+            'alerts': alerts
+        }), 200
+    
+    except DependencyUnavailable:
+        raise
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+
+@alert_bp.route('/clinician/<clinician_id>/unresolved-count', methods=['GET'])
+def get_unresolved_count(clinician_id):
+    """Cached count of open alerts across a clinician's patients"""
+    try:
+        counts = alert_count_cache.get(clinician_id, supabase_service.get_unresolved_alert_counts)
+        
+        if counts is None:
+            return jsonify({'error': 'Failed to count alerts'}), 500
+        
+        return jsonify({
+            'clinician_id': clinician_id,
+            'unresolved_count': counts['total'],
+            'by_patient': counts['by_patient']
+        }), 200
+    
+    except DependencyUnavailable:
+        raise
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
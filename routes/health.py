@@ -0,0 +1,39 @@
+from flask import Blueprint, request, jsonify
+from services.resilience import dependency_stats, CircuitBreaker
+from services.request_limits import request_limiter
+from services.http_cache import http_cache
+from services.tenancy import tenant_metrics
+from services.profiling import profiler
+
+health_bp = Blueprint('health', __name__)
+
+@health_bp.route('', methods=['GET'])
+def health():
+    """Overall health plus the circuit state of each external dependency"""
+    # Stays 200 when degraded: an open Twilio breaker shouldn't pull the instance
+    dependencies = dependency_stats()
+    states = {name: stats['state'] for name, stats in dependencies.items()}
+    degraded = any(state != CircuitBreaker.CLOSED for state in states.values())
+    
+    return jsonify({
+        'status': 'degraded' if degraded else 'ok',
+        'dependencies': states
+    }), 200
+
+
+@health_bp.route('/metrics', methods=['GET'])
+def metrics():
+    """Breaker, bulkhead and latency metrics per dependency, plus rate limiting, HTTP caching and profiling"""
+    return jsonify({
+        'dependencies': dependency_stats(),
+        'rate_limits': request_limiter.stats(),
+        'http_cache': http_cache.stats(),
+        'profiling': profiler.stats()
+    }), 200
+
+
+@health_bp.route('/tenants', methods=['GET'])
+def tenants():
+    """Busiest clinicians by ingestion and background work time"""
+    top = min(request.args.get('top', 20, type=int), 200)
+    return jsonify(tenant_metrics.stats(top)), 200
@@ -1,7 +1,14 @@
 from flask import Blueprint, request, jsonify
 from services.supabase_service import SupabaseService
 from services.twilio_service import TwilioService
+from services.rollup_service import rollup_service
+from services import onboarding_service
+from services.patient_index import patient_index
+from services.measurement_service import measurement_service
+from services.http_cache import http_cache
+from services.archive_service import archive_service
 from models import Patient
+from services.resilience import DependencyUnavailable
 import uuid
 
 patient_bp = Blueprint('patient', __name__)
@@ -33,6 +40,8 @@ def register_patient():
         result = supabase_service.register_patient(patient)
         
         if result:
+            patient_index.add(result)
+            http_cache.bump_clinician(result['clinician_id'])
             return jsonify({
                 'message': 'Patient registered successfully',
                 'patient': result
@@ -40,11 +49,61 @@ def register_patient():
         else:
             return jsonify({'error': 'Failed to register patient'}), 500
     
+    except DependencyUnavailable:
+        raise
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+
+@patient_bp.route('/bulk-register', methods=['POST'])
+def bulk_register_patients():
+    """Start a bulk onboarding job from a CSV or JSON body (?job_id= resumes a job)"""
+    try:
+        rows = onboarding_service.parse_rows(request.get_data(as_text=True), request.content_type or 'json')
+        if not rows:
+            return jsonify({'error': 'No patients provided'}), 400
+        
+        job_id = onboarding_service.start_job(rows, request.args.get('job_id'))
+        
+        return jsonify({
+            'message': 'Bulk onboarding started',
+            'job_id': job_id,
+            'count': len(rows)
+        }), 202
+    
+    except onboarding_service.JobRunningError as e:
+        return jsonify({'error': str(e)}), 409
+    except ValueError as e:
+        return jsonify({'error': f'Invalid input: {e}'}), 400
+    except DependencyUnavailable:
+        raise
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+
+@patient_bp.route('/bulk-register/<job_id>', methods=['GET'])
+def get_bulk_register_status(job_id):
+    """Progress and per-row status of a bulk onboarding job"""
+    try:
+        report = onboarding_service.load_report(job_id)
+        
+        if report is None:
+            return jsonify({'error': 'Job not found'}), 404
+        
+        return jsonify({
+            'message': 'Job retrieved successfully',
+            'job_id': job_id,
+            **report
+        }), 200
+    
+    except DependencyUnavailable:
+        raise
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
 
 @patient_bp.route('/<patient_id>', methods=['GET'])
+@http_cache.conditional(lambda patient_id: f"patient:{patient_id}")
 def get_patient(patient_id):
     """Get patient by ID"""
     try:
@@ -58,15 +117,20 @@ def get_patient(patient_id):
         else:
             return jsonify({'error': 'Patient not found'}), 404
     
+    except DependencyUnavailable:
+        raise
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
 
 @patient_bp.route('/clinician/<clinician_id>', methods=['GET'])
+@http_cache.conditional(lambda clinician_id: f"clinician:{clinician_id}")
 def get_clinician_patients(clinician_id):
     """Get all patients for a clinician"""
     try:
         patients = supabase_service.get_clinician_patients(clinician_id)
+        if patients is None:
+            return jsonify({'error': 'Failed to load patients'}), 503
         
         return jsonify({
             'message': 'Patients retrieved successfully',
@@ -74,16 +138,24 @@ def get_clinician_patients(clinician_id):
             'patients': patients
         }), 200
     
+    except DependencyUnavailable:
+        raise
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
 
 @patient_bp.route('/<patient_id>/readings', methods=['GET'])
+@http_cache.conditional(lambda patient_id: f"patient:{patient_id}")
 def get_patient_readings(patient_id):
-    """Get patient's recent readings"""
+    """Get patient's recent readings (optionally ?start=&end= ISO timestamps)"""
     try:
         limit = request.args.get('limit', 10, type=int)
-        readings = supabase_service.get_patient_readings(patient_id, limit)
+        # Falls back to archived readings once the hot table runs out
+        readings = archive_service.get_patient_readings(
+            patient_id, limit, request.args.get('start'), request.args.get('end')
+        )
+        if readings is None:
+            return jsonify({'error': 'Failed to load readings'}), 503
         
         return jsonify({
             'message': 'Readings retrieved successfully',
@@ -91,15 +163,82 @@ def get_patient_readings(patient_id):
             'readings': readings
         }), 200
     
+    except DependencyUnavailable:
+        raise
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+
+@patient_bp.route('/<patient_id>/series', methods=['GET'])
+def get_patient_series(patient_id):
+    """Chart series for a date range, at raw or rollup resolution within a point budget"""
+    try:
+        start = request.args.get('start')
+        end = request.args.get('end')
+        if not start or not end:
+            return jsonify({'error': 'start and end are required'}), 400
+        
+        points = request.args.get('points', 300, type=int)
+        series = rollup_service.get_series(patient_id, start, end, max(points, 3))
+        
+        if series is None:
+            return jsonify({'error': 'Failed to load series'}), 500
+        
+        return jsonify({
+            'message': 'Series retrieved successfully',
+            'count': len(series['points']),
+            **series
+        }), 200
+    
+    except ValueError as e:
+        return jsonify({'error': f'Invalid date: {e}'}), 400
+    except DependencyUnavailable:
+        raise
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
 
+@patient_bp.route('/<patient_id>/measurements/<metric>', methods=['GET'])
+def get_patient_measurements(patient_id, metric):
+    """Heart rate, SpO2, weight, glucose or steps for a date range, bucketed within a point budget"""
+    try:
+        start = request.args.get('start')
+        end = request.args.get('end')
+        if not start or not end:
+            return jsonify({'error': 'start and end are required'}), 400
+        
+        points = request.args.get('points', 500, type=int)
+        series = measurement_service.get_series(patient_id, metric, start, end, max(points, 1))
+        
+        if series is None:
+            return jsonify({'error': 'Failed to load measurements'}), 500
+        
+        return jsonify({
+            'message': 'Measurements retrieved successfully',
+            'count': len(series['points']),
+            **series
+        }), 200
+    
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    except DependencyUnavailable:
+        raise
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
 @patient_bp.route('/<patient_id>/alerts', methods=['GET'])
+@http_cache.conditional(lambda patient_id: f"patient:{patient_id}")
 def get_patient_alerts(patient_id):
-    """Get patient's alerts"""
+    """Get patient's alerts (?active=true for unresolved only, ?include_archived=true for archived ones too)"""
     try:
-        alerts = supabase_service.get_patient_alerts(patient_id)
+        if request.args.get('active', 'false').lower() == 'true':
+            alerts = supabase_service.get_active_alerts(patient_id)
+        elif request.args.get('include_archived', 'false').lower() == 'true':
+            alerts = archive_service.get_patient_alerts(patient_id)
+        else:
+            alerts = supabase_service.get_patient_alerts(patient_id)
+        if alerts is None:
+            return jsonify({'error': 'Failed to load alerts'}), 503
         
         return jsonify({
             'message': 'Alerts retrieved successfully',
@@ -107,5 +246,7 @@ def get_patient_alerts(patient_id):
             'alerts': alerts
         }), 200
     
+    except DependencyUnavailable:
+        raise
     except Exception as e:
         return jsonify({'error': str(e)}), 500
\ No newline at end of file
@@ -0,0 +1,76 @@
+from functools import wraps
+from datetime import datetime, timezone
+from flask import Blueprint, request, jsonify, Response
+from services.profiling import profiler, folded, call_tree, TOKEN_HEADER
+
+profiling_bp = Blueprint('profiling', __name__)
+
+
+def admin_only(view):
+    """404 unless profiling is enabled and the request carries the admin token"""
+    @wraps(view)
+    def wrapper(*args, **kwargs):
+        if not profiler.authorized(request.headers.get(TOKEN_HEADER)):
+            # Indistinguishable from a route that doesn't exist
+            return jsonify({'error': 'Not found'}), 404
+        return view(*args, **kwargs)
+    return wrapper
+
+
+@profiling_bp.route('/profile', methods=['GET'])
+@admin_only
+def sample_profile():
+    """Sample every thread for ?seconds=N and return collapsed stacks (or ?format=tree)"""
+    seconds = request.args.get('seconds', 10, type=float)
+    interval_ms = request.args.get('interval_ms', type=float)
+    stacks = profiler.sample(seconds, interval_ms / 1000 if interval_ms else None)
+    if stacks is None:
+        return jsonify({'error': 'A profile is already being captured'}), 409
+
+    if request.args.get('format') == 'tree':
+        return Response(call_tree(stacks, min_share=0.01) + '\n', mimetype='text/plain')
+
+    response = Response(folded(stacks), mimetype='text/plain')
+    # Ready for flamegraph.pl / speedscope / inferno-flamegraph
+    filename = f"profile-{datetime.now(timezone.utc):%Y%m%dT%H%M%SZ}.folded"
+    response.headers['Content-Disposition'] = f'attachment; filename="{filename}"'
+    return response
+
+
+@profiling_bp.route('/profiles', methods=['GET'])
+@admin_only
+def list_request_profiles():
+    """Requests captured with the X-Profile header, newest first"""
+    return jsonify({'profiles': profiler.recent(profiler.request_profiles)}), 200
+
+
+@profiling_bp.route('/profiles/<profile_id>', methods=['GET'])
+@admin_only
+def get_request_profile(profile_id):
+    """cProfile stats for one captured request, sorted by cumulative time"""
+    profile = profiler.request_profiles.get(profile_id)
+    if not profile:
+        return jsonify({'error': 'Profile not found'}), 404
+    return Response(profile['stats'], mimetype='text/plain')
+
+
+@profiling_bp.route('/slow', methods=['GET'])
+@admin_only
+def list_slow_requests():
+    """Requests over PROFILING_SLOW_REQUEST_MS, newest first"""
+    return jsonify({
+        'stats': profiler.stats(),
+        'requests': profiler.recent(profiler.slow_requests)
+    }), 200
+
+
+@profiling_bp.route('/slow/<request_id>', methods=['GET'])
+@admin_only
+def get_slow_request(request_id):
+    """Call tree of one slow request, or its collapsed stacks with ?format=folded"""
+    entry = profiler.slow_requests.get(request_id)
+    if not entry:
+        return jsonify({'error': 'Slow request not found'}), 404
+    if request.args.get('format') == 'folded':
+        return Response(entry['folded'], mimetype='text/plain')
+    return Response(entry['call_tree'] + '\n', mimetype='text/plain')
@@ -1,10 +1,48 @@
 from flask import Blueprint, request, jsonify
 from services.rook_service import RookIntegrationService
 from services.supabase_service import SupabaseService
+from services.ingestion_service import IngestionService
+from services.ingestion_queue import IngestionQueue, QueueFullError
+from services.patient_index import patient_index
+from services.measurement_service import measurement_service
+from services import backfill_service
+from services.http_cache import http_cache
+from services.reading_validation import reading_validator
+from services.tenancy import tenant_of
+from services.resilience import DependencyUnavailable
+import os
 
 rook_bp = Blueprint('rook', __name__)
 rook_service = RookIntegrationService()
 supabase_service = SupabaseService()
+ingestion_service = IngestionService(supabase_service)
+
+
+def _payload_tenant(payload):
+    """Clinician a queued payload belongs to, for round-robin and per-tenant caps.
+
+    A cached row (even a stale one) is enough; patients not cached yet are
+    looked up once, so after a restart they still land in their clinician's
+    share rather than all crowding into one 'unknown' tenant. Only users the
+    database doesn't know (or can't be asked about right now) share that one.
+    """
+    rook_user_id = payload.get('user_id')
+    patient = patient_index.peek(rook_user_id)
+    if patient is None and rook_user_id:
+        try:
+            patient = patient_index.get(rook_user_id)
+        except Exception as e:
+            print(f"Error resolving tenant for {rook_user_id}: {e}")
+    return tenant_of(patient)
+
+
+# Queued payloads are served round-robin by clinician
+ingestion_queue = IngestionQueue(ingestion_service.process_batch, tenant_of=_payload_tenant)
+
+# When enabled the webhook only validates and spools the payload, returning 202
+WEBHOOK_ASYNC = os.getenv("ROOK_WEBHOOK_ASYNC", "false").lower() == "true"
+if WEBHOOK_ASYNC:
+    ingestion_queue.start()
 
 @rook_bp.route('/initialize/<patient_id>', methods=['POST'])
 def initialize_rook(patient_id):
@@ -15,13 +53,25 @@ def initialize_rook(patient_id):
         if not patient:
             return jsonify({'error': 'Patient not found'}), 404
         
-        # Create Rook user
+        # Already initialized: hand back the existing user instead of creating another
+        if patient.get('rook_user_id'):
+            return jsonify({
+                'message': 'Rook already initialized',
+                'patient_id': patient_id,
+                'rook_user_id': patient['rook_user_id'],
+                'connection_code': rook_service.get_connection_code(patient['rook_user_id']),
+                'instructions': 'Use this connection code to connect your health device/app in the Rook app'
+            }), 200
+        
+        # Create Rook user (idempotent per patient ID)
         rook_data = rook_service.create_user(patient_id, patient['email'])
         if not rook_data:
             return jsonify({'error': 'Failed to initialize Rook'}), 500
         
         # Update patient with rook_user_id
-        supabase_service.update_patient_rook_id(patient_id, rook_data['rook_user_id'])
+        updated = supabase_service.update_patient_rook_id(patient_id, rook_data['rook_user_id'])
+        patient_index.add(updated)
+        http_cache.bump_patient(patient_id, patient['clinician_id'])
         
         return jsonify({
             'message': 'Rook initialized successfully',
@@ -31,6 +81,8 @@ def initialize_rook(patient_id):
             'instructions': 'Use this connection code to connect your health device/app in the Rook app'
         }), 200
     
+    except DependencyUnavailable:
+        raise
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
@@ -49,6 +101,8 @@ def get_connection_code(rook_user_id):
         else:
             return jsonify({'error': 'Failed to get connection code'}), 500
     
+    except DependencyUnavailable:
+        raise
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
@@ -66,6 +120,8 @@ def sync_data(rook_user_id):
         else:
             return jsonify({'error': 'Failed to trigger sync'}), 500
     
+    except DependencyUnavailable:
+        raise
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
@@ -84,83 +140,99 @@ def get_latest_reading(rook_user_id):
         else:
             return jsonify({'error': 'No readings found'}), 404
     
+    except DependencyUnavailable:
+        raise
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
 
+@rook_bp.route('/backfill/<patient_id>', methods=['POST'])
+def start_backfill(patient_id):
+    """Import a patient's Rook history in the background (resumes an earlier run)"""
+    try:
+        patient = supabase_service.get_patient(patient_id)
+        if not patient:
+            return jsonify({'error': 'Patient not found'}), 404
+        if not patient.get('rook_user_id'):
+            return jsonify({'error': 'Patient has no Rook user'}), 400
+        
+        backfill_service.start_patient_backfill(patient)
+        
+        return jsonify({
+            'message': 'Backfill started',
+            'patient_id': patient_id
+        }), 202
+    
+    except DependencyUnavailable:
+        raise
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+
+@rook_bp.route('/backfill/<patient_id>', methods=['GET'])
+def get_backfill(patient_id):
+    """Progress of a patient's history import"""
+    try:
+        state = backfill_service.load_patient_backfill(patient_id)
+        
+        if state is None:
+            return jsonify({'error': 'No backfill for this patient'}), 404
+        
+        return jsonify({
+            'message': 'Backfill retrieved successfully',
+            'patient_id': patient_id,
+            **state
+        }), 200
+    
+    except ValueError as e:
+        return jsonify({'error': f'Invalid input: {e}'}), 400
+    except DependencyUnavailable:
+        raise
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
 @rook_bp.route('/webhook', methods=['POST'])
 def rook_webhook():
     """Webhook to receive real-time data from Rook"""
     try:
-        data = request.get_json()
+        data = request.get_json(silent=True)
+        
+        if not isinstance(data, dict) or not data.get('user_id') or not data.get('event_type'):
+            return jsonify({'error': 'Invalid webhook payload'}), 400
+        
+        # Fast-ack mode: spool the payload and let the workers do the rest
+        if WEBHOOK_ASYNC:
+            try:
+                ingestion_queue.enqueue(data)
+            except QueueFullError:
+                response = jsonify({'error': 'Webhook queue is full, retry later'})
+                response.headers['Retry-After'] = '1'
+                return response, 429
+            return jsonify({'message': 'Webhook accepted'}), 202
+        
         print(f"Rook webhook received: {data}")
+        summary = ingestion_service.process_batch([data])
         
-        rook_user_id = data.get('user_id')
-        event_type = data.get('event_type')
-        payload = data.get('payload', {})
-        
-        if event_type == 'blood_pressure_updated':
-            # Get patient by rook_user_id
-            patient = supabase_service.get_patient_by_rook_id(rook_user_id)
-            if not patient:
-                return jsonify({'error': 'Patient not found'}), 404
-            
-            # Extract blood pressure data
-            blood_pressure = payload.get('blood_pressure', {})
-            systolic = blood_pressure.get('systolic')
-            diastolic = blood_pressure.get('diastolic')
-            heart_rate = blood_pressure.get('heart_rate', 0)
-            
-            if systolic and diastolic:
-                # Create reading from Rook data
-                from models import Reading, Alert
-                from datetime import datetime
-                
-                reading = Reading(
-                    patient_id=patient['id'],
-                    systolic=systolic,
-                    diastolic=diastolic,
-                    heart_rate=heart_rate,
-                    source='rook'
-                )
-                
-                result = supabase_service.add_reading(reading)
-                
-                if result:
-                    # Check thresholds and create alert if needed
-                    if (systolic > patient['systolic_threshold'] or 
-                        diastolic > patient['diastolic_threshold']):
-                        
-                        from services.twilio_service import TwilioService
-                        twilio_service = TwilioService()
-                        
-                        alert_type = 'high_systolic' if systolic > patient['systolic_threshold'] else 'high_diastolic'
-                        alert_message = (
-                            f"🚨 High Blood Pressure Alert!\n"
-                            f"Patient: {patient['name']}\n"
-                            f"Systolic: {systolic} mmHg\n"
-                            f"Diastolic: {diastolic} mmHg\n"
-                            f"Heart Rate: {heart_rate} bpm\n"
-                            f"Time: {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}"
-                        )
-                        
-                        alert = Alert(
-                            patient_id=patient['id'],
-                            reading_id=result['id'],
-                            alert_type=alert_type,
-                            message=alert_message
-                        )
-                        
-                        supabase_service.add_alert(alert)
-                        twilio_service.send_whatsapp_alert(patient['phone_number'], alert_message)
-                        
-                        print(f"Alert sent to {patient['name']}")
-        
-        elif event_type == 'user_disconnected':
-            print(f"User {rook_user_id} disconnected from Rook")
-        
-        return jsonify({'message': 'Webhook processed'}), 200
+        if summary['unknown_users']:
+            return jsonify({'error': 'Patient not found'}), 404
+        
+        # Invalid device data is acknowledged (a retry wouldn't fix it) but reported
+        return jsonify({'message': 'Webhook processed', 'rejected': summary['rejected']}), 200
     
+    except DependencyUnavailable:
+        raise
     except Exception as e:
         print(f"Webhook error: {e}")
-        return jsonify({'error': str(e)}), 500
\ No newline at end of file
+        return jsonify({'error': str(e)}), 500
+
+
+@rook_bp.route('/webhook/stats', methods=['GET'])
+def webhook_stats():
+    """Ingestion queue depth, throughput and lag"""
+    return jsonify({
+        'async': WEBHOOK_ASYNC,
+        'queue': ingestion_queue.stats(),
+        'patient_index': patient_index.stats(),
+        'measurements': measurement_service.stats(),
+        'validation': reading_validator.stats()
+    }), 200
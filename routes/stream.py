@@ -0,0 +1,42 @@
+from flask import Blueprint, Response, jsonify, stream_with_context
+from services.event_bus import event_bus
+import json
+import os
+
+stream_bp = Blueprint('stream', __name__)
+
+# Comment frames keep proxies from closing idle connections
+HEARTBEAT_SECONDS = float(os.getenv("STREAM_HEARTBEAT_SECONDS", "15"))
+
+
+@stream_bp.route('/clinician/<clinician_id>', methods=['GET'])
+def stream_clinician_events(clinician_id):
+    """Server-Sent Events stream of new readings and alerts for a clinician's patients"""
+    subscription = event_bus.subscribe(clinician_id)
+
+    def generate():
+        try:
+            yield "retry: 3000\n\n"
+            while True:
+                event = subscription.get(timeout=HEARTBEAT_SECONDS)
+                if event is None:
+                    yield ": keepalive\n\n"
+                    continue
+                yield (
+                    f"id: {event['id']}\n"
+                    f"event: {event['type']}\n"
+                    f"data: {json.dumps(event['data'], default=str)}\n\n"
+                )
+        finally:
+            subscription.close()
+
+    response = Response(stream_with_context(generate()), mimetype='text/event-stream')
+    response.headers['Cache-Control'] = 'no-cache'
+    response.headers['X-Accel-Buffering'] = 'no'
+    return response
+
+
+@stream_bp.route('/stats', methods=['GET'])
+def stream_stats():
+    """Subscriber counts and buffer usage"""
+    return jsonify(event_bus.stats()), 200
@@ -0,0 +1,56 @@
+import os
+import threading
+import time
+
+
+class AlertCountCache:
+    """Cached unresolved alert counts per clinician, with a TTL and explicit invalidation"""
+
+    def __init__(self, ttl: float = None):
+        self.ttl = ttl if ttl is not None else float(os.getenv("ALERT_COUNT_TTL_SECONDS", "60"))
+        self._counts = {}
+        self._patient_clinician = {}
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, clinician_id: str, loader):
+        """Counts for a clinician, calling loader(clinician_id) on a miss.
+
+        loader returns a list of {'patient_id', 'open_alerts'} rows.
+        """
+        now = time.monotonic()
+        with self._lock:
+            cached = self._counts.get(clinician_id)
+            if cached and now - cached['loaded_at'] < self.ttl:
+                self.hits += 1
+                return cached['counts']
+            self.misses += 1
+
+        rows = loader(clinician_id)
+        if rows is None:
+            return None
+
+        by_patient = {row['patient_id']: row['open_alerts'] for row in rows}
+        counts = {'total': sum(by_patient.values()), 'by_patient': by_patient}
+        with self._lock:
+            self._counts[clinician_id] = {'counts': counts, 'loaded_at': now}
+            for patient_id in by_patient:
+                self._patient_clinician[patient_id] = clinician_id
+        return counts
+
+    def invalidate(self, clinician_id: str):
+        with self._lock:
+            self._counts.pop(clinician_id, None)
+
+    def invalidate_patients(self, patient_ids):
+        """Drop the cached counts of whichever clinicians own these patients"""
+        with self._lock:
+            for patient_id in patient_ids:
+                clinician_id = self._patient_clinician.get(patient_id)
+                if clinician_id:
+                    self._counts.pop(clinician_id, None)
+
+
+# Shared so alert creation and resolution invalidate the same counts
+alert_count_cache = AlertCountCache()
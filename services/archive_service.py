@@ -0,0 +1,456 @@
+"""Retention for the hot readings and alerts tables.
+
+Rows older than the retention age are rolled up (readings), written to
+compressed columnar files under ARCHIVE_DIR, one file per patient and month,
+and then deleted from Supabase in batches. Archived rows stay readable
+through get_patient_readings/get_patient_alerts below.
+
+Run on a schedule (e.g. nightly cron); re-run with the same --state file to
+resume an interrupted run:
+    python -m services.archive_service [--table readings|alerts] [--older-than-days N]
+        [--state archive_state.json]
+
+Each patient's files are listed in a small manifest next to them; after
+copying or restoring archive files by hand, recreate the manifests with
+    python -m services.archive_service --rebuild-manifests
+
+Archive files are only on disk, so ARCHIVE_DIR must be the same directory
+for every process that archives or reads archived rows: shared storage
+mounted on every host, or a single host. The first run registers the ID in
+ARCHIVE_DIR/.store_id with the database (migration 014); a process whose
+ARCHIVE_DIR holds another ID, or none, refuses to archive and answers
+archive reads with ArchiveUnavailable (503) rather than partial results.
+When archive files predate the registration, run the first archive job
+where those files are.
+"""
+from datetime import datetime, timedelta, timezone
+import argparse
+import glob
+import gzip
+import json
+import os
+import re
+import time
+import uuid
+
+from dotenv import load_dotenv
+load_dotenv()
+
+from services.http_cache import http_cache
+from services.rollup_service import RollupService, bucket_start, parse_timestamp, rollup_service
+from services.resilience import DependencyUnavailable
+from services.supabase_service import SupabaseService
+
+# Parquet when pyarrow is installed, otherwise zstd-compressed column JSON
+# (gzip if zstandard isn't installed either)
+try:
+    import pyarrow
+    import pyarrow.parquet
+except ImportError:
+    pyarrow = None
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+TABLES = ('alerts', 'readings')
+
+
+class ArchiveUnavailable(DependencyUnavailable):
+    """Raised when this process can't see the archive the database's rows were moved to"""
+
+
+def retention_days(table: str):
+    return int(os.getenv(f"ARCHIVE_{table.upper()}_AFTER_DAYS", "365"))
+
+
+# Columnar files
+def write_columnar(path_base: str, rows: list):
+    """Write rows column by column; returns the path written"""
+    os.makedirs(os.path.dirname(path_base), exist_ok=True)
+    archive_format = os.getenv("ARCHIVE_FORMAT", "auto")
+
+    if pyarrow is not None and archive_format in ('auto', 'parquet'):
+        path = f"{path_base}.parquet"
+        pyarrow.parquet.write_table(pyarrow.Table.from_pylist(rows), f"{path}.tmp", compression='zstd')
+    else:
+        columns = list(rows[0]) if rows else []
+        payload = json.dumps({
+            'columns': columns,
+            'data': {column: [row.get(column) for row in rows] for column in columns}
+        }, default=str).encode()
+        if zstandard is not None:
+            path = f"{path_base}.json.zst"
+            payload = zstandard.ZstdCompressor(level=10).compress(payload)
+        else:
+            path = f"{path_base}.json.gz"
+            payload = gzip.compress(payload)
+        with open(f"{path}.tmp", 'wb') as f:
+            f.write(payload)
+
+    os.replace(f"{path}.tmp", path)
+    return path
+
+
+def read_columnar(path: str):
+    """Rows from a file written by write_columnar"""
+    if path.endswith('.parquet'):
+        if pyarrow is None:
+            raise RuntimeError(f"pyarrow is required to read {path}")
+        return pyarrow.parquet.read_table(path).to_pylist()
+
+    with open(path, 'rb') as f:
+        payload = f.read()
+    if path.endswith('.zst'):
+        if zstandard is None:
+            raise RuntimeError(f"zstandard is required to read {path}")
+        payload = zstandard.ZstdDecompressor().decompress(payload)
+    else:
+        payload = gzip.decompress(payload)
+    data = json.loads(payload)
+    columns = [data['data'][column] for column in data['columns']]
+    return [dict(zip(data['columns'], values)) for values in zip(*columns)]
+
+
+class ArchiveService:
+    """Moves old rows to archive files and reads them back"""
+
+    def __init__(self, supabase_service: SupabaseService = None, archive_dir: str = None):
+        self.supabase_service = supabase_service or SupabaseService()
+        self.archive_dir = archive_dir or os.getenv("ARCHIVE_DIR", "archive")
+        self.page_size = int(os.getenv("ARCHIVE_PAGE_SIZE", "1000"))
+        self.batch_size = int(os.getenv("ARCHIVE_DELETE_BATCH_SIZE", "500"))
+        self.checkpoint_every = int(os.getenv("ARCHIVE_CHECKPOINT_EVERY", "100"))
+        # How long reads trust the last archive store check
+        self.store_check_interval = float(os.getenv("ARCHIVE_STORE_CHECK_SECONDS", "60"))
+        # 'none' (nothing archived yet), 'local' or 'elsewhere', from the last check
+        self._store = None
+        self._store_checked_at = 0.0
+
+    # Archive store: the one directory every host must share
+    def _local_store_id(self, create: bool = False):
+        """ID stored in ARCHIVE_DIR, created when asked; None if there is none"""
+        path = os.path.join(self.archive_dir, '.store_id')
+        if os.path.exists(path):
+            with open(path) as f:
+                return f.read().strip()
+        if not create:
+            return None
+        os.makedirs(self.archive_dir, exist_ok=True)
+        store_id = uuid.uuid4().hex
+        with open(f"{path}.tmp", 'w') as f:
+            f.write(store_id)
+        os.replace(f"{path}.tmp", path)
+        return store_id
+
+    def _claim_store(self):
+        """Register ARCHIVE_DIR as the archive, or fail if another directory already is"""
+        local_id = self._local_store_id(create=True)
+        registered = self.supabase_service.claim_archive_store(local_id)
+        if registered is None:
+            raise RuntimeError("Failed to register the archive store")
+        if registered != local_id:
+            raise RuntimeError(f"ARCHIVE_DIR {self.archive_dir} is not the archive this database uses "
+                               f"(store {registered}); mount the shared archive there")
+
+    def _has_archive(self):
+        """Whether anything was archived; raises ArchiveUnavailable if it was, but not into ARCHIVE_DIR"""
+        now = time.monotonic()
+        if self._store is None or now - self._store_checked_at >= self.store_check_interval:
+            registered = self.supabase_service.get_archive_store()
+            if registered is None:
+                raise ArchiveUnavailable("Failed to look up the archive store")
+            if not registered:
+                self._store = 'none'
+            else:
+                self._store = 'local' if registered == self._local_store_id() else 'elsewhere'
+            self._store_checked_at = now
+        if self._store == 'elsewhere':
+            raise ArchiveUnavailable(f"The archive isn't mounted at {self.archive_dir} on this host")
+        return self._store == 'local'
+
+    # Archiving
+    def run(self, tables=TABLES, older_than_days: int = None, state_path: str = 'archive_state.json'):
+        """Archive every patient's old rows; alerts first, since they pin readings.
+
+        Patients are handled in ID order, checkpoint_every at a time: the
+        batch's files are written (and checkpointed) before any of its rows
+        are deleted, and the checkpoint only keeps the last finished patient
+        ID plus the batch in flight.
+        """
+        started = time.monotonic()
+        self._claim_store()
+        state = self._load_state(state_path)
+        totals = {'archived': 0, 'deleted': 0}
+
+        for table in tables:
+            days = older_than_days if older_than_days is not None else retention_days(table)
+            # Whole days, so rollup buckets are never split by the cutoff
+            cutoff = bucket_start(datetime.now(timezone.utc) - timedelta(days=days), 'day')
+            run_state = state.setdefault(table, {})
+            if run_state.get('cutoff') != cutoff.isoformat() or 'batch' not in run_state:
+                run_state.clear()
+                run_state.update({'cutoff': cutoff.isoformat(), 'after': None, 'batch': {}})
+
+            while True:
+                batch = run_state['batch']
+                if not batch:
+                    ids = self.supabase_service.get_patient_ids(0, self.checkpoint_every, run_state['after'])
+                    if ids is None:
+                        raise RuntimeError("Failed to list patients")
+                    if not ids:
+                        break
+                    batch = run_state['batch'] = {patient_id: {'status': 'pending', 'files': []} for patient_id in ids}
+
+                totals['archived'] += self._write_batch(table, batch, cutoff)
+                self._save_state(state_path, state)
+                totals['deleted'] += self._delete_batch(table, batch)
+                run_state['after'] = list(batch)[-1]
+                run_state['batch'] = {}
+                self._save_state(state_path, state)
+
+        elapsed = time.monotonic() - started
+        rate = totals['archived'] / elapsed if elapsed else 0
+        print(f"Archived {totals['archived']} rows and deleted {totals['deleted']} in {elapsed:.1f}s "
+              f"({rate:.0f} rows/sec)")
+        return {**totals, 'elapsed_seconds': round(elapsed, 2), 'rows_per_second': round(rate, 1)}
+
+    def _write_batch(self, table, batch, cutoff):
+        """Write archive files for the batch's pending patients; returns the rows archived"""
+        archived = 0
+        for patient_id, progress in batch.items():
+            if progress['status'] != 'pending':
+                continue
+            rows = self._archivable(table, patient_id, cutoff)
+            if rows and table == 'readings':
+                self._ensure_rollups(patient_id, rows, cutoff)
+            progress['files'] = self._write(table, patient_id, rows, cutoff)
+            progress['archived'] = len(rows)
+            progress['status'] = 'written'
+            archived += len(rows)
+
+        if table == 'readings':
+            # Raised before anything is deleted, so backfill never re-imports
+            # archived history and charts switch to rollups for those days
+            watermarks = [{'patient_id': patient_id, 'readings_archived_before': cutoff.isoformat()}
+                          for patient_id, progress in batch.items() if progress.get('archived')]
+            if self.supabase_service.set_archive_watermarks(watermarks) is None:
+                raise RuntimeError("Failed to set archive watermarks")
+        return archived
+
+    def _delete_batch(self, table, batch):
+        """Delete the archived rows of the batch's written patients; returns the rows deleted"""
+        deleted = 0
+        for patient_id, progress in batch.items():
+            if progress['status'] != 'written':
+                continue
+            progress['deleted'] = self._delete(table, progress['files'])
+            progress['status'] = 'done'
+            deleted += progress['deleted']
+            if progress['deleted']:
+                http_cache.bump_patient(patient_id)
+        return deleted
+
+    def _archivable(self, table, patient_id, cutoff):
+        rows, offset = [], 0
+        while True:
+            page = self.supabase_service.get_archivable_rows(table, patient_id, cutoff.isoformat(),
+                                                             offset, self.page_size)
+            if page is None:
+                raise RuntimeError(f"Failed to read {table} for patient {patient_id}")
+            rows.extend(page)
+            if len(page) < self.page_size:
+                return rows
+            offset += len(page)
+
+    def _ensure_rollups(self, patient_id, rows, cutoff):
+        """Fill in rollup buckets for days that don't have one before the raw rows go.
+
+        Days that already have rollups were maintained on ingest (or by an
+        earlier run) and are left alone. A missing day is built from every hot
+        reading of that day, including ones an open alert keeps out of this
+        run, so the bucket is complete when created and never needs adding to.
+        """
+        existing = self.supabase_service.get_reading_rollups(patient_id, 'day', None, cutoff.isoformat())
+        if existing is None:
+            raise RuntimeError(f"Failed to read rollups for patient {patient_id}")
+        covered = {parse_timestamp(row['bucket_start']) for row in existing}
+        missing = {bucket_start(parse_timestamp(row['created_at']), 'day') for row in rows} - covered
+        if not missing:
+            return
+
+        buckets, offset = {}, 0
+        while True:
+            page = self.supabase_service.get_readings_page(
+                patient_id, min(missing).isoformat(), cutoff.isoformat(), offset, self.page_size,
+                "patient_id, systolic, diastolic, heart_rate, created_at"
+            )
+            if page is None:
+                raise RuntimeError(f"Failed to read readings for patient {patient_id}")
+            RollupService.aggregate(
+                [row for row in page if bucket_start(parse_timestamp(row['created_at']), 'day') in missing], buckets
+            )
+            if len(page) < self.page_size:
+                break
+            offset += len(page)
+
+        rows = list(buckets.values())
+        for i in range(0, len(rows), self.page_size):
+            if not self.supabase_service.merge_reading_rollups(rows[i:i + self.page_size], replace=True):
+                raise RuntimeError(f"Failed to write rollups for patient {patient_id}")
+
+    def _write(self, table, patient_id, rows, cutoff):
+        """One file per month; the cutoff in the name keeps separate runs apart"""
+        months = {}
+        for row in rows:
+            months.setdefault(parse_timestamp(row['created_at']).strftime('%Y-%m'), []).append(row)
+        files = [
+            write_columnar(os.path.join(self.archive_dir, table, month, f"{patient_id}.{cutoff:%Y%m%d}"), month_rows)
+            for month, month_rows in sorted(months.items())
+        ]
+        if files:
+            self._add_to_manifest(table, patient_id, files)
+        return files
+
+    def _delete(self, table, files):
+        """Delete exactly the rows in the archive files, in batches"""
+        ids = [row['id'] for path in files for row in read_columnar(path)]
+        deleted = 0
+        for i in range(0, len(ids), self.batch_size):
+            count = self.supabase_service.delete_archived_rows(table, ids[i:i + self.batch_size])
+            if count is None:
+                raise RuntimeError(f"Failed to delete archived {table}")
+            deleted += count
+        return deleted
+
+    @staticmethod
+    def _load_state(state_path):
+        if os.path.exists(state_path):
+            with open(state_path) as f:
+                return json.load(f)
+        return {}
+
+    @staticmethod
+    def _save_state(state_path, state):
+        tmp_path = f"{state_path}.tmp"
+        with open(tmp_path, 'w') as f:
+            json.dump(state, f)
+        os.replace(tmp_path, state_path)
+
+    # Manifests: per patient, which archive files exist for which month, so
+    # reads open one small file instead of listing every month directory
+    def _manifest_path(self, table, patient_id):
+        return os.path.join(self.archive_dir, table, '_manifests', f"{patient_id}.json")
+
+    def _manifest(self, table, patient_id):
+        """{month: [path, ...]} of a patient's archive files"""
+        path = self._manifest_path(table, patient_id)
+        if not os.path.exists(path):
+            return {}
+        with open(path) as f:
+            return {month: [os.path.join(self.archive_dir, name) for name in names]
+                    for month, names in json.load(f).items()}
+
+    def _save_manifest(self, table, patient_id, months):
+        path = self._manifest_path(table, patient_id)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        relative = {month: sorted(set(os.path.relpath(name, self.archive_dir) for name in names))
+                    for month, names in months.items()}
+        with open(f"{path}.tmp", 'w') as f:
+            json.dump(relative, f)
+        os.replace(f"{path}.tmp", path)
+
+    def _add_to_manifest(self, table, patient_id, files):
+        months = self._manifest(table, patient_id)
+        for path in files:
+            months.setdefault(os.path.basename(os.path.dirname(path)), []).append(path)
+        self._save_manifest(table, patient_id, months)
+
+    def rebuild_manifests(self, tables=TABLES):
+        """Recreate every manifest from the archive directories"""
+        for table in tables:
+            patients = {}
+            for path in glob.glob(os.path.join(self.archive_dir, table, '*', '*')):
+                month = os.path.basename(os.path.dirname(path))
+                if path.endswith('.tmp') or not re.fullmatch(r'\d{4}-\d{2}', month):
+                    continue
+                patient_id = os.path.basename(path).split('.', 1)[0]
+                patients.setdefault(patient_id, {}).setdefault(month, []).append(path)
+            for patient_id, months in patients.items():
+                self._save_manifest(table, patient_id, months)
+            print(f"Rebuilt {len(patients)} {table} manifests")
+
+    # Reading back
+    def read(self, table: str, patient_id: str, start: str = None, end: str = None, limit: int = None):
+        """A patient's archived rows in [start, end), newest first.
+
+        Only months overlapping the range are opened, newest first, stopping
+        once limit rows are found.
+        """
+        # IDs become file names, so anything but a UUID has no archive
+        if not re.fullmatch(r'[0-9a-fA-F-]+', patient_id or '') or not self._has_archive():
+            return []
+        start_at = parse_timestamp(start) if start else None
+        end_at = parse_timestamp(end) if end else None
+
+        rows = []
+        for month, paths in sorted(self._manifest(table, patient_id).items(), reverse=True):
+            month_start = datetime.strptime(month, '%Y-%m').replace(tzinfo=timezone.utc)
+            month_end = (month_start + timedelta(days=32)).replace(day=1)
+            if (end_at and month_start >= end_at) or (start_at and month_end <= start_at):
+                continue
+            for path in paths:
+                for row in read_columnar(path):
+                    created_at = parse_timestamp(row['created_at'])
+                    if (start_at and created_at < start_at) or (end_at and created_at >= end_at):
+                        continue
+                    rows.append(row)
+            # Every later month in the loop is older than what we already have
+            if limit and len(rows) >= limit:
+                break
+        rows.sort(key=lambda row: str(row['created_at']), reverse=True)
+        return rows[:limit] if limit else rows
+
+    def get_patient_readings(self, patient_id: str, limit: int = 10, start: str = None, end: str = None):
+        """Hot readings, topped up from the archive when they don't fill the request"""
+        readings = self.supabase_service.get_patient_readings(patient_id, limit, start, end)
+        if readings is None:
+            return None
+        if len(readings) >= limit:
+            return readings
+        # Everything left is older than the oldest hot row
+        older_than = readings[-1]['created_at'] if readings else end
+        archived = self.read('readings', patient_id, start, older_than, limit - len(readings))
+        return readings + archived
+
+    def get_patient_alerts(self, patient_id: str):
+        """Hot alerts followed by archived ones; None if the hot read fails"""
+        alerts = self.supabase_service.get_patient_alerts(patient_id)
+        if alerts is None:
+            return None
+        return alerts + self.read('alerts', patient_id)
+
+
+# Shared by the read routes
+archive_service = ArchiveService(rollup_service.supabase_service)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Archive and delete old readings and alerts")
+    parser.add_argument('--table', choices=TABLES, action='append',
+                        help="table to archive (repeatable; default both)")
+    parser.add_argument('--older-than-days', type=int,
+                        help="overrides ARCHIVE_<TABLE>_AFTER_DAYS")
+    parser.add_argument('--state', default='archive_state.json',
+                        help="checkpoint file; re-run with the same file to resume")
+    parser.add_argument('--rebuild-manifests', action='store_true',
+                        help="recreate the per-patient file manifests from the archive directories and exit")
+    args = parser.parse_args()
+
+    # Alerts go first: deleting them is what frees their readings for archiving
+    tables = [table for table in TABLES if not args.table or table in args.table]
+    if args.rebuild_manifests:
+        archive_service.rebuild_manifests(tables)
+    else:
+        archive_service.run(tables, args.older_than_days, args.state)
@@ -0,0 +1,295 @@
+"""Import a patient's full Rook history, not just what arrives by webhook.
+
+Pages through get_health_data for each metric, several patients at a time,
+inserting in chunks and checkpointing the page cursor after each chunk is
+stored, so an interrupted run resumes where it left off:
+    python -m services.backfill_service [--patient ID] [--metrics blood_pressure,steps]
+        [--state backfill_state.json] [--workers 4] [--shard 0/2]
+
+Patients are interleaved by clinician so one large practice doesn't hold every
+worker, and --shard (default WORKER_INDEX/WORKER_COUNT) splits clinicians
+across processes with a consistent hash ring.
+"""
+from concurrent.futures import ThreadPoolExecutor, as_completed
+import argparse
+import json
+import os
+import re
+import threading
+import time
+
+from dotenv import load_dotenv
+load_dotenv()
+
+from services.measurement_service import METRICS, samples_from_payload
+from services.http_cache import http_cache
+from services.rate_limiter import RateLimiter
+from services.reading_validation import ReadingValidator
+from services.rollup_service import parse_timestamp, rollup_service
+from services.rook_service import RookIntegrationService
+from services.supabase_service import SupabaseService
+from services.tenancy import interleave, owns, tenant_metrics, tenant_of
+
+BACKFILL_METRICS = ('blood_pressure',) + tuple(METRICS)
+
+# Separate from the live validator: years-old history must not become the
+# "recent readings" that live outlier detection compares against
+backfill_validator = ReadingValidator(track_history=False)
+
+
+def page_records(data):
+    """Records in one page of a Rook history response"""
+    if not isinstance(data, dict):
+        return []
+    for key in ('readings', 'samples', 'data'):
+        if isinstance(data.get(key), list):
+            return data[key]
+    return []
+
+
+def next_cursor(data):
+    """Cursor for the following page, or None on the last one"""
+    if not isinstance(data, dict):
+        return None
+    pagination = data.get('pagination') or {}
+    return data.get('next_page') or pagination.get('next_page') or pagination.get('next')
+
+
+def reading_rows(patient_id: str, records: list):
+    """readings rows from Rook blood pressure records, skipping undated or invalid ones"""
+    dated = []
+    for record in records:
+        try:
+            dated.append((record, parse_timestamp(record['timestamp']).isoformat()))
+        except (KeyError, TypeError, ValueError):
+            continue
+    if not dated:
+        return []
+
+    result = backfill_validator.validate_batch(
+        [patient_id] * len(dated),
+        [record.get('systolic') for record, _ in dated],
+        [record.get('diastolic') for record, _ in dated],
+        [record.get('heart_rate') for record, _ in dated],
+        [record.get('unit') for record, _ in dated]
+    )
+    return [
+        {'patient_id': patient_id, 'source': 'rook', 'created_at': created_at, **values}
+        for (_, created_at), values in zip(dated, result['values'])
+        if values is not None
+    ]
+
+
+class BackfillJob:
+    """A checkpointed, parallel import of Rook history for a set of patients"""
+
+    def __init__(self, state_path: str, metrics=BACKFILL_METRICS, supabase_service: SupabaseService = None,
+                 rook_service: RookIntegrationService = None, workers: int = None):
+        self.state_path = state_path
+        self.metrics = tuple(metrics)
+        self.supabase_service = supabase_service or SupabaseService()
+        self.rook_service = rook_service or RookIntegrationService()
+        # Rook's bulkhead allows 10 concurrent calls, so stay under it
+        self.workers = workers or int(os.getenv("BACKFILL_WORKERS", "4"))
+        self.page_size = int(os.getenv("BACKFILL_PAGE_SIZE", "500"))
+        self.limiter = RateLimiter(float(os.getenv("ROOK_REQUESTS_PER_SECOND", "5")))
+        self.state = self._load_state()
+        self._lock = threading.Lock()
+
+    # Checkpointing
+    def _load_state(self):
+        if self.state_path and os.path.exists(self.state_path):
+            with open(self.state_path) as f:
+                return json.load(f)
+        return {'status': 'pending', 'patients': {}}
+
+    def save(self):
+        with self._lock:
+            snapshot = json.dumps(self.state)
+        # Workers checkpoint concurrently, so each writes its own temp file before the atomic rename
+        tmp_path = f"{self.state_path}.{threading.get_ident()}.tmp"
+        with open(tmp_path, 'w') as f:
+            f.write(snapshot)
+        os.replace(tmp_path, self.state_path)
+
+    def _progress(self, patient_id, metric):
+        with self._lock:
+            return self.state['patients'][patient_id]['metrics'].setdefault(
+                metric, {'cursor': None, 'done': False, 'fetched': 0, 'imported': 0}
+            )
+
+    # Running
+    def run(self, patients: list):
+        """Backfill patients given as {'id', 'rook_user_id'} dicts"""
+        started = time.monotonic()
+        self.state['status'] = 'running'
+        for patient in patients:
+            self.state['patients'].setdefault(patient['id'], {
+                'rook_user_id': patient['rook_user_id'], 'metrics': {}, 'error': None
+            })
+        self.save()
+
+        with ThreadPoolExecutor(max_workers=self.workers) as executor:
+            futures = {
+                executor.submit(self._backfill_patient, patient['id'], tenant_of(patient)): patient['id']
+                for patient in interleave(patients, tenant_of)
+            }
+            for future in as_completed(futures):
+                patient_id = futures[future]
+                try:
+                    future.result()
+                except Exception as e:
+                    print(f"Backfill failed for patient {patient_id}: {e}")
+                    with self._lock:
+                        self.state['patients'][patient_id]['error'] = str(e)
+                self.save()
+
+        elapsed = time.monotonic() - started
+        imported = sum(progress['imported'] for entry in self.state['patients'].values()
+                       for progress in entry['metrics'].values())
+        failed = sum(1 for entry in self.state['patients'].values() if entry.get('error'))
+        self.state['status'] = 'failed' if failed else 'completed'
+        self.state['elapsed_seconds'] = round(elapsed, 2)
+        self.state['readings_per_second'] = round(imported / elapsed, 1) if elapsed else None
+        self.save()
+
+        print(f"Backfilled {imported} records for {len(patients)} patients in {elapsed:.1f}s "
+              f"({self.state['readings_per_second']} readings/sec, {failed} patients failed)")
+        return self.state
+
+    def _backfill_patient(self, patient_id, tenant_id=None):
+        started = time.monotonic()
+        try:
+            self._backfill_metrics(patient_id)
+        finally:
+            tenant_metrics.record(tenant_id or tenant_of(None), time.monotonic() - started, backfilled_patients=1)
+
+    def _backfill_metrics(self, patient_id):
+        entry = self.state['patients'][patient_id]
+        with self._lock:
+            entry['error'] = None
+        for metric in self.metrics:
+            progress = self._progress(patient_id, metric)
+            while not progress['done']:
+                params = {'page_size': self.page_size}
+                if progress['cursor']:
+                    params['page'] = progress['cursor']
+                data_type = 'blood_pressure' if metric == 'blood_pressure' else METRICS[metric]['rook_data_type']
+
+                self.limiter.acquire()
+                data = self.rook_service.get_health_data(entry['rook_user_id'], data_type, params)
+                if data is None:
+                    raise RuntimeError(f"Failed to fetch {metric} history from Rook")
+
+                records = page_records(data)
+                imported = self._store(patient_id, metric, records)
+
+                # Only advance the cursor once the page is stored
+                with self._lock:
+                    progress['fetched'] += len(records)
+                    progress['imported'] += imported
+                    progress['cursor'] = next_cursor(data)
+                    progress['done'] = not progress['cursor'] or not records
+                self.save()
+
+    def _store(self, patient_id, metric, records):
+        """Insert one page, skipping rows already stored; returns how many were new"""
+        if metric == 'blood_pressure':
+            inserted = self.supabase_service.insert_readings_if_new(reading_rows(patient_id, records))
+            if inserted is None:
+                raise RuntimeError("Failed to store historical readings")
+            # History still belongs in the chart rollups, but is too old to alert on
+            rollup_service.record(inserted)
+            if inserted:
+                http_cache.bump_patient(patient_id)
+            return len(inserted)
+
+        samples = samples_from_payload(metric, records)
+        if not samples:
+            return 0
+        recorded_at, values = (list(column) for column in zip(*samples))
+        stored = self.supabase_service.insert_measurements(
+            [patient_id] * len(samples), [metric] * len(samples), recorded_at, values
+        )
+        if stored is None:
+            raise RuntimeError(f"Failed to store historical {metric} samples")
+        return stored
+
+
+def patients_to_backfill(supabase_service: SupabaseService, patient_id: str = None, page_size: int = 1000):
+    """The given patient, or every patient with a Rook ID"""
+    if patient_id:
+        patient = supabase_service.get_patient(patient_id)
+        if not patient or not patient.get('rook_user_id'):
+            raise ValueError(f"Patient {patient_id} has no Rook user")
+        return [patient]
+
+    patients, offset = [], 0
+    while True:
+        page = supabase_service.get_patients_with_rook_ids(offset, page_size)
+        if page is None:
+            raise RuntimeError("Failed to list patients")
+        patients.extend(page)
+        if len(page) < page_size:
+            return patients
+        offset += len(page)
+
+
+
+def state_path_for(patient_id: str):
+    """Checkpoint file for an API-started backfill of one patient"""
+    if not re.fullmatch(r'[A-Za-z0-9_-]+', patient_id or ''):
+        raise ValueError("Invalid patient ID")
+    state_dir = os.getenv("BACKFILL_STATE_DIR", "backfill_jobs")
+    os.makedirs(state_dir, exist_ok=True)
+    return os.path.join(state_dir, f"{patient_id}.json")
+
+
+def start_patient_backfill(patient: dict):
+    """Backfill (or resume backfilling) one patient in a background thread"""
+    job = BackfillJob(state_path_for(patient['id']))
+
+    def run():
+        try:
+            job.run([patient])
+        except Exception as e:
+            print(f"Backfill for patient {patient['id']} failed: {e}")
+
+    threading.Thread(target=run, name=f"backfill-{patient['id']}", daemon=True).start()
+
+
+def load_patient_backfill(patient_id: str):
+    """Checkpoint state of a patient's backfill, or None if it never ran"""
+    path = state_path_for(patient_id)
+    if not os.path.exists(path):
+        return None
+    with open(path) as f:
+        return json.load(f)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Import Rook history for connected patients")
+    parser.add_argument('--patient')
+    parser.add_argument('--metrics', default=','.join(BACKFILL_METRICS),
+                        help="comma-separated subset of: " + ', '.join(BACKFILL_METRICS))
+    parser.add_argument('--state', default='backfill_state.json',
+                        help="checkpoint file; re-run with the same file to resume")
+    parser.add_argument('--workers', type=int)
+    parser.add_argument('--shard', default=f"{os.getenv('WORKER_INDEX', '0')}/{os.getenv('WORKER_COUNT', '1')}",
+                        help="INDEX/COUNT: only backfill clinicians hashed to this worker")
+    args = parser.parse_args()
+
+    metrics = [metric.strip() for metric in args.metrics.split(',') if metric.strip()]
+    unknown = set(metrics) - set(BACKFILL_METRICS)
+    if unknown:
+        parser.error(f"unknown metrics: {', '.join(sorted(unknown))}")
+    try:
+        shard_index, shard_count = (int(part) for part in args.shard.split('/'))
+    except ValueError:
+        parser.error("--shard must look like INDEX/COUNT")
+
+    job = BackfillJob(args.state, metrics, workers=args.workers)
+    patients = patients_to_backfill(job.supabase_service, args.patient)
+    job.run([patient for patient in patients if owns(tenant_of(patient), shard_index, shard_count)])
+    # Push the last rollup buckets before the process exits
+    rollup_service.flush()
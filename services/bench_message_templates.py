@@ -0,0 +1,66 @@
+"""Compare precompiled template rendering with the old per-message f-string.
+
+    python -m services.bench_message_templates --recipients 10000
+"""
+from datetime import datetime
+import argparse
+import time
+
+from services.message_templates import message_templates
+
+
+def fstring_alert(patient, reading):
+    return (
+        f"🚨 High Blood Pressure Alert!\n"
+        f"Patient: {patient['name']}\n"
+        f"Systolic: {reading['systolic']} mmHg\n"
+        f"Diastolic: {reading['diastolic']} mmHg\n"
+        f"Heart Rate: {reading['heart_rate']} bpm\n"
+        f"Time: {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}"
+    )
+
+
+def run(recipients: int, rounds: int):
+    patients = [
+        {'id': f"patient-{i}", 'name': f"Patient {i}", 'phone_number': f"+1555{i:07d}",
+         'locale': 'es' if i % 4 == 0 else 'en'}
+        for i in range(recipients)
+    ]
+    reading = {'systolic': 172, 'diastolic': 104, 'heart_rate': 88}
+
+    # Warm the per-patient bound template cache, as a long-running worker would
+    for patient in patients:
+        message_templates.render_alert(patient, reading)
+
+    timings = {}
+    for name, render in (('f-string', fstring_alert), ('templates', message_templates.render_alert)):
+        best = float('inf')
+        for _ in range(rounds):
+            started = time.perf_counter()
+            for patient in patients:
+                render(patient, reading)
+            best = min(best, time.perf_counter() - started)
+        timings[name] = best
+        print(f"{name:>10}: {recipients} messages in {best * 1000:.1f} ms "
+              f"({best / recipients * 1e6:.2f} µs/message)")
+
+    best = float('inf')
+    pairs = [(patient, reading) for patient in patients]
+    for _ in range(rounds):
+        started = time.perf_counter()
+        message_templates.render_alerts(pairs)
+        best = min(best, time.perf_counter() - started)
+    timings['batch'] = best
+    print(f"{'batch':>10}: {recipients} messages in {best * 1000:.1f} ms "
+          f"({best / recipients * 1e6:.2f} µs/message)")
+
+    print(f"speedup: {timings['f-string'] / timings['templates']:.2f}x per message, "
+          f"{timings['f-string'] / timings['batch']:.2f}x batched")
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Benchmark alert message rendering")
+    parser.add_argument('--recipients', type=int, default=10000)
+    parser.add_argument('--rounds', type=int, default=5)
+    args = parser.parse_args()
+    run(args.recipients, args.rounds)
@@ -0,0 +1,103 @@
+import itertools
+import os
+import threading
+from collections import deque
+
+
+class Subscription:
+    """One subscriber's bounded event buffer; the oldest events drop when it fills"""
+
+    def __init__(self, bus, clinician_id: str, maxsize: int):
+        self.bus = bus
+        self.clinician_id = clinician_id
+        self.events = deque(maxlen=maxsize)
+        self.dropped = 0
+        self.closed = False
+        self._ready = threading.Condition()
+
+    def push(self, event):
+        with self._ready:
+            if len(self.events) == self.events.maxlen:
+                self.dropped += 1
+            self.events.append(event)
+            self._ready.notify()
+
+    def get(self, timeout: float = None):
+        """Next event, or None if nothing arrived within the timeout"""
+        with self._ready:
+            if not self.events and not self.closed:
+                self._ready.wait(timeout)
+            return self.events.popleft() if self.events else None
+
+    def close(self):
+        with self._ready:
+            self.closed = True
+            self._ready.notify_all()
+        self.bus.unsubscribe(self)
+
+
+class EventBus:
+    """In-process pub/sub fan-out of reading and alert events, keyed by clinician"""
+
+    def __init__(self, buffer_size: int = None):
+        self.buffer_size = buffer_size or int(os.getenv("EVENT_BUFFER_SIZE", "256"))
+        self._subscribers = {}
+        self._lock = threading.Lock()
+        self._ids = itertools.count(1)
+        self.published_total = 0
+
+    def subscribe(self, clinician_id: str):
+        subscription = Subscription(self, clinician_id, self.buffer_size)
+        with self._lock:
+            self._subscribers.setdefault(clinician_id, set()).add(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription: Subscription):
+        with self._lock:
+            subscribers = self._subscribers.get(subscription.clinician_id)
+            if subscribers:
+                subscribers.discard(subscription)
+                if not subscribers:
+                    del self._subscribers[subscription.clinician_id]
+
+    def publish(self, clinician_id: str, event_type: str, data: dict):
+        """Deliver an event to every subscriber of the clinician's panel"""
+        with self._lock:
+            subscribers = list(self._subscribers.get(clinician_id, ()))
+            self.published_total += 1
+        if not subscribers:
+            return 0
+
+        event = {'id': next(self._ids), 'type': event_type, 'data': data}
+        for subscription in subscribers:
+            subscription.push(event)
+        return len(subscribers)
+
+    def publish_reading(self, patient: dict, reading: dict):
+        return self.publish(patient.get('clinician_id'), 'reading', {
+            'patient_id': patient['id'],
+            'patient_name': patient.get('name'),
+            'reading': reading
+        })
+
+    def publish_alert(self, patient: dict, alert: dict):
+        return self.publish(patient.get('clinician_id'), 'alert', {
+            'patient_id': patient['id'],
+            'patient_name': patient.get('name'),
+            'alert': alert
+        })
+
+    def stats(self):
+        with self._lock:
+            subscriptions = [s for subscribers in self._subscribers.values() for s in subscribers]
+            return {
+                'clinicians': len(self._subscribers),
+                'subscribers': len(subscriptions),
+                'published_total': self.published_total,
+                'buffered': sum(len(s.events) for s in subscriptions),
+                'dropped_total': sum(s.dropped for s in subscriptions),
+            }
+
+
+# Shared by the ingestion paths and the stream endpoint
+event_bus = EventBus()
@@ -0,0 +1,188 @@
+"""ETag / Last-Modified support for patient and history reads.
+
+Every write that changes what a patient's endpoints return bumps a version
+counter for that patient (and for the clinician, when their patient list
+changes). A conditional GET whose validator matches the current version is
+answered with 304 before the view runs, so it never reaches Supabase.
+
+Counters are per process by default. With several workers set
+HTTP_CACHE_DB_PATH so they share counters through SQLite; otherwise a
+worker that didn't see a write could answer 304 for stale data.
+"""
+from datetime import datetime, timezone
+from email.utils import format_datetime, parsedate_to_datetime
+from functools import wraps
+import hashlib
+import math
+import os
+import sqlite3
+import threading
+import time
+import uuid
+
+from flask import request, make_response
+
+
+# Modification times are whole seconds, as in Last-Modified, and each bump
+# moves them forward at least one second, so If-Modified-Since can't miss a
+# second write within the same second.
+
+
+class MemoryVersionStore:
+    """Version counters for this process; the epoch changes on every restart"""
+
+    def __init__(self):
+        self.epoch = uuid.uuid4().hex[:8]
+        self._versions = {}
+        self._started = math.floor(time.time())
+        self._lock = threading.Lock()
+
+    def get(self, key: str):
+        with self._lock:
+            return self._versions.get(key, (0, self._started))
+
+    def bump(self, keys):
+        now = math.ceil(time.time())
+        with self._lock:
+            for key in keys:
+                version, updated = self._versions.get(key, (0, self._started))
+                self._versions[key] = (version + 1, max(now, updated + 1))
+
+
+class SQLiteVersionStore:
+    """Version counters in a SQLite file shared by every worker process on the host"""
+
+    def __init__(self, path: str):
+        self.connection = sqlite3.connect(path, check_same_thread=False, isolation_level=None, timeout=5)
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.execute("PRAGMA synchronous=NORMAL")
+        self.connection.execute(
+            "CREATE TABLE IF NOT EXISTS versions (key TEXT PRIMARY KEY, version INTEGER NOT NULL, updated REAL NOT NULL)"
+        )
+        # Counters persist with the file, so the epoch does too
+        self.connection.execute(
+            "INSERT OR IGNORE INTO versions (key, version, updated) VALUES ('__epoch__', ?, ?)",
+            (int(time.time()), time.time())
+        )
+        self.epoch = str(self.connection.execute(
+            "SELECT version FROM versions WHERE key = '__epoch__'"
+        ).fetchone()[0])
+        self._started = math.floor(time.time())
+        self._lock = threading.Lock()
+
+    def get(self, key: str):
+        with self._lock:
+            row = self.connection.execute("SELECT version, updated FROM versions WHERE key = ?", (key,)).fetchone()
+        return (row[0], row[1]) if row else (0, self._started)
+
+    def bump(self, keys):
+        now = math.ceil(time.time())
+        with self._lock:
+            self.connection.executemany(
+                "INSERT INTO versions (key, version, updated) VALUES (?, 1, ?) "
+                "ON CONFLICT(key) DO UPDATE SET version = version + 1, "
+                "updated = max(excluded.updated, versions.updated + 1)",
+                [(key, now) for key in keys]
+            )
+
+
+class HttpCache:
+    """Per-patient/per-clinician versions and the conditional GET decorator built on them"""
+
+    def __init__(self, store=None):
+        db_path = os.getenv("HTTP_CACHE_DB_PATH")
+        self.store = store or (SQLiteVersionStore(db_path) if db_path else MemoryVersionStore())
+        self.max_age = int(os.getenv("HTTP_CACHE_MAX_AGE_SECONDS", "0"))
+        self.not_modified = 0
+        self.full_responses = 0
+
+    # Versions
+    def bump_patient(self, patient_id: str, clinician_id: str = None):
+        """Call after a write that changes a patient's readings, alerts or record"""
+        try:
+            keys = [f"patient:{patient_id}"]
+            if clinician_id:
+                keys.append(f"clinician:{clinician_id}")
+            self.store.bump(keys)
+        except Exception as e:
+            print(f"Error bumping cache version: {e}")
+
+    def bump_patients(self, patient_ids):
+        try:
+            self.store.bump([f"patient:{patient_id}" for patient_id in set(patient_ids)])
+        except Exception as e:
+            print(f"Error bumping cache versions: {e}")
+
+    def bump_clinician(self, clinician_id: str):
+        """Call after a clinician's patient list changes"""
+        try:
+            self.store.bump([f"clinician:{clinician_id}"])
+        except Exception as e:
+            print(f"Error bumping cache version: {e}")
+
+    # Conditional GETs
+    def _etag(self, version: int):
+        # The query string is part of the representation (limit, active, ...)
+        variant = hashlib.sha1(request.query_string).hexdigest()[:8]
+        return f'W/"{self.store.epoch}-{version}-{variant}"'
+
+    @staticmethod
+    def _not_modified_since(last_modified: datetime):
+        header = request.headers.get('If-Modified-Since')
+        if not header:
+            return False
+        try:
+            return last_modified <= parsedate_to_datetime(header)
+        except (TypeError, ValueError):
+            return False
+
+    def conditional(self, scope):
+        """Decorate a GET view; scope(**view_args) returns the version key, e.g. 'patient:<id>'.
+
+        scope may return None when the key can't be derived cheaply; the view
+        then runs unconditionally. Only 200s are tagged, so views must not
+        answer 200 with a body built from a failed read (the read methods
+        return None on failure and the views answer 503).
+        """
+        def decorator(view):
+            @wraps(view)
+            def wrapper(*args, **kwargs):
+                key = scope(**kwargs)
+                if key is None:
+                    return view(*args, **kwargs)
+
+                # Read the version before the view runs, so a concurrent write
+                # can only make the ETag older than the body, never newer
+                version, updated = self.store.get(key)
+                etag = self._etag(version)
+                last_modified = datetime.fromtimestamp(updated, timezone.utc)
+
+                if_none_match = request.headers.get('If-None-Match')
+                if (if_none_match and etag in [tag.strip() for tag in if_none_match.split(',')]) or \
+                        (not if_none_match and self._not_modified_since(last_modified)):
+                    self.not_modified += 1
+                    response = make_response('', 304)
+                else:
+                    response = make_response(view(*args, **kwargs))
+                    if response.status_code != 200:
+                        return response
+                    self.full_responses += 1
+
+                response.headers['ETag'] = etag
+                response.headers['Last-Modified'] = format_datetime(last_modified, usegmt=True)
+                # Patient data: never in shared caches, and revalidated before reuse
+                response.headers['Cache-Control'] = f"private, max-age={self.max_age}, must-revalidate"
+                return response
+            return wrapper
+        return decorator
+
+    def stats(self):
+        return {
+            'store': type(self.store).__name__,
+            'not_modified': self.not_modified,
+            'full_responses': self.full_responses
+        }
+
+
+# Shared by the write paths that bump versions and the views that check them
+http_cache = HttpCache()
@@ -0,0 +1,417 @@
+import argparse
+import heapq
+import json
+import os
+import random
+import socket
+import sqlite3
+import threading
+import time
+import uuid
+from collections import deque
+
+from services.resilience import CircuitOpenError, BulkheadFullError
+
+
+class QueueFullError(Exception):
+    """Raised when the ingestion queue is at capacity"""
+
+
+class IngestionQueue:
+    """Bounded webhook queue drained in micro-batches by a pool of worker threads.
+
+    Payloads are spooled to SQLite before they are acknowledged so a restart
+    replays anything the workers had not finished. Several processes can share
+    one spool file: each holds a renewed lease on the rows it queued, and only
+    rows whose owner stopped renewing are claimed and replayed by another
+    process (or by the restarted one). Failed batches are retried with
+    exponential backoff; payloads that use up their attempts stay in the
+    spool flagged as failed until requeue_failed() (or the CLI below) puts
+    them back. With tenant_of, payloads
+    are queued per tenant and batches are filled round-robin across tenants,
+    so one busy practice can't starve the others.
+    """
+
+    def __init__(self, handler, maxsize: int = None, workers: int = None,
+                 batch_size: int = None, batch_wait: float = None,
+                 spool_path: str = None, max_attempts: int = None,
+                 tenant_of=None, tenant_maxsize: int = None):
+        self.handler = handler
+        self.tenant_of = tenant_of or (lambda payload: None)
+        self.maxsize = maxsize or int(os.getenv("INGEST_QUEUE_MAXSIZE", "10000"))
+        self.workers = workers or int(os.getenv("INGEST_WORKERS", "4"))
+        self.batch_size = batch_size or int(os.getenv("INGEST_BATCH_SIZE", "100"))
+        self.batch_wait = batch_wait if batch_wait is not None else \
+            int(os.getenv("INGEST_BATCH_WAIT_MS", "50")) / 1000
+        self.max_attempts = max_attempts or int(os.getenv("INGEST_MAX_ATTEMPTS", "5"))
+        self.retry_base = float(os.getenv("INGEST_RETRY_BASE_SECONDS", "1"))
+        self.retry_max = float(os.getenv("INGEST_RETRY_MAX_SECONDS", "60"))
+        self.spool_path = spool_path if spool_path is not None else \
+            os.getenv("INGEST_SPOOL_PATH", "ingest_spool.db")
+        self.lease_seconds = float(os.getenv("INGEST_SPOOL_LEASE_SECONDS", "30"))
+        # Unique per process start, so a restarted worker never mistakes old rows for its own
+        self.owner = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+        # Share of the queue one tenant may fill; defaults to the whole queue
+        self.tenant_maxsize = tenant_maxsize or int(os.getenv("INGEST_TENANT_MAXSIZE", str(self.maxsize)))
+
+        # tenant -> deque of items; _turns holds tenants with items, in serving order
+        self._queues = {}
+        self._turns = deque()
+        self._depth = 0
+        # Items waiting out a retry backoff: heap of (not_before, seq, item)
+        self._delayed = []
+        self._delayed_seq = 0
+        self._lock = threading.Lock()
+        self._not_empty = threading.Condition(self._lock)
+        self._threads = []
+        self._running = False
+        self._spool = None
+        self._spool_lock = threading.Lock()
+
+        self.enqueued_total = 0
+        self.processed_total = 0
+        self.rejected_total = 0
+        self.tenant_rejected_total = 0
+        self.failed_total = 0
+        self.retried_total = 0
+        self.claimed_total = 0
+        self.batches_total = 0
+        self.last_batch_size = 0
+        self.last_lag = 0.0
+        self.max_lag = 0.0
+
+    # Lifecycle
+    def start(self):
+        """Open the spool, replay pending payloads and start the workers"""
+        with self._lock:
+            if self._running:
+                return
+            self._running = True
+
+        if self.spool_path:
+            self._open_spool()
+            self._claim_expired()
+            if self._spool:
+                thread = threading.Thread(target=self._keep_lease, name="ingest-spool-lease", daemon=True)
+                thread.start()
+                self._threads.append(thread)
+
+        for i in range(self.workers):
+            thread = threading.Thread(target=self._worker, name=f"ingest-worker-{i}", daemon=True)
+            thread.start()
+            self._threads.append(thread)
+
+        print(f"Ingestion queue started with {self.workers} workers (capacity {self.maxsize})")
+
+    def stop(self, timeout: float = 5.0):
+        """Stop the workers; anything still queued stays in the spool"""
+        with self._not_empty:
+            self._running = False
+            self._not_empty.notify_all()
+        for thread in self._threads:
+            thread.join(timeout)
+        self._threads = []
+
+    # Per-tenant queues (callers hold self._lock)
+    def _push(self, item):
+        queue = self._queues.get(item['tenant'])
+        if queue is None:
+            queue = self._queues[item['tenant']] = deque()
+            self._turns.append(item['tenant'])
+        queue.append(item)
+        self._depth += 1
+
+    def _pop(self):
+        """Next item from the tenant whose turn it is"""
+        tenant = self._turns.popleft()
+        queue = self._queues[tenant]
+        item = queue.popleft()
+        if queue:
+            self._turns.append(tenant)
+        else:
+            del self._queues[tenant]
+        self._depth -= 1
+        return item
+
+    # Producer side
+    def enqueue(self, payload: dict):
+        """Spool and queue a payload, raising QueueFullError when at capacity"""
+        tenant = self.tenant_of(payload)
+        with self._lock:
+            if self._depth + len(self._delayed) >= self.maxsize:
+                self.rejected_total += 1
+                raise QueueFullError(f"Ingestion queue is full ({self.maxsize})")
+            if len(self._queues.get(tenant, ())) >= self.tenant_maxsize:
+                self.rejected_total += 1
+                self.tenant_rejected_total += 1
+                raise QueueFullError(f"Ingestion queue share for this tenant is full ({self.tenant_maxsize})")
+
+        enqueued_at = time.time()
+        spool_id = self._spool_insert(payload, enqueued_at)
+
+        with self._not_empty:
+            self._push({
+                'spool_id': spool_id,
+                'payload': payload,
+                'tenant': tenant,
+                'enqueued_at': enqueued_at,
+                'attempts': 0,
+            })
+            self.enqueued_total += 1
+            self._not_empty.notify()
+
+    # Consumer side
+    def _next_batch(self):
+        """Block for the first item, then gather up to batch_size within batch_wait"""
+        with self._not_empty:
+            while self._running and not self._release_due():
+                self._not_empty.wait(self._wait_time())
+            if not self._running:
+                return []
+
+            deadline = time.monotonic() + self.batch_wait
+            batch = []
+            while len(batch) < self.batch_size:
+                if self._depth:
+                    batch.append(self._pop())
+                    continue
+                remaining = deadline - time.monotonic()
+                if remaining <= 0 or not self._running:
+                    break
+                self._not_empty.wait(remaining)
+            return batch
+
+    def _release_due(self):
+        """Queue delayed items whose backoff is over; returns the queue depth (caller holds the lock)"""
+        now = time.time()
+        while self._delayed and self._delayed[0][0] <= now:
+            self._push(heapq.heappop(self._delayed)[2])
+        return self._depth
+
+    def _wait_time(self):
+        if not self._delayed:
+            return 1.0
+        return min(1.0, max(self._delayed[0][0] - time.time(), 0.01))
+
+    def _worker(self):
+        while self._running:
+            batch = self._next_batch()
+            if not batch:
+                continue
+
+            started = time.time()
+            try:
+                self.handler([item['payload'] for item in batch])
+            except Exception as e:
+                print(f"Error processing ingestion batch: {e}")
+                self._retry(batch, e)
+                continue
+
+            lag = started - min(item['enqueued_at'] for item in batch)
+            with self._lock:
+                self.processed_total += len(batch)
+                self.batches_total += 1
+                self.last_batch_size = len(batch)
+                self.last_lag = lag
+                self.max_lag = max(self.max_lag, lag)
+
+            self._spool_delete([item['spool_id'] for item in batch])
+
+    def _retry(self, batch, error=None):
+        """Requeue a failed batch after a backoff, flagging items that used up their attempts.
+
+        A dependency that refused the call (open circuit, full bulkhead) says
+        nothing about the payloads, so that doesn't use up an attempt.
+        """
+        refused = isinstance(error, (CircuitOpenError, BulkheadFullError))
+        dead = []
+        with self._not_empty:
+            for item in batch:
+                if not refused:
+                    item['attempts'] += 1
+                if item['attempts'] >= self.max_attempts:
+                    dead.append(item['spool_id'])
+                    continue
+                delay = min(self.retry_base * 2 ** item['attempts'], self.retry_max)
+                delay = max(delay, getattr(error, 'retry_after', 0) or 0)
+                # Jittered so a batch that failed together doesn't retry together
+                not_before = time.time() + delay * random.uniform(0.5, 1.0)
+                self._delayed_seq += 1
+                heapq.heappush(self._delayed, (not_before, self._delayed_seq, item))
+            self.retried_total += len(batch) - len(dead)
+            self.failed_total += len(dead)
+            self._not_empty.notify_all()
+
+        if dead:
+            print(f"Parking {len(dead)} webhook payloads as failed after {self.max_attempts} attempts "
+                  f"(requeue with: python -m services.ingestion_queue requeue-failed)")
+            self._spool_mark_failed(dead)
+
+    # Metrics
+    def stats(self):
+        """Queue depth, throughput counters and lag in seconds"""
+        with self._lock:
+            oldest = min((queue[0]['enqueued_at'] for queue in self._queues.values()), default=None)
+            deepest = sorted(((tenant, len(queue)) for tenant, queue in self._queues.items()),
+                             key=lambda item: item[1], reverse=True)[:10]
+            return {
+                'running': self._running,
+                'workers': self.workers,
+                'depth': self._depth,
+                'retry_pending': len(self._delayed),
+                'capacity': self.maxsize,
+                'tenant_capacity': self.tenant_maxsize,
+                'tenants_queued': len(self._queues),
+                'deepest_tenants': [{'tenant': tenant, 'depth': depth} for tenant, depth in deepest],
+                'durable': self._spool is not None,
+                'enqueued_total': self.enqueued_total,
+                'processed_total': self.processed_total,
+                'rejected_total': self.rejected_total,
+                'tenant_rejected_total': self.tenant_rejected_total,
+                'failed_total': self.failed_total,
+                'retried_total': self.retried_total,
+                'claimed_total': self.claimed_total,
+                'batches_total': self.batches_total,
+                'last_batch_size': self.last_batch_size,
+                'last_lag_seconds': round(self.last_lag, 4),
+                'max_lag_seconds': round(self.max_lag, 4),
+                'oldest_pending_age_seconds': round(time.time() - oldest, 4) if oldest else 0.0,
+            }
+
+    # SQLite spool
+    def _open_spool(self):
+        try:
+            self._spool = sqlite3.connect(self.spool_path, check_same_thread=False, isolation_level=None)
+            self._spool.execute("PRAGMA journal_mode=WAL")
+            self._spool.execute("PRAGMA synchronous=NORMAL")
+            self._spool.execute(
+                "CREATE TABLE IF NOT EXISTS spool ("
+                " id INTEGER PRIMARY KEY AUTOINCREMENT,"
+                " payload TEXT NOT NULL,"
+                " enqueued_at REAL NOT NULL,"
+                " failed INTEGER NOT NULL DEFAULT 0,"
+                " owner TEXT,"
+                " lease_until REAL NOT NULL DEFAULT 0)"
+            )
+            # Spools created before leases existed: their rows are claimable right away
+            columns = {row[1] for row in self._spool.execute("PRAGMA table_info(spool)")}
+            if 'owner' not in columns:
+                self._spool.execute("ALTER TABLE spool ADD COLUMN owner TEXT")
+                self._spool.execute("ALTER TABLE spool ADD COLUMN lease_until REAL NOT NULL DEFAULT 0")
+        except Exception as e:
+            print(f"Error opening ingestion spool, falling back to memory: {e}")
+            self._spool = None
+
+    def _keep_lease(self):
+        """Renew the lease on this process's rows and pick up rows whose owner went away"""
+        while self._running:
+            time.sleep(self.lease_seconds / 3)
+            try:
+                with self._spool_lock:
+                    self._spool.execute(
+                        "UPDATE spool SET lease_until = ? WHERE owner = ? AND failed = 0",
+                        (time.time() + self.lease_seconds, self.owner)
+                    )
+                self._claim_expired()
+            except Exception as e:
+                print(f"Error renewing ingestion spool lease: {e}")
+
+    def _claim_expired(self):
+        """Take over and queue rows whose lease ran out; live workers' rows are left alone"""
+        if not self._spool:
+            return
+        now = time.time()
+        with self._spool_lock:
+            # One write transaction, so two processes can't claim the same row
+            self._spool.execute("BEGIN IMMEDIATE")
+            try:
+                rows = self._spool.execute(
+                    "SELECT id, payload, enqueued_at FROM spool"
+                    " WHERE failed = 0 AND lease_until < ? AND (owner IS NULL OR owner != ?) ORDER BY id",
+                    (now, self.owner)
+                ).fetchall()
+                self._spool.executemany(
+                    "UPDATE spool SET owner = ?, lease_until = ? WHERE id = ?",
+                    [(self.owner, now + self.lease_seconds, spool_id) for spool_id, _, _ in rows]
+                )
+                self._spool.execute("COMMIT")
+            except Exception:
+                self._spool.execute("ROLLBACK")
+                raise
+        if not rows:
+            return
+        with self._not_empty:
+            for spool_id, payload, enqueued_at in rows:
+                payload = json.loads(payload)
+                self._push({
+                    'spool_id': spool_id,
+                    'payload': payload,
+                    'tenant': self.tenant_of(payload),
+                    'enqueued_at': enqueued_at,
+                    'attempts': 0,
+                })
+            self.claimed_total += len(rows)
+            self._not_empty.notify_all()
+        print(f"Replaying {len(rows)} spooled webhook payloads")
+
+    def _spool_insert(self, payload, enqueued_at):
+        if not self._spool:
+            return None
+        with self._spool_lock:
+            cursor = self._spool.execute(
+                "INSERT INTO spool (payload, enqueued_at, owner, lease_until) VALUES (?, ?, ?, ?)",
+                (json.dumps(payload), enqueued_at, self.owner, time.time() + self.lease_seconds)
+            )
+            return cursor.lastrowid
+
+    def _spool_delete(self, spool_ids):
+        ids = [(spool_id,) for spool_id in spool_ids if spool_id is not None]
+        if not self._spool or not ids:
+            return
+        with self._spool_lock:
+            self._spool.execute("BEGIN")
+            self._spool.executemany("DELETE FROM spool WHERE id = ?", ids)
+            self._spool.execute("COMMIT")
+
+    def _spool_mark_failed(self, spool_ids):
+        ids = [(spool_id,) for spool_id in spool_ids if spool_id is not None]
+        if not self._spool or not ids:
+            return
+        with self._spool_lock:
+            self._spool.execute("BEGIN")
+            self._spool.executemany("UPDATE spool SET failed = 1 WHERE id = ?", ids)
+            self._spool.execute("COMMIT")
+
+    def requeue_failed(self):
+        """Make payloads that used up their attempts claimable again; returns how many.
+
+        Running workers sharing the spool pick them up on their next lease
+        renewal; this process queues them right away.
+        """
+        if not self._spool:
+            self._open_spool()
+        if not self._spool:
+            return 0
+        with self._spool_lock:
+            cursor = self._spool.execute("UPDATE spool SET failed = 0, owner = NULL, lease_until = 0 WHERE failed = 1")
+            count = cursor.rowcount
+        if count and self._running:
+            self._claim_expired()
+        return count
+
+    def failed_count(self):
+        if not self._spool:
+            return 0
+        with self._spool_lock:
+            return self._spool.execute("SELECT count(*) FROM spool WHERE failed = 1").fetchone()[0]
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Ingestion spool maintenance")
+    subcommands = parser.add_subparsers(dest='command', required=True)
+    requeue = subcommands.add_parser('requeue-failed', help="retry payloads that used up their attempts")
+    requeue.add_argument('--spool', default=os.getenv("INGEST_SPOOL_PATH", "ingest_spool.db"))
+    args = parser.parse_args()
+
+    queue = IngestionQueue(handler=None, spool_path=args.spool)
+    print(f"Requeued {queue.requeue_failed()} failed payloads")
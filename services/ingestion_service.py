@@ -0,0 +1,174 @@
+import time
+import uuid
+
+from models import Reading, Alert
+from services.supabase_service import SupabaseService
+from services.twilio_service import TwilioService
+from services.message_templates import message_templates
+from services.patient_index import patient_index
+from services.reading_fanout import ReadingFanout
+from services.reading_validation import reading_validator
+from services.measurement_service import measurement_service, EVENT_TYPES, TIMESTAMP_KEYS, samples_from_payload
+from services.rollup_service import parse_timestamp
+from services.tenancy import tenant_metrics, tenant_of
+from services.profiling import profiler
+
+
+def measured_at(payload: dict):
+    """Rook's timestamp for a reading payload as ISO UTC, or None if it has no usable one"""
+    value = next((payload[key] for key in TIMESTAMP_KEYS if payload.get(key)), None)
+    if value is None:
+        return None
+    try:
+        return parse_timestamp(value).isoformat()
+    except (TypeError, ValueError):
+        return None
+
+
+class IngestionService:
+    """Turns Rook webhook events into readings, alerts and WhatsApp notifications"""
+
+    def __init__(self, supabase_service: SupabaseService = None, twilio_service: TwilioService = None):
+        self.supabase_service = supabase_service or SupabaseService()
+        self.twilio_service = twilio_service or TwilioService()
+        self.fanout = ReadingFanout(self.twilio_service)
+
+    def process_batch(self, events: list):
+        """Process a micro-batch of webhook events, grouped by Rook user.
+
+        Raises if the readings can't be stored, so the queue retries the batch
+        instead of dropping it.
+        """
+        started = time.monotonic()
+        usage = {}
+        try:
+            # Sampled like a request, so slow batches show up in /api/debug/slow
+            with profiler.track('ingestion batch', 'BATCH'):
+                return self._process_batch(events, usage)
+        finally:
+            self._record_usage(usage, time.monotonic() - started)
+
+    def _process_batch(self, events: list, usage: dict):
+        summary = {'readings': 0, 'measurements': 0, 'alerts': 0, 'unknown_users': [], 'ignored': 0,
+                   'rejected': []}
+
+        # Group data events so each patient is looked up once
+        groups = {}
+        for event in events:
+            event_type = event.get('event_type')
+            if event_type == 'blood_pressure_updated' or event_type in EVENT_TYPES:
+                groups.setdefault(event.get('user_id'), []).append(event)
+            elif event_type == 'user_disconnected':
+                print(f"User {event.get('user_id')} disconnected from Rook")
+            else:
+                summary['ignored'] += 1
+
+        patients = {}
+        blood_pressure_events = []
+        samples = {}
+        for rook_user_id, group in groups.items():
+            patient = patient_index.get(rook_user_id)
+            if not patient:
+                summary['unknown_users'].append(rook_user_id)
+                continue
+
+            patients[patient['id']] = patient
+            counts = usage.setdefault(tenant_of(patient), {'events': 0, 'readings': 0, 'alerts': 0, 'measurements': 0})
+            counts['events'] += len(group)
+            for event in group:
+                metric = EVENT_TYPES.get(event.get('event_type'))
+                if metric:
+                    # Other metrics go to the time series store
+                    event_samples = samples_from_payload(metric, (event.get('payload') or {}).get(metric))
+                    for recorded_at, value in event_samples:
+                        samples[(patient['id'], metric, recorded_at)] = value
+                    counts['measurements'] += len(event_samples)
+                    if not event_samples:
+                        summary['ignored'] += 1
+                    continue
+
+                blood_pressure_events.append((patient, event))
+
+        # Written before returning, not buffered: once this returns the queue
+        # deletes the spooled payload, so nothing may only be in memory
+        if samples and measurement_service.store(samples) is None:
+            raise RuntimeError(f"Failed to store {len(samples)} measurement samples")
+        summary['measurements'] = len(samples)
+
+        readings = self._validated_readings(blood_pressure_events, summary)
+        if not readings:
+            return summary
+
+        # Ids are assigned here so alerts can reference their readings, and both
+        # go in with one transactional call: all of the batch is stored or none
+        reading_rows = [{**reading.to_dict(), 'id': str(uuid.uuid4())} for reading in readings]
+        alert_rows = [
+            {**self.build_alert(patients[row['patient_id']], row).to_dict(), 'id': str(uuid.uuid4())}
+            for row in reading_rows if self.exceeds_thresholds(patients[row['patient_id']], row)
+        ]
+        stored = self.supabase_service.insert_readings_with_alerts(reading_rows, alert_rows)
+        if stored is None:
+            raise RuntimeError(f"Failed to store {len(reading_rows)} readings")
+
+        # Only rows that were actually stored are published and sent
+        self.fanout.publish(patients, stored['readings'], stored['alerts'])
+        for result in stored['readings']:
+            usage[tenant_of(patients[result['patient_id']])]['readings'] += 1
+        for alert_row in stored['alerts']:
+            usage[tenant_of(patients[alert_row['patient_id']])]['alerts'] += 1
+        summary['readings'] = len(stored['readings'])
+        summary['alerts'] = len(stored['alerts'])
+
+        return summary
+
+    @staticmethod
+    def _record_usage(usage: dict, elapsed: float):
+        """Per-tenant counters, with the batch's time split by each tenant's share of events"""
+        total = sum(counts['events'] for counts in usage.values())
+        for tenant_id, counts in usage.items():
+            tenant_metrics.record(tenant_id, elapsed * counts['events'] / total if total else 0.0, **counts)
+
+    def _validated_readings(self, events: list, summary: dict):
+        """Readings for the (patient, blood_pressure_updated event) pairs that pass validation"""
+        if not events:
+            return []
+        payloads = [(event.get('payload') or {}).get('blood_pressure') or {} for _, event in events]
+
+        # One vectorized pass over the whole batch
+        result = reading_validator.validate_batch(
+            [patient['id'] for patient, _ in events],
+            [payload.get('systolic') for payload in payloads],
+            [payload.get('diastolic') for payload in payloads],
+            [payload.get('heart_rate') for payload in payloads],
+            [payload.get('unit') for payload in payloads]
+        )
+
+        readings = []
+        for (patient, event), payload, values, errors in zip(events, payloads, result['values'], result['errors']):
+            if values is None:
+                summary['rejected'].append({'user_id': event.get('user_id'), 'reasons': errors})
+                continue
+            readings.append(Reading(patient_id=patient['id'], source='rook',
+                                    measured_at=measured_at(payload), **values))
+        return readings
+
+    @staticmethod
+    def exceeds_thresholds(patient, reading):
+        """Check a stored reading against the patient's thresholds"""
+        return (reading['systolic'] > patient['systolic_threshold'] or
+                reading['diastolic'] > patient['diastolic_threshold'])
+
+    @staticmethod
+    def build_alert(patient, reading):
+        """Create the Alert for a reading that exceeded the patient's thresholds"""
+        if reading['systolic'] > patient['systolic_threshold']:
+            alert_type = 'high_systolic'
+        else:
+            alert_type = 'high_diastolic'
+
+        return Alert(
+            patient_id=patient['id'],
+            reading_id=reading['id'],
+            alert_type=alert_type,
+            message=message_templates.render_alert(patient, reading)
+        )
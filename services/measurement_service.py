@@ -0,0 +1,332 @@
+"""Time series store for Rook metrics beyond blood pressure.
+
+Samples are buffered in memory, deduplicated by (patient, metric, timestamp)
+and written in columnar batches by a background flusher. Samples whose batch
+keeps failing are appended to a dead-letter file (JSON lines) after
+MEASUREMENT_MAX_ATTEMPTS flushes instead of being retried forever.
+
+Apply retention, or re-queue dead-lettered samples, from the command line:
+    python -m services.measurement_service prune [--metric NAME]
+    python -m services.measurement_service replay-dead-letter
+"""
+from datetime import datetime, timedelta, timezone
+import argparse
+import json
+import math
+import os
+import threading
+import time
+
+from dotenv import load_dotenv
+load_dotenv()
+
+from services.supabase_service import SupabaseService
+from services.resilience import DependencyUnavailable
+from services.rollup_service import parse_timestamp
+
+# Rook data type, unit, sample value keys and default retention per metric.
+# Retention can be overridden with MEASUREMENT_RETENTION_<METRIC>_DAYS.
+METRICS = {
+    'heart_rate': {'rook_data_type': 'heart_rate', 'unit': 'bpm',
+                   'value_keys': ('heart_rate', 'bpm', 'value'), 'retention_days': 90},
+    'spo2': {'rook_data_type': 'oxygenation', 'unit': '%',
+             'value_keys': ('spo2', 'saturation_percentage', 'value'), 'retention_days': 365},
+    'weight': {'rook_data_type': 'body_metrics', 'unit': 'kg',
+               'value_keys': ('weight', 'weight_kg', 'value'), 'retention_days': 3650},
+    'glucose': {'rook_data_type': 'blood_glucose', 'unit': 'mg/dL',
+                'value_keys': ('glucose', 'blood_glucose_mg_per_dL', 'value'), 'retention_days': 3650},
+    'steps': {'rook_data_type': 'steps', 'unit': 'steps',
+              'value_keys': ('steps', 'value'), 'retention_days': 90},
+}
+
+# Webhook event types that carry samples for each metric
+EVENT_TYPES = {f'{metric}_updated': metric for metric in METRICS}
+
+TIMESTAMP_KEYS = ('timestamp', 'recorded_at', 'datetime', 'time')
+
+
+def retention_days(metric: str):
+    return int(os.getenv(f"MEASUREMENT_RETENTION_{metric.upper()}_DAYS", METRICS[metric]['retention_days']))
+
+
+def samples_from_payload(metric: str, payload):
+    """(recorded_at, value) pairs from a Rook sample, a list of samples or {'samples': [...]}"""
+    if isinstance(payload, dict) and isinstance(payload.get('samples'), list):
+        payload = payload['samples']
+    if not isinstance(payload, list):
+        payload = [payload] if payload else []
+
+    samples = []
+    for sample in payload:
+        if not isinstance(sample, dict):
+            continue
+        value = next((sample[key] for key in METRICS[metric]['value_keys'] if sample.get(key) is not None), None)
+        recorded_at = next((sample[key] for key in TIMESTAMP_KEYS if sample.get(key)), None)
+        if value is None or recorded_at is None:
+            continue
+        try:
+            samples.append((parse_timestamp(recorded_at).isoformat(), float(value)))
+        except (TypeError, ValueError):
+            continue
+    return samples
+
+
+class MeasurementService:
+    """Buffers, stores, prunes and queries per-metric time series"""
+
+    def __init__(self, supabase_service: SupabaseService = None):
+        self.supabase_service = supabase_service or SupabaseService()
+        self.flush_interval = float(os.getenv("MEASUREMENT_FLUSH_SECONDS", "2"))
+        self.batch_size = int(os.getenv("MEASUREMENT_BATCH_SIZE", "5000"))
+        self.max_buffered = int(os.getenv("MEASUREMENT_MAX_BUFFERED", "200000"))
+        self.max_attempts = int(os.getenv("MEASUREMENT_MAX_ATTEMPTS", "10"))
+        self.prune_batch_size = int(os.getenv("MEASUREMENT_PRUNE_BATCH_SIZE", "10000"))
+        self.dead_letter_path = os.getenv("MEASUREMENT_DEAD_LETTER_PATH", "measurement_dead_letter.jsonl")
+        self._pending = {}
+        # (patient, metric, recorded_at) -> failed flushes, for samples not yet stored
+        self._attempts = {}
+        self._lock = threading.Lock()
+        self._flush_now = threading.Event()
+        self._flusher = None
+        self.recorded_total = 0
+        self.stored_total = 0
+        self.dropped_total = 0
+        self.dead_lettered_total = 0
+
+    # Ingestion
+    def record(self, patient_id: str, metric: str, samples: list):
+        """Buffer (recorded_at, value) samples; returns how many were accepted"""
+        if metric not in METRICS:
+            raise ValueError(f"Unknown metric: {metric}")
+        accepted = 0
+        with self._lock:
+            for recorded_at, value in samples:
+                key = (patient_id, metric, recorded_at)
+                if key not in self._pending and len(self._pending) >= self.max_buffered:
+                    self.dropped_total += 1
+                    continue
+                # Re-delivered samples overwrite rather than duplicate
+                self._pending[key] = value
+                accepted += 1
+            self.recorded_total += accepted
+            if len(self._pending) >= self.batch_size:
+                self._flush_now.set()
+            if self._flusher is None:
+                self._flusher = threading.Thread(target=self._flush_loop, name="measurement-flusher", daemon=True)
+                self._flusher.start()
+        return accepted
+
+    def flush(self):
+        """Write everything buffered, batch_size samples per RPC"""
+        with self._lock:
+            pending, self._pending = self._pending, {}
+        if not pending:
+            return True
+
+        items = list(pending.items())
+        for i in range(0, len(items), self.batch_size):
+            batch = items[i:i + self.batch_size]
+            try:
+                stored = self._insert(batch)
+            except DependencyUnavailable as e:
+                # Supabase refused or timed out: keep everything, without using up an attempt
+                print(f"Measurement flush deferred: {e}")
+                self._retry([], items[i:])
+                return False
+            if stored is None:
+                self._retry(batch, items[i + self.batch_size:])
+                return False
+            with self._lock:
+                for key, _ in batch:
+                    self._attempts.pop(key, None)
+            self.stored_total += stored
+        return True
+
+    def store(self, samples: dict):
+        """Write {(patient_id, metric, recorded_at): value} samples now, bypassing the buffer.
+
+        For callers that acknowledge the samples' source once this returns
+        (the spooled ingestion queue). Returns how many were new, or None if a
+        batch failed; re-sending is harmless since duplicates are ignored.
+        """
+        items = list(samples.items())
+        stored = 0
+        for i in range(0, len(items), self.batch_size):
+            count = self._insert(items[i:i + self.batch_size])
+            if count is None:
+                return None
+            stored += count
+        with self._lock:
+            self.recorded_total += len(items)
+            self.stored_total += stored
+        return stored
+
+    def _insert(self, batch):
+        # Columnar arrays: four JSON lists instead of one object per sample
+        patient_ids, metrics, recorded_at = (list(column) for column in zip(*(key for key, _ in batch)))
+        values = [value for _, value in batch]
+        return self.supabase_service.insert_measurements(patient_ids, metrics, recorded_at, values)
+
+    def _retry(self, failed, rest):
+        """Put samples back for the next flush, dead-lettering failed ones that used up their attempts"""
+        dead = []
+        with self._lock:
+            for key, value in failed:
+                self._attempts[key] = self._attempts.get(key, 0) + 1
+                if self._attempts[key] >= self.max_attempts:
+                    del self._attempts[key]
+                    dead.append((key, value))
+                else:
+                    self._pending.setdefault(key, value)
+            # Not sent this time, so they haven't used an attempt
+            for key, value in rest:
+                self._pending.setdefault(key, value)
+            self.dead_lettered_total += len(dead)
+
+        if dead:
+            print(f"Dead-lettering {len(dead)} measurement samples after {self.max_attempts} failed flushes")
+            self._dead_letter(dead)
+
+    def _dead_letter(self, samples):
+        try:
+            with open(self.dead_letter_path, 'a') as f:
+                for (patient_id, metric, recorded_at), value in samples:
+                    f.write(json.dumps({'patient_id': patient_id, 'metric': metric,
+                                        'recorded_at': recorded_at, 'value': value}) + '\n')
+        except Exception as e:
+            print(f"Error writing measurement dead letters: {e}")
+
+    def replay_dead_letter(self):
+        """Re-queue dead-lettered samples and flush them; returns how many were replayed"""
+        if not os.path.exists(self.dead_letter_path):
+            return 0
+        # Moved aside first, so samples that fail again start a fresh file
+        replay_path = f"{self.dead_letter_path}.replay"
+        os.replace(self.dead_letter_path, replay_path)
+        count = 0
+        with open(replay_path) as f:
+            for line in f:
+                sample = json.loads(line)
+                count += self.record(sample['patient_id'], sample['metric'], [(sample['recorded_at'], sample['value'])])
+                if self.stats()['buffered'] >= self.batch_size:
+                    self._drain()
+        self._drain()
+        os.remove(replay_path)
+        return count
+
+    def _drain(self):
+        """Flush until the buffer is empty; samples that keep failing are dead-lettered again"""
+        while self.stats()['buffered']:
+            if not self.flush():
+                time.sleep(self.flush_interval)
+
+    def _flush_loop(self):
+        while True:
+            self._flush_now.wait(self.flush_interval)
+            self._flush_now.clear()
+            try:
+                self.flush()
+            except Exception as e:
+                print(f"Error flushing measurements: {e}")
+
+    # Retention
+    def prune(self, metric: str = None):
+        """Delete samples past each metric's retention; returns deleted counts per metric.
+
+        One batch per RPC, so each batch is its own transaction and a large
+        backlog never holds its locks for the whole prune.
+        """
+        deleted = {}
+        for name in ([metric] if metric else METRICS):
+            before = datetime.now(timezone.utc) - timedelta(days=retention_days(name))
+            deleted[name] = 0
+            while True:
+                count = self.supabase_service.prune_measurements(name, before.isoformat(), self.prune_batch_size)
+                if count is None:
+                    print(f"Stopped pruning {name} after an error")
+                    break
+                deleted[name] += count
+                if count < self.prune_batch_size:
+                    break
+            print(f"Pruned {deleted[name]} {name} samples older than {before:%Y-%m-%d}")
+        return deleted
+
+    # Queries
+    def get_series(self, patient_id: str, metric: str, start: str, end: str, max_points: int = 500):
+        """Samples in [start, end) at raw resolution, or bucketed to fit max_points"""
+        if metric not in METRICS:
+            raise ValueError(f"Unknown metric: {metric}")
+        start_at, end_at = parse_timestamp(start), parse_timestamp(end)
+        count = self.supabase_service.count_measurements(patient_id, metric, start_at.isoformat(), end_at.isoformat())
+        if count is None:
+            return None
+
+        if count <= max_points:
+            rows = []
+            while len(rows) < count:
+                page = self.supabase_service.get_measurements(
+                    patient_id, metric, start_at.isoformat(), end_at.isoformat(), len(rows), 1000
+                )
+                if page is None:
+                    return None
+                rows.extend(page)
+                if len(page) < 1000:
+                    break
+            points = [{'t': row['recorded_at'], 'value': row['value']} for row in rows]
+            bucket_seconds = None
+        else:
+            # Round bucket width up to a whole minute so boundaries line up across requests
+            span = (end_at - start_at).total_seconds()
+            bucket_seconds = max(60, math.ceil(span / max_points / 60) * 60)
+            rows = self.supabase_service.get_measurement_buckets(
+                patient_id, metric, start_at.isoformat(), end_at.isoformat(), f"{bucket_seconds} seconds"
+            )
+            if rows is None:
+                return None
+            points = [{
+                't': row['bucket_start'],
+                'count': row['count'],
+                'value': row['value_avg'],
+                'min': row['value_min'],
+                'max': row['value_max'],
+                'sum': row['value_sum'],
+            } for row in rows]
+
+        return {
+            'metric': metric,
+            'unit': METRICS[metric]['unit'],
+            'resolution': 'raw' if bucket_seconds is None else f'{bucket_seconds}s',
+            'source_count': count,
+            'points': points
+        }
+
+    def stats(self):
+        with self._lock:
+            return {
+                'buffered': len(self._pending),
+                'recorded_total': self.recorded_total,
+                'stored_total': self.stored_total,
+                'dropped_total': self.dropped_total,
+                'retrying': len(self._attempts),
+                'dead_lettered_total': self.dead_lettered_total
+            }
+
+
+# Shared so every ingestion path feeds the same buffer
+measurement_service = MeasurementService()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Measurement store maintenance")
+    subcommands = parser.add_subparsers(dest='command', required=True)
+    prune = subcommands.add_parser('prune', help="delete samples past their metric's retention")
+    prune.add_argument('--metric', choices=sorted(METRICS))
+    subcommands.add_parser('replay-dead-letter', help="re-queue and store dead-lettered samples")
+    args = parser.parse_args()
+
+    started = time.monotonic()
+    if args.command == 'prune':
+        measurement_service.prune(args.metric)
+    else:
+        print(f"Replayed {measurement_service.replay_dead_letter()} dead-lettered samples")
+    print(f"Done in {time.monotonic() - started:.1f}s")
@@ -0,0 +1,194 @@
+from collections import OrderedDict
+from functools import partial
+from string import Formatter
+import keyword
+import os
+import threading
+import time
+
+DEFAULT_LOCALE = os.getenv("DEFAULT_MESSAGE_LOCALE", "en")
+DEFAULT_CHANNEL = "whatsapp"
+
+# (kind, locale, channel) -> template source
+TEMPLATES = {
+    ('alert', 'en', 'whatsapp'): (
+        "🚨 High Blood Pressure Alert!\n"
+        "Patient: {name}\n"
+        "Systolic: {systolic} mmHg\n"
+        "Diastolic: {diastolic} mmHg\n"
+        "Heart Rate: {heart_rate} bpm\n"
+        "Time: {time}"
+    ),
+    ('alert', 'en', 'sms'): (
+        "High BP alert for {name}: {systolic}/{diastolic} mmHg, HR {heart_rate} bpm at {time}"
+    ),
+    ('alert', 'es', 'whatsapp'): (
+        "🚨 ¡Alerta de Presión Arterial Alta!\n"
+        "Paciente: {name}\n"
+        "Sistólica: {systolic} mmHg\n"
+        "Diastólica: {diastolic} mmHg\n"
+        "Frecuencia cardíaca: {heart_rate} lpm\n"
+        "Hora: {time}"
+    ),
+    ('alert', 'es', 'sms'): (
+        "Alerta de presión alta para {name}: {systolic}/{diastolic} mmHg, FC {heart_rate} lpm a las {time}"
+    ),
+    ('digest', 'en', 'whatsapp'): (
+        "📋 Daily summary for {name}\n"
+        "Readings: {reading_count}\n"
+        "Alerts: {alert_count}\n"
+        "Latest: {last_systolic}/{last_diastolic} mmHg"
+    ),
+    ('digest', 'es', 'whatsapp'): (
+        "📋 Resumen diario de {name}\n"
+        "Lecturas: {reading_count}\n"
+        "Alertas: {alert_count}\n"
+        "Última: {last_systolic}/{last_diastolic} mmHg"
+    ),
+    ('reminder', 'en', 'whatsapp'): (
+        "Hi {name}, this is a reminder to take your blood pressure reading today."
+    ),
+    ('reminder', 'es', 'whatsapp'): (
+        "Hola {name}, le recordamos tomar su lectura de presión arterial hoy."
+    ),
+}
+
+# Fields taken from the patient record when a template is bound
+PATIENT_FIELDS = ('name',)
+
+
+class CompiledTemplate:
+    """A template parsed once and compiled into a Python function.
+
+    The function is generated from an f-string, so rendering runs as bytecode
+    instead of re-parsing a format string per message. Fields listed in
+    `bindable` become leading positional arguments that bind() fills in with
+    a functools.partial, which keeps binding cheap enough to do per patient.
+    """
+
+    def __init__(self, source: str, bindable: tuple = ()):
+        self.source = source
+        segments = list(Formatter().parse(source))
+        fields = tuple(dict.fromkeys(field for _, field, _, _ in segments if field))
+        self.bindable = tuple(field for field in bindable if field in fields)
+        self.fields = self.bindable + tuple(field for field in fields if field not in self.bindable)
+        self.render_fn = self._compile_function()
+
+    def _compile_function(self):
+        if not all(field.isidentifier() and not keyword.iskeyword(field) for field in self.fields):
+            # Attribute/index fields such as {reading.systolic} can't be arguments
+            names = self.fields
+            return lambda *args, **values: self.source.format_map(dict(zip(names, args), **values))
+
+        source = (
+            f"def render({''.join(field + ', ' for field in self.fields)}**_):\n"
+            f"    return f{self.source!r}\n"
+        )
+        namespace = {}
+        exec(compile(source, '<message template>', 'exec'), namespace)
+        return namespace['render']
+
+    def bind(self, values: dict):
+        """Prebind the bindable fields, returning a BoundTemplate"""
+        return BoundTemplate(partial(self.render_fn, *(values.get(field) for field in self.bindable)))
+
+    def render(self, values: dict):
+        return self.render_fn(**values)
+
+
+class BoundTemplate:
+    """A compiled template with its patient-level fields already applied"""
+
+    __slots__ = ('render_fn',)
+
+    def __init__(self, render_fn):
+        self.render_fn = render_fn
+
+    def render(self, values: dict):
+        return self.render_fn(**values)
+
+
+class MessageTemplates:
+    """Precompiled alert, digest and reminder templates, cached per locale and channel"""
+
+    def __init__(self, templates: dict = None, cache_size: int = None):
+        self.compiled = {
+            key: CompiledTemplate(source, bindable=PATIENT_FIELDS)
+            for key, source in (templates or TEMPLATES).items()
+        }
+        self.cache_size = cache_size or int(os.getenv("MESSAGE_TEMPLATE_CACHE_SIZE", "100000"))
+        self._bound = OrderedDict()
+        self._lock = threading.Lock()
+        self._clock = (0, '')
+
+    def get(self, kind: str, locale: str = None, channel: str = DEFAULT_CHANNEL):
+        """Find the compiled template, falling back to the default locale and channel"""
+        locale = locale or DEFAULT_LOCALE
+        for key in ((kind, locale, channel), (kind, DEFAULT_LOCALE, channel),
+                    (kind, locale, DEFAULT_CHANNEL), (kind, DEFAULT_LOCALE, DEFAULT_CHANNEL)):
+            template = self.compiled.get(key)
+            if template:
+                return template
+        raise KeyError(f"No template for {kind}/{locale}/{channel}")
+
+    def for_patient(self, kind: str, patient: dict, channel: str = DEFAULT_CHANNEL):
+        """Template with the patient's fields prebound, cached per patient"""
+        get = patient.get
+        # A changed patient record produces a new key rather than a stale hit
+        key = (get('id'), kind, get('locale'), channel) + tuple(map(get, PATIENT_FIELDS))
+
+        bound = self._bound.get(key)
+        if bound is not None:
+            return bound
+
+        bound = self.get(kind, get('locale'), channel).bind(
+            {field: get(field) for field in PATIENT_FIELDS}
+        )
+
+        with self._lock:
+            self._bound[key] = bound
+            while len(self._bound) > self.cache_size:
+                self._bound.popitem(last=False)
+        return bound
+
+    def now_text(self):
+        """Current local time as text, formatted at most once per second"""
+        now = int(time.time())
+        second, text = self._clock
+        if second != now:
+            text = time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(now))
+            self._clock = (now, text)
+        return text
+
+    def render(self, kind: str, patient: dict, values: dict, channel: str = DEFAULT_CHANNEL):
+        """Render a message for one patient"""
+        if 'time' not in values:
+            values = dict(values, time=self.now_text())
+        return self.for_patient(kind, patient, channel).render(values)
+
+    def render_alert(self, patient: dict, reading: dict, channel: str = DEFAULT_CHANNEL):
+        """Render the high blood pressure alert for a reading"""
+        return self.for_patient('alert', patient, channel).render_fn(
+            systolic=reading['systolic'],
+            diastolic=reading['diastolic'],
+            heart_rate=reading['heart_rate'],
+            time=self.now_text(),
+        )
+
+    def render_alerts(self, pairs, channel: str = DEFAULT_CHANNEL):
+        """Render alerts for many (patient, reading) pairs with one clock read"""
+        now = self.now_text()
+        for_patient = self.for_patient
+        return [
+            for_patient('alert', patient, channel).render_fn(
+                systolic=reading['systolic'],
+                diastolic=reading['diastolic'],
+                heart_rate=reading['heart_rate'],
+                time=now,
+            )
+            for patient, reading in pairs
+        ]
+
+
+# Compiled once at import so request handlers only ever render
+message_templates = MessageTemplates()
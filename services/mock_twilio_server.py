@@ -0,0 +1,108 @@
+"""Local stand-in for the Twilio Messages API, used for bulk send throughput tests.
+
+Run it on its own:
+    python -m services.mock_twilio_server --port 8099 --latency-ms 80
+
+Or let it benchmark TwilioService.send_bulk_whatsapp against itself:
+    python -m services.mock_twilio_server --bench 2000 --rate 50 --fail-rate 0.02
+"""
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs
+import argparse
+import itertools
+import json
+import os
+import random
+import threading
+import time
+
+
+class MockTwilioHandler(BaseHTTPRequestHandler):
+    counter = itertools.count(1)
+    latency = 0.0
+    fail_rate = 0.0
+
+    def do_POST(self):
+        body = self.rfile.read(int(self.headers.get('Content-Length', 0))).decode()
+        form = parse_qs(body)
+
+        if self.latency:
+            time.sleep(self.latency)
+
+        if not self.path.endswith('/Messages.json'):
+            return self._reply(404, {'code': 20404, 'message': 'Not found', 'status': 404})
+
+        if random.random() < self.fail_rate:
+            return self._reply(503, {'code': 20503, 'message': 'Service unavailable', 'status': 503})
+
+        sid = f"SM{next(self.counter):032d}"
+        self._reply(201, {
+            'sid': sid,
+            'status': 'queued',
+            'to': form.get('To', [''])[0],
+            'from': form.get('From', [''])[0],
+            'body': form.get('Body', [''])[0],
+        })
+
+    def _reply(self, status, payload):
+        data = json.dumps(payload).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def start_server(port: int = 8099, latency_ms: float = 0, fail_rate: float = 0.0):
+    """Start the mock server in a background thread and return it"""
+    MockTwilioHandler.latency = latency_ms / 1000
+    MockTwilioHandler.fail_rate = fail_rate
+    server = ThreadingHTTPServer(('127.0.0.1', port), MockTwilioHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def run_benchmark(count: int, port: int, rate: float, workers: int):
+    """Send `count` messages through TwilioService against the mock server"""
+    os.environ.setdefault("TWILIO_ACCOUNT_SID", "ACmock")
+    os.environ.setdefault("TWILIO_AUTH_TOKEN", "mock")
+    os.environ.setdefault("TWILIO_WHATSAPP_NUMBER", "+10000000000")
+    os.environ["TWILIO_API_BASE_URL"] = f"http://127.0.0.1:{port}"
+
+    from services.twilio_service import TwilioService
+    twilio_service = TwilioService()
+
+    messages = [(f"+1555{i:07d}", f"Reminder #{i}: please take your reading") for i in range(count)]
+    report = twilio_service.send_bulk_whatsapp(messages, messages_per_second=rate, max_workers=workers)
+
+    retried = sum(1 for result in report['results'] if result['attempts'] > 1)
+    print(f"Sent {report['sent']}/{report['total']} "
+          f"({report['failed']} failed, {retried} retried) "
+          f"in {report['elapsed_seconds']}s = {report['messages_per_second']} msg/s")
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Mock Twilio Messages API")
+    parser.add_argument('--port', type=int, default=8099)
+    parser.add_argument('--latency-ms', type=float, default=50)
+    parser.add_argument('--fail-rate', type=float, default=0.0)
+    parser.add_argument('--bench', type=int, default=0, help="number of messages to send, 0 to just serve")
+    parser.add_argument('--rate', type=float, default=100, help="messages per second for the benchmark")
+    parser.add_argument('--workers', type=int, default=16)
+    args = parser.parse_args()
+
+    server = start_server(args.port, args.latency_ms, args.fail_rate)
+    print(f"Mock Twilio listening on http://127.0.0.1:{args.port}")
+
+    if args.bench:
+        run_benchmark(args.bench, args.port, args.rate, args.workers)
+        server.shutdown()
+    else:
+        try:
+            while True:
+                time.sleep(3600)
+        except KeyboardInterrupt:
+            server.shutdown()
@@ -0,0 +1,328 @@
+"""Bulk patient onboarding: one insert for the clinic, Rook users provisioned in parallel.
+
+From the command line (re-run with the same --state file to resume):
+    python -m services.onboarding_service patients.csv --state onboarding_state.json
+"""
+from concurrent.futures import ThreadPoolExecutor, as_completed
+import argparse
+import csv
+import fcntl
+import io
+import json
+import os
+import re
+import threading
+import time
+import uuid
+
+from dotenv import load_dotenv
+load_dotenv()
+
+from models import Patient
+from services.http_cache import http_cache
+from services.patient_index import patient_index
+from services.rate_limiter import RateLimiter
+from services.rook_service import RookIntegrationService
+from services.supabase_service import SupabaseService
+
+REQUIRED_FIELDS = ('name', 'email', 'phone_number', 'clinician_id')
+CHUNK_SIZE = 500
+
+
+class JobRunningError(Exception):
+    """Raised when starting a job that is already running"""
+
+
+def parse_rows(content: str, content_type: str = 'json'):
+    """Rows from a CSV document, a JSON list, or a JSON {'patients': [...]} object"""
+    if 'csv' in content_type:
+        return [dict(row) for row in csv.DictReader(io.StringIO(content))]
+    data = json.loads(content)
+    if isinstance(data, dict):
+        data = data.get('patients', [])
+    if not isinstance(data, list):
+        raise ValueError("Expected a list of patients")
+    return data
+
+
+def validate_row(row: dict):
+    """Patient for a row, or an error message"""
+    missing = [field for field in REQUIRED_FIELDS if not str(row.get(field) or '').strip()]
+    if missing:
+        return None, f"Missing required fields: {', '.join(missing)}"
+    try:
+        return Patient(
+            name=row['name'].strip(),
+            email=row['email'].strip().lower(),
+            phone_number=str(row['phone_number']).strip(),
+            clinician_id=str(row['clinician_id']).strip(),
+            systolic_threshold=int(row.get('systolic_threshold') or 160),
+            diastolic_threshold=int(row.get('diastolic_threshold') or 100)
+        ), None
+    except (TypeError, ValueError) as e:
+        return None, f"Invalid threshold: {e}"
+
+
+class OnboardingJob:
+    """One bulk onboarding run whose per-row state is checkpointed to a JSON file.
+
+    Row states: invalid, registered, rook_created, provisioned, failed.
+    Re-running with the same state file skips rows that are already done.
+    """
+
+    def __init__(self, rows: list, state_path: str, supabase_service: SupabaseService = None,
+                 rook_service: RookIntegrationService = None):
+        self.rows = rows
+        self.state_path = state_path
+        self.supabase_service = supabase_service or SupabaseService()
+        self.rook_service = rook_service or RookIntegrationService()
+        self.rook_workers = int(os.getenv("ONBOARDING_ROOK_WORKERS", "8"))
+        self.limiter = RateLimiter(float(os.getenv("ROOK_REQUESTS_PER_SECOND", "5")))
+        self.state = self._load_state()
+        self._lock = threading.Lock()
+
+    # Checkpointing
+    def _load_state(self):
+        if self.state_path and os.path.exists(self.state_path):
+            with open(self.state_path) as f:
+                return json.load(f)
+        return {'status': 'pending', 'started_at': time.time(), 'rows': {}}
+
+    def save(self):
+        if not self.state_path:
+            return
+        with self._lock:
+            snapshot = json.dumps(self.state)
+        # Write-then-rename so a crash never leaves a truncated checkpoint
+        tmp_path = f"{self.state_path}.tmp"
+        with open(tmp_path, 'w') as f:
+            f.write(snapshot)
+        os.replace(tmp_path, self.state_path)
+
+    def _set(self, key, **fields):
+        with self._lock:
+            self.state['rows'].setdefault(key, {}).update(fields)
+
+    # Phases
+    def run(self):
+        started = time.monotonic()
+        self.state['status'] = 'running'
+
+        patients = self._validate()
+        self._register(patients)
+        self.save()
+        self._provision()
+        self._store_rook_ids()
+
+        # Clinician patient lists and the new patients' records changed
+        for clinician_id in {patient.clinician_id for patient in patients.values()}:
+            http_cache.bump_clinician(clinician_id)
+        http_cache.bump_patients(row['patient_id'] for row in self.state['rows'].values() if row.get('patient_id'))
+
+        self.state['status'] = 'completed'
+        self.state['elapsed_seconds'] = round(time.monotonic() - started, 2)
+        self.save()
+        return self.report()
+
+    def _validate(self):
+        """Validated patients keyed by email; duplicate emails in the input are rejected"""
+        patients = {}
+        for index, row in enumerate(self.rows):
+            patient, error = validate_row(row)
+            key = patient.email if patient else f"row-{index}"
+            if key in patients:
+                error = "Duplicate email in input"
+            existing = self.state['rows'].get(key)
+            if existing and existing.get('row') != index and error is None:
+                error = "Duplicate email in input"
+            if error:
+                self._set(f"row-{index}" if patient else key, row=index, email=row.get('email'),
+                          status='invalid', error=error)
+                continue
+            self._set(key, row=index, email=patient.email)
+            patients[key] = patient
+        return patients
+
+    def _register(self, patients: dict):
+        """Insert patients not yet in the database, in multi-row chunks"""
+        pending = [key for key in patients if not self.state['rows'][key].get('patient_id')]
+
+        # Patients from an interrupted run (or registered by hand) are matched by email
+        unchecked = set()
+        for i in range(0, len(pending), CHUNK_SIZE):
+            chunk = pending[i:i + CHUNK_SIZE]
+            existing = self.supabase_service.get_patients_by_emails(chunk)
+            if existing is None:
+                # Inserting without knowing what exists would duplicate them
+                for key in chunk:
+                    self._set(key, status='failed', error='Failed to check for existing patients')
+                unchecked.update(chunk)
+                continue
+            for patient in existing:
+                # Stored emails may differ in case or padding from the normalized input
+                key = patient['email'].strip().lower()
+                if key in patients:
+                    self._set(key, patient_id=patient['id'], rook_user_id=patient.get('rook_user_id'),
+                              status='provisioned' if patient.get('rook_user_id') else 'registered')
+
+        pending = [key for key in patients
+                   if not self.state['rows'][key].get('patient_id') and key not in unchecked]
+        for i in range(0, len(pending), CHUNK_SIZE):
+            chunk = pending[i:i + CHUNK_SIZE]
+            inserted = self.supabase_service.register_patients([patients[key] for key in chunk])
+            if inserted is None:
+                for key in chunk:
+                    self._set(key, status='failed', error='Failed to register patient')
+                continue
+            for patient in inserted:
+                self._set(patient['email'].strip().lower(), patient_id=patient['id'], status='registered', error=None)
+
+    def _provision(self):
+        """Create Rook users concurrently, under the Rook rate limit"""
+        keys = [key for key, row in self.state['rows'].items()
+                if row.get('patient_id') and not row.get('rook_user_id')]
+        if not keys:
+            return
+
+        def provision(key):
+            row = self.state['rows'][key]
+            self.limiter.acquire()
+            # Idempotent per patient ID, so users created before a crash (and
+            # not yet checkpointed) are returned rather than created twice
+            return key, self.rook_service.create_user(row['patient_id'], row['email'])
+
+        completed = 0
+        with ThreadPoolExecutor(max_workers=self.rook_workers) as executor:
+            for future in as_completed([executor.submit(provision, key) for key in keys]):
+                key, rook_data = future.result()
+                if rook_data and rook_data.get('rook_user_id'):
+                    self._set(key, rook_user_id=rook_data['rook_user_id'],
+                              connection_code=rook_data.get('connection_code'),
+                              status='rook_created', error=None)
+                else:
+                    self._set(key, status='failed', error='Failed to create Rook user')
+                completed += 1
+                if completed % 50 == 0:
+                    self.save()
+        self.save()
+
+    def _store_rook_ids(self):
+        """Write the new rook_user_ids back to patients in bulk"""
+        keys = [key for key, row in self.state['rows'].items() if row.get('status') == 'rook_created']
+        for i in range(0, len(keys), CHUNK_SIZE):
+            chunk = keys[i:i + CHUNK_SIZE]
+            updates = [{'id': self.state['rows'][key]['patient_id'],
+                        'rook_user_id': self.state['rows'][key]['rook_user_id']} for key in chunk]
+            if self.supabase_service.set_patient_rook_ids(updates) is None:
+                for key in chunk:
+                    self._set(key, error='Failed to store Rook user ID')
+                continue
+            for key in chunk:
+                self._set(key, status='provisioned')
+            # Webhooks may already have arrived for these users and been cached as unknown
+            patient_index.forget([update['rook_user_id'] for update in updates])
+
+    def report(self):
+        with self._lock:
+            return build_report(self.state)
+
+
+def build_report(state: dict):
+    """Status counts, throughput and per-row results, in input order"""
+    rows = sorted(state['rows'].values(), key=lambda row: row.get('row', 0))
+    counts = {}
+    for row in rows:
+        status = row.get('status', 'pending')
+        counts[status] = counts.get(status, 0) + 1
+    elapsed = state.get('elapsed_seconds')
+    return {
+        'status': state['status'],
+        'error': state.get('error'),
+        'elapsed_seconds': elapsed,
+        'rows_per_second': round(len(rows) / elapsed, 2) if elapsed else None,
+        'counts': counts,
+        'rows': rows
+    }
+
+
+def state_path_for(job_id: str):
+    """Checkpoint file for an API-started job"""
+    if not re.fullmatch(r'[A-Za-z0-9_-]+', job_id):
+        raise ValueError("Invalid job ID")
+    state_dir = os.getenv("ONBOARDING_STATE_DIR", "onboarding_jobs")
+    os.makedirs(state_dir, exist_ok=True)
+    return os.path.join(state_dir, f"{job_id}.json")
+
+
+def _lock_job(job_id: str):
+    """Exclusive lock on a job's checkpoint, held while it runs; raises JobRunningError if taken.
+
+    flock, so it is released if the process dies and also conflicts between
+    threads and workers of the same host.
+    """
+    lock_file = open(f"{state_path_for(job_id)}.lock", 'w')
+    try:
+        fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except BlockingIOError:
+        lock_file.close()
+        raise JobRunningError(f"Onboarding job {job_id} is already running")
+    return lock_file
+
+
+def start_job(rows: list, job_id: str = None):
+    """Run (or resume) an onboarding job in a background thread; returns its ID.
+
+    Raises JobRunningError if the job is already running, since two runs
+    sharing one checkpoint would register every patient twice.
+    """
+    job_id = job_id or uuid.uuid4().hex
+    lock_file = _lock_job(job_id)
+    try:
+        job = OnboardingJob(rows, state_path_for(job_id))
+        job.save()
+    except Exception:
+        lock_file.close()
+        raise
+
+    def run():
+        try:
+            job.run()
+        except Exception as e:
+            print(f"Onboarding job {job_id} failed: {e}")
+            job.state['status'] = 'failed'
+            job.state['error'] = str(e)
+            job.save()
+        finally:
+            lock_file.close()
+
+    threading.Thread(target=run, name=f"onboarding-{job_id}", daemon=True).start()
+    return job_id
+
+
+def load_report(job_id: str):
+    """Current report for a job, or None if unknown"""
+    try:
+        path = state_path_for(job_id)
+    except ValueError:
+        return None
+    if not os.path.exists(path):
+        return None
+    with open(path) as f:
+        return build_report(json.load(f))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Bulk onboard patients from CSV or JSON")
+    parser.add_argument('file')
+    parser.add_argument('--state', default='onboarding_state.json',
+                        help="checkpoint file; re-run with the same file to resume")
+    args = parser.parse_args()
+
+    with open(args.file) as f:
+        content = f.read()
+    rows = parse_rows(content, 'csv' if args.file.endswith('.csv') else 'json')
+
+    report = OnboardingJob(rows, args.state).run()
+    print(json.dumps(report['counts'], indent=2))
+    print(f"Finished in {report['elapsed_seconds']}s ({report['rows_per_second']} rows/sec); "
+          f"per-row status in {args.state}")
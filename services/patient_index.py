@@ -0,0 +1,181 @@
+import os
+import threading
+import time
+from collections import OrderedDict
+
+from services.supabase_service import SupabaseService
+from services.tenancy import tenant_of
+
+
+class PatientIndex:
+    """In-memory rook_user_id -> patient map for routing Rook webhooks.
+
+    Warmed with one paged bulk query, kept current by the code paths that
+    assign Rook IDs, and backed by a database lookup on a miss. Entries are
+    re-read after PATIENT_INDEX_TTL_SECONDS, so thresholds and phone numbers
+    edited elsewhere are picked up. IDs the database confirmed it doesn't
+    know are remembered for a while (up to PATIENT_INDEX_MAX_UNKNOWN of them,
+    least recently seen dropped first) so repeated events from an unknown
+    user don't each cost a query. A failed lookup is never cached: it raises,
+    so the caller can retry.
+    """
+
+    def __init__(self, supabase_service: SupabaseService = None):
+        self.supabase_service = supabase_service or SupabaseService()
+        self.ttl = float(os.getenv("PATIENT_INDEX_TTL_SECONDS", "300"))
+        self.negative_ttl = float(os.getenv("PATIENT_INDEX_NEGATIVE_TTL_SECONDS", "60"))
+        self.max_unknown = int(os.getenv("PATIENT_INDEX_MAX_UNKNOWN", "10000"))
+        self._patients = {}
+        # rook_user_id -> monotonic time after which the cached row is re-read
+        self._expires = {}
+        self._rook_ids = {}
+        self._unknown = OrderedDict()
+        self._lock = threading.Lock()
+        self.warmed = False
+        self.hits = 0
+        self.misses = 0
+        self.negative_hits = 0
+        self.refreshes = 0
+
+    def warm(self, page_size: int = 1000):
+        """Load every patient that has a Rook ID"""
+        started = time.monotonic()
+        offset = 0
+        loaded = {}
+        while True:
+            try:
+                page = self.supabase_service.get_patients_with_rook_ids(offset, page_size)
+            except Exception as e:
+                print(f"Error warming patient index: {e}")
+                return False
+            if page is None:
+                print("Error warming patient index")
+                return False
+            for patient in page:
+                loaded[patient['rook_user_id']] = patient
+            if len(page) < page_size:
+                break
+            offset += len(page)
+
+        with self._lock:
+            # Entries added while warming are newer than the bulk query
+            expires = dict.fromkeys(loaded, time.monotonic() + self.ttl)
+            expires.update(self._expires)
+            loaded.update(self._patients)
+            self._patients = loaded
+            self._expires = expires
+            self._rook_ids = {patient['id']: rook_user_id for rook_user_id, patient in loaded.items()}
+            self.warmed = True
+        print(f"Patient index warmed with {len(loaded)} patients in {time.monotonic() - started:.2f}s")
+        return True
+
+    def warm_in_background(self):
+        threading.Thread(target=self.warm, name="patient-index-warm", daemon=True).start()
+
+    def get(self, rook_user_id: str):
+        """Patient for a Rook user ID, or None if there isn't one.
+
+        Raises if the database can't be asked and nothing is cached.
+        """
+        if not rook_user_id:
+            return None
+        with self._lock:
+            cached = self._patients.get(rook_user_id)
+            if cached is not None:
+                if self._expires.get(rook_user_id, 0) > time.monotonic():
+                    self.hits += 1
+                    return cached
+                self.refreshes += 1
+            else:
+                unknown_until = self._unknown.get(rook_user_id)
+                if unknown_until is not None:
+                    if unknown_until > time.monotonic():
+                        self.negative_hits += 1
+                        self._unknown.move_to_end(rook_user_id)
+                        return None
+                    del self._unknown[rook_user_id]
+                self.misses += 1
+
+        try:
+            patient = self.supabase_service.get_patient_by_rook_id(rook_user_id)
+        except Exception:
+            if cached is None:
+                raise
+            # Keep routing with the old row rather than failing events, and retry later
+            with self._lock:
+                self._expires[rook_user_id] = time.monotonic() + self.negative_ttl
+            return cached
+
+        with self._lock:
+            if patient:
+                self._patients[rook_user_id] = patient
+                self._rook_ids[patient['id']] = rook_user_id
+                self._expires[rook_user_id] = time.monotonic() + self.ttl
+            else:
+                # Confirmed gone (or never existed)
+                if cached is not None:
+                    self._patients.pop(rook_user_id, None)
+                    self._expires.pop(rook_user_id, None)
+                    self._rook_ids.pop(cached['id'], None)
+                self._unknown[rook_user_id] = time.monotonic() + self.negative_ttl
+                self._unknown.move_to_end(rook_user_id)
+                while len(self._unknown) > self.max_unknown:
+                    self._unknown.popitem(last=False)
+        return patient
+
+    def peek(self, rook_user_id: str):
+        """Cached patient for a Rook user ID, without falling back to the database"""
+        with self._lock:
+            return self._patients.get(rook_user_id)
+
+    def add(self, patient: dict):
+        """Index a patient that was just registered or given a Rook ID"""
+        rook_user_id = patient.get('rook_user_id') if patient else None
+        if not rook_user_id:
+            return
+        with self._lock:
+            # A patient has one Rook ID, so drop any previous one
+            previous = self._rook_ids.get(patient['id'])
+            if previous and previous != rook_user_id:
+                self._patients.pop(previous, None)
+                self._expires.pop(previous, None)
+            self._patients[rook_user_id] = patient
+            self._expires[rook_user_id] = time.monotonic() + self.ttl
+            self._rook_ids[patient['id']] = rook_user_id
+            self._unknown.pop(rook_user_id, None)
+
+    def forget(self, rook_user_ids):
+        """Drop cached entries (including negative ones) so the next lookup hits the database"""
+        with self._lock:
+            for rook_user_id in rook_user_ids:
+                patient = self._patients.pop(rook_user_id, None)
+                self._expires.pop(rook_user_id, None)
+                if patient:
+                    self._rook_ids.pop(patient['id'], None)
+                self._unknown.pop(rook_user_id, None)
+
+    def stats(self, top: int = 10):
+        with self._lock:
+            tenants = {}
+            for patient in self._patients.values():
+                tenant = tenant_of(patient)
+                tenants[tenant] = tenants.get(tenant, 0) + 1
+            return {
+                'warmed': self.warmed,
+                'patients': len(self._patients),
+                'tenants': len(tenants),
+                'largest_tenants': [
+                    {'tenant': tenant, 'patients': count}
+                    for tenant, count in sorted(tenants.items(), key=lambda item: item[1], reverse=True)[:top]
+                ],
+                'unknown': len(self._unknown),
+                'hits': self.hits,
+                'misses': self.misses,
+                'negative_hits': self.negative_hits,
+                'refreshes': self.refreshes,
+                'ttl_seconds': self.ttl
+            }
+
+
+# Shared so every webhook route reads the same map
+patient_index = PatientIndex()
@@ -0,0 +1,301 @@
+"""Opt-in profiling for diagnosing latency in a running instance.
+
+Three tools, all off by default:
+- sample(): a wall-clock sampling profile of every thread for N seconds,
+  returned as collapsed stacks ("frame;frame;frame count" lines) that
+  flamegraph.pl, speedscope or inferno render directly.
+- Per-request cProfile: send X-Profile: 1 with the admin token and the
+  request's profile is kept under the id returned in X-Profile-Id.
+- Slow-request logging: with PROFILING_SLOW_REQUEST_MS set, in-flight
+  requests (and background jobs wrapped in track(), such as ingestion
+  batches) are sampled in the background and any slower than the threshold
+  has its call tree printed and kept for /api/debug/slow.
+
+Profiles cover this process only; with several workers, each has its own.
+"""
+from collections import Counter, OrderedDict
+from contextlib import contextmanager
+from datetime import datetime, timezone
+import cProfile
+import hmac
+import io
+import os
+import pstats
+import sys
+import threading
+import time
+import uuid
+
+from flask import g, request
+
+PROFILE_HEADER = 'X-Profile'
+TOKEN_HEADER = 'X-Admin-Token'
+
+
+def _frame_name(frame):
+    code = frame.f_code
+    # ';' separates frames in the collapsed format, so it can't appear in a name
+    return f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})".replace(';', ':')
+
+
+def collapse(frame, root: str = None):
+    """Collapsed stack for a frame, outermost call first"""
+    names = []
+    while frame is not None:
+        names.append(_frame_name(frame))
+        frame = frame.f_back
+    if root:
+        names.append(root.replace(';', ':'))
+    return ';'.join(reversed(names))
+
+
+def folded(stacks: Counter):
+    """Collapsed-stack text, one 'stack count' line per distinct stack"""
+    return ''.join(f"{stack} {count}\n" for stack, count in stacks.most_common())
+
+
+def call_tree(stacks: Counter, min_share: float = 0.02):
+    """Indented call tree with each frame's share of samples, small branches pruned"""
+    total = sum(stacks.values())
+    if not total:
+        return ''
+    tree = {}
+    for stack, count in stacks.items():
+        node = tree
+        for name in stack.split(';'):
+            child = node.setdefault(name, {'count': 0, 'children': {}})
+            child['count'] += count
+            node = child['children']
+
+    lines = []
+
+    def walk(nodes, depth):
+        for name, node in sorted(nodes.items(), key=lambda item: item[1]['count'], reverse=True):
+            share = node['count'] / total
+            if share < min_share:
+                continue
+            lines.append(f"{share * 100:6.1f}%  {'  ' * depth}{name}")
+            walk(node['children'], depth + 1)
+
+    walk(tree, 0)
+    return '\n'.join(lines)
+
+
+class Profiler:
+    """Sampling profiles, per-request cProfile captures and slow-request call trees"""
+
+    def __init__(self):
+        self.enabled = os.getenv("PROFILING_ENABLED", "false").lower() == "true"
+        self.admin_token = os.getenv("PROFILING_ADMIN_TOKEN", "")
+        self.max_seconds = float(os.getenv("PROFILING_MAX_SECONDS", "60"))
+        self.interval = int(os.getenv("PROFILING_SAMPLE_INTERVAL_MS", "10")) / 1000
+        self.slow_threshold = int(os.getenv("PROFILING_SLOW_REQUEST_MS", "0")) / 1000
+        self.keep = int(os.getenv("PROFILING_KEEP", "50"))
+        self.top = int(os.getenv("PROFILING_TOP_FUNCTIONS", "40"))
+
+        self._sampling = threading.Lock()
+        # cProfile can only have one active profiler per process on 3.12+
+        self._cprofile = threading.Lock()
+        self._lock = threading.Lock()
+        self._inflight = {}
+        self._monitor = None
+        self.request_profiles = OrderedDict()
+        self.slow_requests = OrderedDict()
+        self.slow_total = 0
+
+    # Access
+    def authorized(self, token: str):
+        """Whether profiling is on and the token matches PROFILING_ADMIN_TOKEN"""
+        if not self.enabled or not self.admin_token or not token:
+            return False
+        return hmac.compare_digest(token.encode(), self.admin_token.encode())
+
+    # Sampling profile
+    def sample(self, seconds: float, interval: float = None):
+        """Sample every thread's stack for `seconds`; returns a Counter of collapsed stacks.
+
+        Returns None if another sampling run is already in progress.
+        """
+        seconds = min(max(seconds, 0.1), self.max_seconds)
+        interval = max(interval or self.interval, 0.001)
+        if not self._sampling.acquire(blocking=False):
+            return None
+        try:
+            me = threading.get_ident()
+            stacks = Counter()
+            deadline = time.monotonic() + seconds
+            while time.monotonic() < deadline:
+                names = {thread.ident: thread.name for thread in threading.enumerate()}
+                for ident, frame in sys._current_frames().items():
+                    if ident != me:
+                        stacks[collapse(frame, names.get(ident, f"thread-{ident}"))] += 1
+                time.sleep(interval)
+            return stacks
+        finally:
+            self._sampling.release()
+
+    # Request hooks
+    def init_app(self, app):
+        app.before_request(self.before_request)
+        app.after_request(self.after_request)
+        app.teardown_request(self.teardown_request)
+
+    def before_request(self):
+        self._begin_slow(request.method, request.path)
+
+        if request.headers.get(PROFILE_HEADER) and self.authorized(request.headers.get(TOKEN_HEADER)):
+            if not self._cprofile.acquire(blocking=False):
+                g.profile_busy = True
+                return None
+            try:
+                profile = cProfile.Profile()
+                profile.enable()
+            except ValueError as e:
+                # Another profiling tool (a debugger, coverage) already holds the hook
+                self._cprofile.release()
+                print(f"Request profiling unavailable: {e}")
+                g.profile_busy = True
+                return None
+            g.profile = profile
+            g.profile_started = time.monotonic()
+        return None
+
+    def after_request(self, response):
+        profile_id = self._finish_profile()
+        if profile_id:
+            response.headers['X-Profile-Id'] = profile_id
+        elif g.pop('profile_busy', False):
+            response.headers['X-Profile-Id'] = 'busy'
+        self._finish_slow(response.status_code)
+        return response
+
+    def teardown_request(self, error=None):
+        # after_request doesn't run when a view raises, so clean up here too
+        self._finish_profile()
+        self._finish_slow(500 if error else None)
+
+    def _finish_profile(self):
+        profile = g.pop('profile', None)
+        if profile is None:
+            return None
+        try:
+            profile.disable()
+        finally:
+            self._cprofile.release()
+
+        elapsed = time.monotonic() - g.pop('profile_started')
+        stream = io.StringIO()
+        pstats.Stats(profile, stream=stream).sort_stats('cumulative').print_stats(self.top)
+        profile_id = uuid.uuid4().hex[:12]
+        self._keep(self.request_profiles, profile_id, {
+            'id': profile_id,
+            'method': request.method,
+            'path': request.path,
+            'elapsed_ms': round(elapsed * 1000, 1),
+            'captured_at': datetime.now(timezone.utc).isoformat(),
+            'stats': stream.getvalue()
+        })
+        return profile_id
+
+    # Slow requests
+    @property
+    def watching_slow(self):
+        return self.enabled and self.slow_threshold > 0
+
+    @contextmanager
+    def track(self, name: str, kind: str = 'JOB'):
+        """Sample a background job on this thread like a request; slow runs land in /api/debug/slow"""
+        self._begin_slow(kind, name)
+        status = None
+        try:
+            yield
+        except Exception:
+            status = 500
+            raise
+        finally:
+            self._finish_slow(status)
+
+    def _begin_slow(self, method, path):
+        if not self.watching_slow:
+            return
+        self._start_monitor()
+        with self._lock:
+            self._inflight[threading.get_ident()] = {
+                'started': time.monotonic(), 'stacks': Counter(), 'method': method, 'path': path
+            }
+
+    def _start_monitor(self):
+        with self._lock:
+            if self._monitor is None:
+                self._monitor = threading.Thread(target=self._watch, name="slow-request-sampler", daemon=True)
+                self._monitor.start()
+
+    def _watch(self):
+        """Sample the stacks of in-flight requests until the process exits"""
+        while True:
+            time.sleep(self.interval)
+            if not self._inflight:
+                continue
+            frames = sys._current_frames()
+            # Under the lock so a finishing request never reads a Counter mid-update
+            with self._lock:
+                for ident, entry in self._inflight.items():
+                    frame = frames.get(ident)
+                    if frame is not None:
+                        entry['stacks'][collapse(frame)] += 1
+            del frames
+
+    def _finish_slow(self, status_code):
+        with self._lock:
+            entry = self._inflight.pop(threading.get_ident(), None)
+        if entry is None:
+            return
+        elapsed = time.monotonic() - entry['started']
+        if elapsed < self.slow_threshold:
+            return
+
+        tree = call_tree(entry['stacks'])
+        print(f"Slow request: {entry['method']} {entry['path']} took {elapsed * 1000:.0f}ms "
+              f"({sum(entry['stacks'].values())} samples)\n{tree}")
+        request_id = uuid.uuid4().hex[:12]
+        self._keep(self.slow_requests, request_id, {
+            'id': request_id,
+            'method': entry['method'],
+            'path': entry['path'],
+            'status': status_code,
+            'elapsed_ms': round(elapsed * 1000, 1),
+            'captured_at': datetime.now(timezone.utc).isoformat(),
+            'call_tree': tree,
+            'folded': folded(entry['stacks'])
+        })
+        with self._lock:
+            self.slow_total += 1
+
+    def _keep(self, store, key, value):
+        with self._lock:
+            store[key] = value
+            while len(store) > self.keep:
+                store.popitem(last=False)
+
+    def recent(self, store):
+        """Summaries of kept captures, newest first"""
+        with self._lock:
+            entries = list(store.values())
+        return [{key: value for key, value in entry.items() if key not in ('stats', 'call_tree', 'folded')}
+                for entry in reversed(entries)]
+
+    def stats(self):
+        with self._lock:
+            return {
+                'enabled': self.enabled,
+                'slow_request_threshold_ms': self.slow_threshold * 1000 if self.watching_slow else None,
+                'sample_interval_ms': self.interval * 1000,
+                'in_flight': len(self._inflight),
+                'slow_requests_total': self.slow_total,
+                'request_profiles_kept': len(self.request_profiles),
+                'slow_requests_kept': len(self.slow_requests)
+            }
+
+
+# Shared by the app hooks and the debug routes
+profiler = Profiler()
@@ -0,0 +1,57 @@
+from services.twilio_service import TwilioService
+from services.message_templates import message_templates
+from services.event_bus import event_bus
+from services.alert_counts import alert_count_cache
+from services.rollup_service import rollup_service
+from services.http_cache import http_cache
+from services.reading_validation import reading_validator
+
+
+class ReadingFanout:
+    """Everything that follows storing readings: outlier history, rollups, caches, pushes and alerts.
+
+    Shared by the reading and webhook routes and by IngestionService, so a
+    reading has the same side effects whichever path stored it.
+    """
+
+    def __init__(self, twilio_service: TwilioService = None):
+        self.twilio_service = twilio_service or TwilioService()
+
+    def publish(self, patients: dict, readings: list, alerts: list = ()):
+        """Fan out stored readings and alerts; patients maps patient ID -> patient row.
+
+        Only pass rows the database confirmed, so nothing is pushed or sent
+        for a reading that wasn't stored.
+        """
+        if not readings and not alerts:
+            return
+        reading_validator.remember(readings)
+        rollup_service.record(readings)
+        http_cache.bump_patients(reading['patient_id'] for reading in readings)
+        for reading in readings:
+            event_bus.publish_reading(patients[reading['patient_id']], reading)
+
+        readings_by_id = {reading['id']: reading for reading in readings}
+        for alert in alerts:
+            patient = patients[alert['patient_id']]
+            event_bus.publish_alert(patient, alert)
+            alert_count_cache.invalidate(patient['clinician_id'])
+            self.send_alert_notification(patient, readings_by_id.get(alert['reading_id']), alert)
+
+    def send_alert_notification(self, patient, reading, alert):
+        """Send the WhatsApp notification for an alert the database already created"""
+        try:
+            alert_message = message_templates.render_alert(patient, reading) if reading else alert['message']
+            self.twilio_service.send_whatsapp_alert(patient['phone_number'], alert_message)
+
+            print(f"Alert sent for patient {patient['id']}")
+            return True
+
+        except Exception as e:
+            # The reading and alert are stored; a failed message mustn't undo that
+            print(f"Error sending alert notification: {e}")
+            return False
+
+
+# Shared by the routes; IngestionService builds its own around its Twilio client
+reading_fanout = ReadingFanout()
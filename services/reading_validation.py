@@ -0,0 +1,208 @@
+"""Validation and normalization of blood pressure readings before they are stored.
+
+Coerces types, converts readings declared in kPa to mmHg, fixes swapped
+systolic/diastolic,
+rejects physiologically impossible values and flags readings far outside the
+patient's recent distribution. validate() handles one reading;
+validate_batch() runs the same checks over NumPy arrays for bulk paths.
+Readings only join a patient's history through remember(), once stored.
+"""
+from collections import OrderedDict, deque
+import math
+import os
+import threading
+
+import numpy as np
+
+KPA_TO_MMHG = 7.50062
+
+# Plausible ranges; values outside are device or entry errors
+SYSTOLIC_RANGE = (50, 300)
+DIASTOLIC_RANGE = (25, 200)
+HEART_RATE_RANGE = (20, 250)
+MIN_PULSE_PRESSURE = 10
+
+# Outlier detection: robust z-score (median/MAD) against the last readings seen
+HISTORY_SIZE = 50
+MIN_HISTORY = 5
+# Patients whose history is kept; the least recently seen are dropped first
+HISTORY_MAX_PATIENTS = int(os.getenv("READING_HISTORY_MAX_PATIENTS", "10000"))
+OUTLIER_Z = float(os.getenv("READING_OUTLIER_Z", "6"))
+# Outliers are only reported by default: a genuine hypertensive crisis looks
+# exactly like one, and rejecting it would suppress the alert
+REJECT_OUTLIERS = os.getenv("READING_REJECT_OUTLIERS", "false").lower() == "true"
+
+
+def _number(value):
+    """float from a number or numeric string, None if missing, NaN if unparseable"""
+    if value is None or value == '':
+        return None
+    if isinstance(value, bool):
+        return math.nan
+    try:
+        return float(str(value).strip()) if isinstance(value, str) else float(value)
+    except (TypeError, ValueError):
+        return math.nan
+
+
+class ReadingValidator:
+    """Checks readings and keeps a short per-patient history for outlier detection.
+
+    Validating a reading doesn't add it to the history; callers remember()
+    readings once they are stored, so payloads for unknown patients or
+    failed inserts never take a slot. At most max_patients histories are
+    kept, least recently seen evicted first.
+
+    With track_history=False (bulk imports of old data) readings are checked
+    without outlier detection and without touching any patient's history.
+    """
+
+    def __init__(self, history_size: int = HISTORY_SIZE, track_history: bool = True,
+                 max_patients: int = HISTORY_MAX_PATIENTS):
+        self.history_size = history_size
+        self.track_history = track_history
+        self.max_patients = max_patients
+        self._history = OrderedDict()
+        self._lock = threading.Lock()
+        self.accepted = 0
+        self.rejected = {}
+
+    # Single readings
+    def validate(self, patient_id: str, systolic, diastolic, heart_rate=None, unit: str = None):
+        """Normalized {'systolic', 'diastolic', 'heart_rate'} and the problems found.
+
+        Returns (values, errors, warnings); values is None when the reading is rejected.
+        """
+        result = self.validate_batch([patient_id], [systolic], [diastolic], [heart_rate], [unit])
+        return result['values'][0], result['errors'][0], result['warnings'][0]
+
+    # Batches
+    def validate_batch(self, patient_ids: list, systolic, diastolic, heart_rate=None, units=None):
+        """Vectorized validate over parallel sequences.
+
+        Returns {'accepted': bool array, 'values': [dict | None], 'errors': [[reason]],
+        'warnings': [[reason]]}, one entry per input reading.
+        """
+        count = len(patient_ids)
+        heart_rate = heart_rate if heart_rate is not None else [None] * count
+        units = units if units is not None else [None] * count
+
+        sys_parsed = [_number(value) for value in systolic]
+        dia_parsed = [_number(value) for value in diastolic]
+        hr_parsed = [_number(value) for value in heart_rate]
+
+        def column(parsed, default=math.nan):
+            return (np.array([default if value is None else value for value in parsed], dtype=float),
+                    np.array([value is None for value in parsed], dtype=bool))
+
+        sys_values, sys_missing = column(sys_parsed)
+        dia_values, dia_missing = column(dia_parsed)
+        # A missing (or 0) heart rate means the device didn't report one
+        hr_values, hr_missing = column(hr_parsed, 0.0)
+
+        errors = [[] for _ in range(count)]
+        warnings = [[] for _ in range(count)]
+
+        def flag(mask, reason, into=errors):
+            for index in np.flatnonzero(mask):
+                into[index].append(reason)
+
+        flag(sys_missing | dia_missing, 'missing systolic or diastolic')
+        flag(~(sys_missing | dia_missing) & (np.isnan(sys_values) | np.isnan(dia_values)),
+             'systolic and diastolic must be numbers')
+        flag(~hr_missing & np.isnan(hr_values), 'heart rate must be a number')
+
+        # Only a declared unit is converted: values that merely look like kPa are
+        # as likely to be device garbage, and fail the mmHg range checks below
+        in_kpa = np.array([str(unit or '').lower() == 'kpa' for unit in units], dtype=bool)
+        sys_values = np.where(in_kpa, sys_values * KPA_TO_MMHG, sys_values)
+        dia_values = np.where(in_kpa, dia_values * KPA_TO_MMHG, dia_values)
+
+        swapped = (dia_values > sys_values) & (sys_values > 0)
+        flag(swapped, 'systolic and diastolic were swapped', warnings)
+        sys_values, dia_values = np.where(swapped, dia_values, sys_values), np.where(swapped, sys_values, dia_values)
+
+        with np.errstate(invalid='ignore'):
+            flag((sys_values < SYSTOLIC_RANGE[0]) | (sys_values > SYSTOLIC_RANGE[1]),
+                 f'systolic outside {SYSTOLIC_RANGE[0]}-{SYSTOLIC_RANGE[1]} mmHg')
+            flag((dia_values < DIASTOLIC_RANGE[0]) | (dia_values > DIASTOLIC_RANGE[1]),
+                 f'diastolic outside {DIASTOLIC_RANGE[0]}-{DIASTOLIC_RANGE[1]} mmHg')
+            flag((sys_values - dia_values) < MIN_PULSE_PRESSURE,
+                 f'pulse pressure under {MIN_PULSE_PRESSURE} mmHg')
+            flag((hr_values != 0) & ((hr_values < HEART_RATE_RANGE[0]) | (hr_values > HEART_RATE_RANGE[1])),
+                 f'heart rate outside {HEART_RATE_RANGE[0]}-{HEART_RATE_RANGE[1]} bpm')
+
+        if self.track_history:
+            self._flag_outliers(patient_ids, sys_values, dia_values, errors, warnings)
+
+        accepted = np.array([not reasons for reasons in errors], dtype=bool)
+        values = [
+            {
+                'systolic': int(round(sys_values[i])),
+                'diastolic': int(round(dia_values[i])),
+                'heart_rate': int(round(hr_values[i])),
+            } if accepted[i] else None
+            for i in range(count)
+        ]
+        self._record(patient_ids, values, errors)
+        return {'accepted': accepted, 'values': values, 'errors': errors, 'warnings': warnings}
+
+    def _flag_outliers(self, patient_ids, sys_values, dia_values, errors, warnings):
+        """Robust z-score of each reading against its patient's recent readings"""
+        into = errors if REJECT_OUTLIERS else warnings
+        with self._lock:
+            history = {}
+            for patient_id in set(patient_ids):
+                if patient_id in self._history:
+                    self._history.move_to_end(patient_id)
+                    if len(self._history[patient_id]) >= MIN_HISTORY:
+                        history[patient_id] = np.array(self._history[patient_id], dtype=float)
+        if not history:
+            return
+
+        for patient_id, recent in history.items():
+            indexes = np.array([i for i, pid in enumerate(patient_ids) if pid == patient_id])
+            for column, values, name in ((0, sys_values, 'systolic'), (1, dia_values, 'diastolic')):
+                median = np.median(recent[:, column])
+                # 1.4826 scales MAD to a standard deviation; the floor stops a
+                # very steady history from flagging ordinary variation
+                spread = max(1.4826 * np.median(np.abs(recent[:, column] - median)), 5.0)
+                with np.errstate(invalid='ignore'):
+                    z = np.abs(values[indexes] - median) / spread
+                for index in indexes[z > OUTLIER_Z]:
+                    into[index].append(f'{name} far from recent readings (median {median:.0f})')
+
+    def _record(self, patient_ids, values, errors):
+        with self._lock:
+            self.accepted += sum(1 for value in values if value is not None)
+            for reasons in errors:
+                for reason in reasons:
+                    self.rejected[reason] = self.rejected.get(reason, 0) + 1
+
+    def remember(self, readings):
+        """Add stored readings (dicts with patient_id, systolic, diastolic) to their patients' history"""
+        if not self.track_history:
+            return
+        with self._lock:
+            for reading in readings:
+                patient_id = reading['patient_id']
+                recent = self._history.get(patient_id)
+                if recent is None:
+                    recent = self._history[patient_id] = deque(maxlen=self.history_size)
+                    if len(self._history) > self.max_patients:
+                        self._history.popitem(last=False)
+                else:
+                    self._history.move_to_end(patient_id)
+                recent.append((reading['systolic'], reading['diastolic']))
+
+    def stats(self):
+        with self._lock:
+            return {
+                'accepted': self.accepted,
+                'rejected': dict(self.rejected),
+                'patients_tracked': len(self._history)
+            }
+
+
+# Shared so every ingestion path sees the same patient history
+reading_validator = ReadingValidator()
@@ -0,0 +1,207 @@
+"""Per-caller request rate limits for the HTTP API.
+
+Each request is charged to a token bucket keyed by route class (ingestion,
+read or webhook) and caller identity: a verified API key (one listed in
+API_KEYS), otherwise the source IP. Behind a reverse proxy, set
+TRUSTED_PROXY_COUNT so the IP is the client's, not the proxy's. Headers a
+client can set freely (an unknown X-API-Key, X-Clinician-Id) never pick the
+bucket, or rotating them would buy a fresh one per request. Buckets live in process memory by default; with
+RATE_LIMIT_BACKEND=sqlite they live in a shared SQLite file so the limits
+hold across every worker on the host.
+"""
+from collections import OrderedDict
+import hashlib
+import hmac
+import math
+import os
+import sqlite3
+import threading
+import time
+
+from flask import request, jsonify
+
+from services.rate_limiter import RateLimiter
+
+# Requests per second and burst per caller, overridable with
+# RATE_LIMIT_<CLASS>_PER_SECOND and RATE_LIMIT_<CLASS>_BURST
+DEFAULT_BUDGETS = {
+    'ingestion': (5, 20),
+    'read': (20, 60),
+    'webhook': (50, 200),
+}
+
+# Never limited: liveness checks must keep working under load
+EXEMPT_PREFIXES = ('/api/health',)
+
+
+def _budget(route_class: str):
+    rate, burst = DEFAULT_BUDGETS[route_class]
+    prefix = f"RATE_LIMIT_{route_class.upper()}"
+    return (float(os.getenv(f"{prefix}_PER_SECOND", rate)),
+            float(os.getenv(f"{prefix}_BURST", burst)))
+
+
+class MemoryBackend:
+    """Token buckets in this process, least recently used evicted past max_keys"""
+
+    def __init__(self, max_keys: int = None):
+        self.max_keys = max_keys or int(os.getenv("RATE_LIMIT_MAX_KEYS", "10000"))
+        self._buckets = OrderedDict()
+        self._lock = threading.Lock()
+
+    def try_acquire(self, key: str, rate: float, burst: float):
+        with self._lock:
+            bucket = self._buckets.get(key)
+            if bucket is None:
+                bucket = self._buckets[key] = RateLimiter(rate, burst)
+                if len(self._buckets) > self.max_keys:
+                    self._buckets.popitem(last=False)
+            else:
+                self._buckets.move_to_end(key)
+        return bucket.try_acquire()
+
+    def size(self):
+        return len(self._buckets)
+
+
+class SQLiteBackend:
+    """Token buckets in a SQLite file shared by every worker process on the host"""
+
+    def __init__(self, path: str):
+        self.connection = sqlite3.connect(path, check_same_thread=False, isolation_level=None, timeout=5)
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.execute("PRAGMA synchronous=NORMAL")
+        self.connection.execute(
+            "CREATE TABLE IF NOT EXISTS rate_buckets ("
+            "key TEXT PRIMARY KEY, tokens REAL NOT NULL, updated REAL NOT NULL)"
+        )
+        self._lock = threading.Lock()
+
+    def try_acquire(self, key: str, rate: float, burst: float):
+        # Wall clock, since monotonic clocks aren't comparable across processes
+        now = time.time()
+        with self._lock:
+            self.connection.execute("BEGIN IMMEDIATE")
+            try:
+                row = self.connection.execute(
+                    "SELECT tokens, updated FROM rate_buckets WHERE key = ?", (key,)
+                ).fetchone()
+                tokens = burst if row is None else min(burst, row[0] + max(0.0, now - row[1]) * rate)
+                wait = 0.0
+                if tokens >= 1:
+                    tokens -= 1
+                else:
+                    wait = (1 - tokens) / rate
+                self.connection.execute(
+                    "INSERT INTO rate_buckets (key, tokens, updated) VALUES (?, ?, ?) "
+                    "ON CONFLICT(key) DO UPDATE SET tokens = excluded.tokens, updated = excluded.updated",
+                    (key, tokens, now)
+                )
+                self.connection.execute("COMMIT")
+                return wait
+            except Exception:
+                self.connection.execute("ROLLBACK")
+                raise
+
+    def size(self):
+        with self._lock:
+            return self.connection.execute("SELECT COUNT(*) FROM rate_buckets").fetchone()[0]
+
+
+class RequestLimiter:
+    """Classifies requests, charges them to the caller's bucket and answers 429s"""
+
+    def __init__(self, backend=None):
+        self.enabled = os.getenv("RATE_LIMIT_ENABLED", "true").lower() == "true"
+        if backend is None:
+            if os.getenv("RATE_LIMIT_BACKEND", "memory") == "sqlite":
+                backend = SQLiteBackend(os.getenv("RATE_LIMIT_DB_PATH", "rate_limits.db"))
+            else:
+                backend = MemoryBackend()
+        self.backend = backend
+        self.budgets = {route_class: _budget(route_class) for route_class in DEFAULT_BUDGETS}
+        self.api_keys = [key.strip() for key in os.getenv("API_KEYS", "").split(',') if key.strip()]
+        self._metrics = {route_class: {'allowed': 0, 'limited': 0} for route_class in DEFAULT_BUDGETS}
+        self._limited_callers = {}
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def route_class(method: str, path: str):
+        """ingestion, read, webhook, or None for exempt requests"""
+        if method == 'OPTIONS' or path.startswith(EXEMPT_PREFIXES):
+            return None
+        if method == 'GET':
+            return 'read'
+        if '/webhook' in path:
+            return 'webhook'
+        return 'ingestion'
+
+    def verified_api_key(self, api_key: str):
+        """Whether the key is one of API_KEYS (constant-time comparison)"""
+        if not api_key:
+            return False
+        return any(hmac.compare_digest(api_key.encode(), key.encode()) for key in self.api_keys)
+
+    def caller(self):
+        """Verified API key, otherwise source IP"""
+        api_key = request.headers.get('X-API-Key')
+        if self.verified_api_key(api_key):
+            # Hashed so raw keys never reach the shared store or the metrics
+            return f"key:{hashlib.sha256(api_key.encode()).hexdigest()[:16]}"
+        return f"ip:{request.remote_addr}"
+
+    def check(self, route_class: str, caller: str):
+        """Seconds until the caller may retry, 0 if the request is allowed"""
+        rate, burst = self.budgets[route_class]
+        try:
+            wait = self.backend.try_acquire(f"{route_class}:{caller}", rate, burst)
+        except Exception as e:
+            # A broken limiter shouldn't take the API down with it
+            print(f"Rate limiter error: {e}")
+            wait = 0.0
+
+        with self._lock:
+            if wait > 0:
+                self._metrics[route_class]['limited'] += 1
+                if caller in self._limited_callers or len(self._limited_callers) < 1000:
+                    self._limited_callers[caller] = self._limited_callers.get(caller, 0) + 1
+            else:
+                self._metrics[route_class]['allowed'] += 1
+        return wait
+
+    def before_request(self):
+        if not self.enabled:
+            return None
+        route_class = self.route_class(request.method, request.path)
+        if route_class is None:
+            return None
+
+        wait = self.check(route_class, self.caller())
+        if wait <= 0:
+            return None
+
+        rate, burst = self.budgets[route_class]
+        response = jsonify({'error': 'Rate limit exceeded, retry later'})
+        response.headers['Retry-After'] = str(max(1, math.ceil(wait)))
+        response.headers['X-RateLimit-Limit'] = f"{rate:g};burst={burst:g}"
+        return response, 429
+
+    def init_app(self, app):
+        app.before_request(self.before_request)
+
+    def stats(self):
+        with self._lock:
+            top = sorted(self._limited_callers.items(), key=lambda item: item[1], reverse=True)[:10]
+            return {
+                'enabled': self.enabled,
+                'backend': type(self.backend).__name__,
+                'buckets': self.backend.size(),
+                'budgets': {name: {'per_second': rate, 'burst': burst}
+                            for name, (rate, burst) in self.budgets.items()},
+                'classes': {name: dict(counts) for name, counts in self._metrics.items()},
+                'top_limited_callers': [{'caller': caller, 'limited': count} for caller, count in top]
+            }
+
+
+# Shared by the app hook and the metrics endpoint
+request_limiter = RequestLimiter()
@@ -0,0 +1,215 @@
+import os
+import threading
+import time
+
+
+class DependencyUnavailable(Exception):
+    """A dependency can't answer right now; retry_after is a hint in seconds.
+
+    Callers let this propagate (rather than treating it as "no data") so
+    requests can be answered with 503 + Retry-After.
+    """
+
+    def __init__(self, message: str = '', retry_after: float = 1.0):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+class CircuitOpenError(DependencyUnavailable):
+    """Raised instead of calling a dependency whose circuit is open"""
+
+
+class BulkheadFullError(DependencyUnavailable):
+    """Raised when a dependency already has its maximum concurrent calls"""
+
+
+class DependencyTimeout(DependencyUnavailable):
+    """Raised when a dependency call runs past its timeout"""
+
+
+class CircuitBreaker:
+    """Closed -> open after consecutive failures, half-open probes after a cool-down"""
+
+    CLOSED = 'closed'
+    OPEN = 'open'
+    HALF_OPEN = 'half_open'
+
+    def __init__(self, failure_threshold: int = 5, reset_timeout: float = 30.0, half_open_max_calls: int = 1):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.half_open_max_calls = half_open_max_calls
+        self.state = self.CLOSED
+        self.consecutive_failures = 0
+        self.opened_at = None
+        self.half_open_calls = 0
+        self.times_opened = 0
+        self._lock = threading.Lock()
+
+    def allow(self):
+        """Whether a call may go through right now"""
+        with self._lock:
+            if self.state == self.OPEN:
+                if time.monotonic() - self.opened_at < self.reset_timeout:
+                    return False
+                self.state = self.HALF_OPEN
+                self.half_open_calls = 0
+
+            if self.state == self.HALF_OPEN:
+                if self.half_open_calls >= self.half_open_max_calls:
+                    return False
+                self.half_open_calls += 1
+            return True
+
+    def retry_after(self):
+        """Seconds until an open circuit lets a probe through"""
+        with self._lock:
+            if self.state != self.OPEN:
+                return 0.0
+            return max(self.reset_timeout - (time.monotonic() - self.opened_at), 0.0)
+
+    def record_success(self):
+        with self._lock:
+            self.state = self.CLOSED
+            self.consecutive_failures = 0
+            self.half_open_calls = 0
+
+    def record_failure(self):
+        with self._lock:
+            self.consecutive_failures += 1
+            if self.state == self.HALF_OPEN or self.consecutive_failures >= self.failure_threshold:
+                if self.state != self.OPEN:
+                    self.times_opened += 1
+                self.state = self.OPEN
+                self.opened_at = time.monotonic()
+
+    def release_probe(self):
+        """Give back a half-open slot when a probe ends without a verdict"""
+        with self._lock:
+            if self.state == self.HALF_OPEN and self.half_open_calls > 0:
+                self.half_open_calls -= 1
+
+
+class Bulkhead:
+    """Caps concurrent calls to one dependency so it can't hold every worker thread"""
+
+    def __init__(self, max_concurrent: int = 10, max_wait: float = 0.0):
+        self.max_concurrent = max_concurrent
+        self.max_wait = max_wait
+        self.in_flight = 0
+        self.rejected = 0
+        self._semaphore = threading.BoundedSemaphore(max_concurrent)
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        if self.max_wait > 0:
+            acquired = self._semaphore.acquire(timeout=self.max_wait)
+        else:
+            acquired = self._semaphore.acquire(blocking=False)
+        if not acquired:
+            with self._lock:
+                self.rejected += 1
+            return False
+        with self._lock:
+            self.in_flight += 1
+        return True
+
+    def release(self):
+        with self._lock:
+            self.in_flight -= 1
+        self._semaphore.release()
+
+
+class Dependency:
+    """Timeout, circuit breaker and bulkhead settings for one external service.
+
+    Settings come from <NAME>_TIMEOUT_SECONDS, <NAME>_BREAKER_FAILURES,
+    <NAME>_BREAKER_RESET_SECONDS, <NAME>_MAX_CONCURRENT and
+    <NAME>_BULKHEAD_WAIT_SECONDS. `is_failure` decides which exceptions count
+    against the breaker, so e.g. a 404 doesn't open the circuit.
+    """
+
+    def __init__(self, name: str, timeout: float = 10.0, max_concurrent: int = 10, is_failure=None):
+        prefix = name.upper()
+        self.name = name
+        self.timeout = float(os.getenv(f"{prefix}_TIMEOUT_SECONDS", timeout))
+        self.breaker = CircuitBreaker(
+            failure_threshold=int(os.getenv(f"{prefix}_BREAKER_FAILURES", "5")),
+            reset_timeout=float(os.getenv(f"{prefix}_BREAKER_RESET_SECONDS", "30")),
+        )
+        self.bulkhead = Bulkhead(
+            max_concurrent=int(os.getenv(f"{prefix}_MAX_CONCURRENT", max_concurrent)),
+            max_wait=float(os.getenv(f"{prefix}_BULKHEAD_WAIT_SECONDS", "0.5")),
+        )
+        self.is_failure = is_failure or (lambda error: True)
+
+        self.calls = 0
+        self.failures = 0
+        self.short_circuited = 0
+        self.total_latency = 0.0
+        self._lock = threading.Lock()
+
+    def call(self, fn, *args, **kwargs):
+        """Run fn through the breaker and bulkhead, raising fast when either refuses"""
+        if not self.breaker.allow():
+            with self._lock:
+                self.short_circuited += 1
+            raise CircuitOpenError(f"{self.name} circuit is open", retry_after=self.breaker.retry_after() or 1.0)
+
+        if not self.bulkhead.acquire():
+            self.breaker.release_probe()
+            raise BulkheadFullError(f"{self.name} has {self.bulkhead.max_concurrent} calls in flight")
+
+        started = time.monotonic()
+        try:
+            result = fn(*args, **kwargs)
+        except Exception as e:
+            if self.is_failure(e):
+                self.breaker.record_failure()
+                with self._lock:
+                    self.failures += 1
+            else:
+                self.breaker.record_success()
+            raise
+        else:
+            self.breaker.record_success()
+            return result
+        finally:
+            self.bulkhead.release()
+            with self._lock:
+                self.calls += 1
+                self.total_latency += time.monotonic() - started
+
+    def stats(self):
+        with self._lock:
+            return {
+                'state': self.breaker.state,
+                'timeout_seconds': self.timeout,
+                'consecutive_failures': self.breaker.consecutive_failures,
+                'times_opened': self.breaker.times_opened,
+                'calls': self.calls,
+                'failures': self.failures,
+                'short_circuited': self.short_circuited,
+                'avg_latency_ms': round(self.total_latency / self.calls * 1000, 2) if self.calls else None,
+                'in_flight': self.bulkhead.in_flight,
+                'max_concurrent': self.bulkhead.max_concurrent,
+                'bulkhead_rejected': self.bulkhead.rejected,
+            }
+
+
+_dependencies = {}
+_registry_lock = threading.Lock()
+
+
+def get_dependency(name: str, **kwargs):
+    """Shared Dependency for a service name, created on first use"""
+    with _registry_lock:
+        if name not in _dependencies:
+            _dependencies[name] = Dependency(name, **kwargs)
+        return _dependencies[name]
+
+
+def dependency_stats():
+    """Breaker, bulkhead and latency metrics for every registered dependency"""
+    with _registry_lock:
+        dependencies = list(_dependencies.values())
+    return {dependency.name: dependency.stats() for dependency in dependencies}
@@ -0,0 +1,341 @@
+"""Hourly/daily blood pressure rollups and range queries for charts.
+
+New readings are folded into pending buckets and merged every
+ROLLUP_FLUSH_SECONDS, plus once more at interpreter exit. A process that is
+killed (or can't reach the database on the way out) loses at most its
+pending buckets; the exit flush prints the backfill that rebuilds them.
+
+Backfill from the command line:
+    python -m services.rollup_service backfill [--patient ID] [--start ISO] [--end ISO]
+"""
+from datetime import datetime, timedelta, timezone
+import argparse
+import atexit
+import os
+import threading
+import time
+
+from dotenv import load_dotenv
+load_dotenv()
+
+from services.supabase_service import SupabaseService
+
+RESOLUTIONS = {
+    'hour': timedelta(hours=1),
+    'day': timedelta(days=1),
+}
+
+METRICS = ('systolic', 'diastolic', 'heart_rate')
+
+
+def parse_timestamp(value):
+    """ISO timestamp (or datetime) as an aware UTC datetime"""
+    if isinstance(value, datetime):
+        timestamp = value
+    else:
+        timestamp = datetime.fromisoformat(str(value).replace('Z', '+00:00'))
+    if timestamp.tzinfo is None:
+        timestamp = timestamp.replace(tzinfo=timezone.utc)
+    return timestamp.astimezone(timezone.utc)
+
+
+def bucket_start(timestamp: datetime, resolution: str):
+    if resolution == 'hour':
+        return timestamp.replace(minute=0, second=0, microsecond=0)
+    return timestamp.replace(hour=0, minute=0, second=0, microsecond=0)
+
+
+def lttb(points: list, threshold: int, value=lambda point: point[1]):
+    """Largest-Triangle-Three-Buckets downsampling.
+
+    points are ordered by x, where x is point[0] as a number. Keeps the first
+    and last point and, from each bucket in between, the point forming the
+    largest triangle with its neighbours, so peaks survive downsampling.
+    """
+    if threshold >= len(points) or threshold < 3:
+        return list(points)
+
+    sampled = [points[0]]
+    bucket_size = (len(points) - 2) / (threshold - 2)
+    previous = 0
+
+    for i in range(threshold - 2):
+        start = int(i * bucket_size) + 1
+        end = int((i + 1) * bucket_size) + 1
+
+        # Average of the next bucket is the third triangle vertex
+        next_start = end
+        next_end = min(int((i + 2) * bucket_size) + 1, len(points))
+        next_bucket = points[next_start:next_end] or [points[-1]]
+        avg_x = sum(point[0] for point in next_bucket) / len(next_bucket)
+        avg_y = sum(value(point) for point in next_bucket) / len(next_bucket)
+
+        ax, ay = points[previous][0], value(points[previous])
+        best, best_area = start, -1.0
+        for j in range(start, end):
+            area = abs((ax - avg_x) * (value(points[j]) - ay) - (ax - points[j][0]) * (avg_y - ay))
+            if area > best_area:
+                best, best_area = j, area
+
+        sampled.append(points[best])
+        previous = best
+
+    sampled.append(points[-1])
+    return sampled
+
+
+class RollupService:
+    """Maintains reading_rollups and answers chart queries at the right resolution"""
+
+    def __init__(self, supabase_service: SupabaseService = None):
+        self.supabase_service = supabase_service or SupabaseService()
+        self.flush_interval = float(os.getenv("ROLLUP_FLUSH_SECONDS", "5"))
+        self.raw_point_limit = int(os.getenv("ROLLUP_RAW_POINT_LIMIT", "5000"))
+        self._pending = {}
+        self._lock = threading.Lock()
+        # Serializes flushes, so the exit flush waits for one in progress
+        self._flush_lock = threading.Lock()
+        self._flusher = None
+
+    # Aggregation
+    @staticmethod
+    def aggregate(readings, into: dict = None):
+        """Fold readings into {(patient_id, resolution, bucket_start): bucket} aggregates"""
+        buckets = into if into is not None else {}
+        for reading in readings:
+            created_at = parse_timestamp(reading.get('created_at') or datetime.now(timezone.utc))
+            for resolution in RESOLUTIONS:
+                key = (reading['patient_id'], resolution, bucket_start(created_at, resolution).isoformat())
+                bucket = buckets.get(key)
+                if bucket is None:
+                    bucket = buckets[key] = {
+                        'patient_id': key[0], 'resolution': resolution, 'bucket_start': key[2],
+                        'count': 0, 'heart_rate_count': 0,
+                    }
+                bucket['count'] += 1
+                for metric in METRICS:
+                    value = reading.get(metric)
+                    if metric == 'heart_rate':
+                        # 0 means the device didn't report one
+                        if not value:
+                            continue
+                        bucket['heart_rate_count'] += 1
+                    if value is None:
+                        continue
+                    bucket[f'{metric}_min'] = min(bucket.get(f'{metric}_min', value), value)
+                    bucket[f'{metric}_max'] = max(bucket.get(f'{metric}_max', value), value)
+                    bucket[f'{metric}_sum'] = bucket.get(f'{metric}_sum', 0) + value
+        return buckets
+
+    # Incremental updates
+    def record(self, readings: list):
+        """Add freshly stored readings to the pending rollups; flushed in the background"""
+        with self._lock:
+            self.aggregate(readings, self._pending)
+            if self._flusher is None:
+                self._flusher = threading.Thread(target=self._flush_loop, name="rollup-flusher", daemon=True)
+                self._flusher.start()
+                atexit.register(self.close)
+
+    def flush(self):
+        """Merge pending buckets into reading_rollups with one RPC"""
+        with self._flush_lock:
+            return self._flush()
+
+    def _flush(self):
+        with self._lock:
+            pending, self._pending = self._pending, {}
+        if not pending:
+            return True
+        try:
+            if self.supabase_service.merge_reading_rollups(list(pending.values())):
+                return True
+        except Exception as e:
+            print(f"Error flushing rollups: {e}")
+
+        # Put them back so the next flush retries
+        with self._lock:
+            for key, bucket in pending.items():
+                self._merge_bucket(self._pending, key, bucket)
+        return False
+
+    @staticmethod
+    def _merge_bucket(buckets, key, bucket):
+        existing = buckets.get(key)
+        if existing is None:
+            buckets[key] = bucket
+            return
+        existing['count'] += bucket['count']
+        existing['heart_rate_count'] += bucket['heart_rate_count']
+        for metric in METRICS:
+            if f'{metric}_sum' not in bucket:
+                continue
+            existing[f'{metric}_min'] = min(existing.get(f'{metric}_min', bucket[f'{metric}_min']), bucket[f'{metric}_min'])
+            existing[f'{metric}_max'] = max(existing.get(f'{metric}_max', bucket[f'{metric}_max']), bucket[f'{metric}_max'])
+            existing[f'{metric}_sum'] = existing.get(f'{metric}_sum', 0) + bucket[f'{metric}_sum']
+
+    def close(self):
+        """Final flush at shutdown; reports the backfill needed for buckets that couldn't be written"""
+        if self.flush():
+            return
+        with self._lock:
+            pending = list(self._pending.values())
+        days = sorted({bucket['bucket_start'][:10] for bucket in pending})
+        patients = sorted({bucket['patient_id'] for bucket in pending})
+        print(f"Lost {len(pending)} pending rollup buckets for {len(patients)} patients; rebuild with: "
+              f"python -m services.rollup_service backfill --start {days[0]} --end "
+              f"{(parse_timestamp(days[-1]) + RESOLUTIONS['day']).date().isoformat()}")
+
+    def _flush_loop(self):
+        while True:
+            time.sleep(self.flush_interval)
+            try:
+                self.flush()
+            except Exception as e:
+                print(f"Error flushing rollups: {e}")
+
+    # Backfill
+    def backfill(self, patient_id: str = None, start: str = None, end: str = None, page_size: int = 1000):
+        """Recompute rollups from raw readings, one patient at a time"""
+        started = time.monotonic()
+        total = 0
+
+        # Whole days only, so a replace never clobbers buckets outside the range
+        range_start = bucket_start(parse_timestamp(start), 'day').isoformat() if start else None
+        range_end = bucket_start(parse_timestamp(end), 'day').isoformat() if end else None
+
+        patient_ids = [patient_id] if patient_id else self._all_patient_ids(page_size)
+        for current in patient_ids:
+            # Days before the archive watermark are missing raw rows; recomputing
+            # them would overwrite complete buckets with partial ones
+            watermark = self.supabase_service.get_archive_watermark(current)
+            if watermark is None:
+                raise RuntimeError(f"Failed to read archive watermark for patient {current}")
+            patient_start = range_start
+            if watermark and (not range_start or parse_timestamp(range_start) < parse_timestamp(watermark)):
+                patient_start = bucket_start(parse_timestamp(watermark), 'day').isoformat()
+
+            buckets = {}
+            for page in self._pages(current, patient_start, range_end, page_size,
+                                    "patient_id, systolic, diastolic, heart_rate, created_at"):
+                self.aggregate(page, buckets)
+                total += len(page)
+
+            rows = list(buckets.values())
+            for i in range(0, len(rows), page_size):
+                if not self.supabase_service.merge_reading_rollups(rows[i:i + page_size], replace=True):
+                    raise RuntimeError(f"Failed to write rollups for patient {current}")
+
+        elapsed = time.monotonic() - started
+        print(f"Rolled up {total} readings in {elapsed:.1f}s "
+              f"({total / elapsed if elapsed else 0:.0f} readings/sec)")
+        return {'readings': total, 'elapsed_seconds': round(elapsed, 2)}
+
+    def _pages(self, patient_id, start, end, page_size, columns):
+        """Yield pages of a patient's readings, oldest first"""
+        offset = 0
+        while True:
+            page = self.supabase_service.get_readings_page(patient_id, start, end, offset, page_size, columns)
+            if page is None:
+                raise RuntimeError(f"Failed to read readings for patient {patient_id}")
+            yield page
+            if len(page) < page_size:
+                return
+            offset += len(page)
+
+    def _all_patient_ids(self, page_size):
+        offset = 0
+        while True:
+            ids = self.supabase_service.get_patient_ids(offset, page_size)
+            if ids is None:
+                raise RuntimeError("Failed to list patients")
+            yield from ids
+            if len(ids) < page_size:
+                return
+            offset += len(ids)
+
+    # Queries
+    def get_series(self, patient_id: str, start: str, end: str, max_points: int = 300):
+        """Chart series for [start, end) with at most max_points points.
+
+        Uses raw readings when they fit (downsampled with LTTB if needed),
+        otherwise hourly or daily rollups, whichever keeps the bucket count
+        closest to the budget. Ranges reaching back past the patient's archive
+        watermark always use rollups, since the raw rows there may be gone.
+        """
+        start_at, end_at = parse_timestamp(start), parse_timestamp(end)
+        raw_count = self.supabase_service.count_patient_readings(patient_id, start, end)
+        watermark = self.supabase_service.get_archive_watermark(patient_id)
+        if raw_count is None or watermark is None:
+            return None
+        archived = bool(watermark) and start_at < parse_timestamp(watermark)
+
+        source_count = raw_count
+        if not archived and raw_count <= max(max_points, self.raw_point_limit):
+            try:
+                points = [
+                    self._raw_point(row)
+                    for page in self._pages(patient_id, start, end, 1000,
+                                            "systolic, diastolic, heart_rate, created_at")
+                    for row in page
+                ]
+            except RuntimeError:
+                return None
+            resolution = 'raw'
+        else:
+            span = end_at - start_at
+            resolution = 'hour' if span / RESOLUTIONS['hour'] <= max_points * 4 else 'day'
+            rows = self.supabase_service.get_reading_rollups(patient_id, resolution, start, end)
+            if rows is None:
+                return None
+            points = [self._rollup_point(row) for row in rows]
+            source_count = sum(row['count'] for row in rows)
+
+        sampled = len(points) > max_points
+        if sampled:
+            keyed = [(parse_timestamp(point['t']).timestamp(), point) for point in points]
+            points = [point for _, point in lttb(keyed, max_points, value=lambda item: item[1]['systolic'] or 0)]
+
+        return {
+            'resolution': resolution,
+            'downsampled': sampled,
+            'source_count': source_count,
+            'points': points
+        }
+
+    @staticmethod
+    def _raw_point(row):
+        return {
+            't': row['created_at'],
+            'systolic': row['systolic'],
+            'diastolic': row['diastolic'],
+            'heart_rate': row['heart_rate'],
+        }
+
+    @staticmethod
+    def _rollup_point(row):
+        point = {'t': row['bucket_start'], 'count': row['count']}
+        for metric in METRICS:
+            divisor = row['heart_rate_count'] if metric == 'heart_rate' else row['count']
+            total = row.get(f'{metric}_sum')
+            point[metric] = round(total / divisor, 1) if total is not None and divisor else None
+            point[f'{metric}_min'] = row.get(f'{metric}_min')
+            point[f'{metric}_max'] = row.get(f'{metric}_max')
+        return point
+
+
+# Shared so every ingestion path feeds the same pending buffer
+rollup_service = RollupService()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Reading rollup maintenance")
+    subcommands = parser.add_subparsers(dest='command', required=True)
+    backfill = subcommands.add_parser('backfill', help="recompute rollups from raw readings")
+    backfill.add_argument('--patient')
+    backfill.add_argument('--start')
+    backfill.add_argument('--end')
+    backfill.add_argument('--page-size', type=int, default=1000)
+    args = parser.parse_args()
+
+    rollup_service.backfill(args.patient, args.start, args.end, args.page_size)
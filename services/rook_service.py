@@ -2,6 +2,17 @@ import requests
 import os
 import json
 from datetime import datetime, timedelta
+from services.resilience import get_dependency
+
+
+def _is_rook_failure(error):
+    """4xx responses mean Rook is up, so they don't count against the breaker"""
+    response = getattr(error, 'response', None)
+    return response is None or response.status_code >= 500
+
+
+rook_dependency = get_dependency("rook", timeout=10, max_concurrent=10, is_failure=_is_rook_failure)
+
 
 class RookIntegrationService:
     def __init__(self):
@@ -11,6 +22,14 @@ class RookIntegrationService:
         self.access_token = None
         self.token_expires_at = None
     
+    def _request(self, method: str, url: str, **kwargs):
+        """HTTP call to Rook with a timeout, through the breaker and bulkhead"""
+        def send():
+            response = requests.request(method, url, timeout=rook_dependency.timeout, **kwargs)
+            response.raise_for_status()
+            return response
+        return rook_dependency.call(send)
+    
     def get_access_token(self):
         """Get OAuth access token from Rook"""
         try:
@@ -26,8 +45,7 @@ class RookIntegrationService:
                 "grant_type": "client_credentials"
             }
             
-            response = requests.post(url, json=payload)
-            response.raise_for_status()
+            response = self._request("POST", url, json=payload)
             
             data = response.json()
             self.access_token = data.get("access_token")
@@ -41,7 +59,11 @@ class RookIntegrationService:
             return None
     
     def create_user(self, patient_id: str, email: str):
-        """Create a Rook user and get their code for device connection"""
+        """Create a Rook user and get their code for device connection.
+
+        Safe to retry: the patient ID is the idempotency key, and if Rook
+        already has a user for it that user is returned instead.
+        """
         try:
             token = self.get_access_token()
             if not token:
@@ -50,15 +72,20 @@ class RookIntegrationService:
             url = f"{self.base_url}/users"
             headers = {
                 "Authorization": f"Bearer {token}",
-                "Content-Type": "application/json"
+                "Content-Type": "application/json",
+                "Idempotency-Key": f"create-user-{patient_id}"
             }
             payload = {
                 "external_id": patient_id,
                 "email": email
             }
             
-            response = requests.post(url, json=payload, headers=headers)
-            response.raise_for_status()
+            try:
+                response = self._request("POST", url, json=payload, headers=headers)
+            except requests.HTTPError as e:
+                if e.response is not None and e.response.status_code == 409:
+                    return self.get_user_by_external_id(patient_id)
+                raise
             
             data = response.json()
             rook_user_id = data.get("id")
@@ -74,6 +101,37 @@ class RookIntegrationService:
             print(f"Error creating Rook user: {e}")
             return None
     
+    def get_user_by_external_id(self, external_id: str):
+        """The Rook user created for a patient ID, as create_user returns it; None if there isn't one"""
+        try:
+            token = self.get_access_token()
+            if not token:
+                return None
+            
+            url = f"{self.base_url}/users"
+            headers = {
+                "Authorization": f"Bearer {token}",
+                "Content-Type": "application/json"
+            }
+            
+            response = self._request("GET", url, headers=headers, params={"external_id": external_id})
+            
+            data = response.json()
+            users = data if isinstance(data, list) else data.get("data", [])
+            user = next((user for user in users if user.get("external_id") == external_id), None)
+            if not user:
+                return None
+            
+            print(f"Rook user found: {user.get('id')}")
+            return {
+                "rook_user_id": user.get("id"),
+                "connection_code": user.get("connection_code") or self.get_connection_code(user.get("id"))
+            }
+        
+        except Exception as e:
+            print(f"Error looking up Rook user: {e}")
+            return None
+    
     def get_connection_code(self, rook_user_id: str):
         """Get connection code for a Rook user to connect devices"""
         try:
@@ -87,8 +145,7 @@ class RookIntegrationService:
                 "Content-Type": "application/json"
             }
             
-            response = requests.get(url, headers=headers)
-            response.raise_for_status()
+            response = self._request("GET", url, headers=headers)
             
             data = response.json()
             connection_code = data.get("connection_code")
@@ -99,8 +156,8 @@ class RookIntegrationService:
             print(f"Error getting connection code: {e}")
             return None
     
-    def get_health_data(self, rook_user_id: str, data_type: str = "blood_pressure"):
-        """Get health data for a specific user"""
+    def get_health_data(self, rook_user_id: str, data_type: str = "blood_pressure", params: dict = None):
+        """Get health data for a specific user (params e.g. page, page_size for history)"""
         try:
             token = self.get_access_token()
             if not token:
@@ -112,8 +169,7 @@ class RookIntegrationService:
                 "Content-Type": "application/json"
             }
             
-            response = requests.get(url, headers=headers)
-            response.raise_for_status()
+            response = self._request("GET", url, headers=headers, params=params)
             
             data = response.json()
             return data
@@ -157,8 +213,7 @@ class RookIntegrationService:
                 "Content-Type": "application/json"
             }
             
-            response = requests.post(url, headers=headers)
-            response.raise_for_status()
+            response = self._request("POST", url, headers=headers)
             
             print(f"Sync triggered for user {rook_user_id}")
             return True
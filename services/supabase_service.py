@@ -1,44 +1,102 @@
-from supabase import create_client, Client
+from supabase import create_client, Client, ClientOptions
+from postgrest.exceptions import APIError
 import os
 from models import Patient, Reading, Alert
+from services.resilience import get_dependency, DependencyUnavailable, DependencyTimeout
+import httpx
 import uuid
+from datetime import datetime, timezone
+
+# An APIError means PostgREST answered, so only transport failures trip the breaker
+supabase_dependency = get_dependency(
+    "supabase", timeout=10, max_concurrent=20,
+    is_failure=lambda error: not isinstance(error, APIError)
+)
 
 class SupabaseService:
     def __init__(self):
         self.supabase: Client = create_client(
             os.getenv("SUPABASE_URL"),
-            os.getenv("SUPABASE_KEY")
+            os.getenv("SUPABASE_KEY"),
+            options=ClientOptions(postgrest_client_timeout=supabase_dependency.timeout)
         )
     
+    def _execute(self, query):
+        """Execute a query through the Supabase timeout, breaker and bulkhead.
+
+        An open circuit, full bulkhead or timeout raises DependencyUnavailable,
+        which the methods below let through instead of returning None/[]/0,
+        so routes can answer 503 rather than "not found" or an empty list.
+        """
+        try:
+            return supabase_dependency.call(query.execute)
+        except httpx.TimeoutException as e:
+            raise DependencyTimeout(f"supabase timed out: {e}") from e
+    
     # Patient Operations
     def register_patient(self, patient: Patient):
         """Register a new patient"""
         try:
             patient_data = patient.to_dict()
             patient_data['id'] = str(uuid.uuid4())
-            response = self.supabase.table("patients").insert(patient_data).execute()
+            response = self._execute(self.supabase.table("patients").insert(patient_data))
             return response.data[0] if response.data else None
+        except DependencyUnavailable:
+            raise
         except Exception as e:
             print(f"Error registering patient: {e}")
             return None
     
+    def register_patients(self, patients: list):
+        """Register several patients with a single multi-row insert"""
+        try:
+            rows = []
+            for patient in patients:
+                patient_data = patient.to_dict()
+                patient_data['id'] = str(uuid.uuid4())
+                rows.append(patient_data)
+            if not rows:
+                return []
+            response = self._execute(self.supabase.table("patients").insert(rows))
+            return response.data or []
+        except DependencyUnavailable:
+            raise
+        except Exception as e:
+            print(f"Error registering patients: {e}")
+            return None
+    
+    def get_patients_by_emails(self, emails: list):
+        """Find existing patients by email, ignoring case"""
+        try:
+            if not emails:
+                return []
+            response = self._execute(self.supabase.rpc("get_patients_by_emails", {"p_emails": emails}))
+            return response.data or []
+        except DependencyUnavailable:
+            raise
+        except Exception as e:
+            print(f"Error fetching patients by email: {e}")
+            return None
+    
     def get_patient(self, patient_id: str):
-        """Get patient by ID"""
+        """Get patient by ID; None if there isn't one, raises if the read fails"""
         try:
-            response = self.supabase.table("patients").select("*").eq("id", patient_id).execute()
+            response = self._execute(self.supabase.table("patients").select("*").eq("id", patient_id))
             return response.data[0] if response.data else None
         except Exception as e:
             print(f"Error fetching patient: {e}")
-            return None
+            raise
     
     def get_clinician_patients(self, clinician_id: str):
-        """Get all patients for a clinician"""
+        """Get all patients for a clinician; None if the read fails"""
         try:
-            response = self.supabase.table("patients").select("*").eq("clinician_id", clinician_id).execute()
+            response = self._execute(self.supabase.table("patients").select("*").eq("clinician_id", clinician_id))
             return response.data
+        except DependencyUnavailable:
+            raise
         except Exception as e:
             print(f"Error fetching clinician patients: {e}")
-            return []
+            return None
     
     # Reading Operations
     def add_reading(self, reading: Reading):
@@ -46,20 +104,370 @@ class SupabaseService:
         try:
             reading_data = reading.to_dict()
             reading_data['id'] = str(uuid.uuid4())
-            response = self.supabase.table("readings").insert(reading_data).execute()
+            response = self._execute(self.supabase.table("readings").insert(reading_data))
             return response.data[0] if response.data else None
+        except DependencyUnavailable:
+            raise
         except Exception as e:
             print(f"Error adding reading: {e}")
             return None
     
-    def get_patient_readings(self, patient_id: str, limit: int = 10):
-        """Get recent readings for a patient"""
+    def add_readings(self, readings: list):
+        """Add several readings with a single multi-row insert"""
         try:
-            response = self.supabase.table("readings").select("*").eq("patient_id", patient_id).order("created_at", desc=True).limit(limit).execute()
+            rows = []
+            for reading in readings:
+                reading_data = reading.to_dict()
+                reading_data['id'] = str(uuid.uuid4())
+                rows.append(reading_data)
+            if not rows:
+                return []
+            response = self._execute(self.supabase.table("readings").insert(rows))
+            return response.data or []
+        except DependencyUnavailable:
+            raise
+        except Exception as e:
+            print(f"Error adding readings: {e}")
+            return None
+    
+    def insert_readings_with_alerts(self, readings: list, alerts: list):
+        """Insert reading and alert dicts (ids already assigned) in one transaction.
+
+        Returns {'readings': [...], 'alerts': [...]}, or None if nothing was stored.
+        """
+        try:
+            if not readings:
+                return {'readings': [], 'alerts': []}
+            response = self._execute(self.supabase.rpc("insert_readings_with_alerts", {
+                "p_readings": readings,
+                "p_alerts": alerts
+            }))
             return response.data
+        except DependencyUnavailable:
+            raise
+        except Exception as e:
+            print(f"Error inserting readings with alerts: {e}")
+            return None
+    
+    def insert_readings_if_new(self, rows: list):
+        """Insert reading dicts (with created_at) unless already stored; returns the new rows"""
+        try:
+            if not rows:
+                return []
+            response = self._execute(self.supabase.rpc("insert_readings_if_new", {"p_rows": rows}))
+            return response.data or []
+        except DependencyUnavailable:
+            raise
+        except Exception as e:
+            print(f"Error inserting historical readings: {e}")
+            return None
+    
+    def insert_reading_and_maybe_alert(self, reading: Reading, alert_message: str = None):
+        """Insert a reading and, if it breaches the patient's thresholds, its alert.
+
+        One round trip through the insert_reading_and_maybe_alert stored
+        procedure (migrations/001). Returns {'patient', 'reading', 'alert'},
+        with 'patient' None when the patient does not exist.
+        """
+        try:
+            response = self._execute(self.supabase.rpc("insert_reading_and_maybe_alert", {
+                "p_patient_id": reading.patient_id,
+                "p_systolic": reading.systolic,
+                "p_diastolic": reading.diastolic,
+                "p_heart_rate": reading.heart_rate,
+                "p_source": reading.source,
+                "p_alert_message": alert_message,
+                "p_measured_at": reading.measured_at
+            }))
+            return response.data
+        except DependencyUnavailable:
+            raise
+        except Exception as e:
+            print(f"Error inserting reading with alert: {e}")
+            return None
+    
+    def get_patient_readings(self, patient_id: str, limit: int = 10, start: str = None, end: str = None):
+        """Get recent readings for a patient, optionally within [start, end); None if the read fails"""
+        try:
+            query = self.supabase.table("readings").select("*").eq("patient_id", patient_id)
+            if start:
+                query = query.gte("created_at", start)
+            if end:
+                query = query.lt("created_at", end)
+            response = self._execute(query.order("created_at", desc=True).limit(limit))
+            return response.data
+        except DependencyUnavailable:
+            raise
         except Exception as e:
             print(f"Error fetching readings: {e}")
-            return []
+            return None
+    
+    def get_readings_page(self, patient_id: str = None, start: str = None, end: str = None,
+                          offset: int = 0, limit: int = 1000, columns: str = "*"):
+        """Page through readings oldest first, for charts and batch jobs"""
+        try:
+            query = self.supabase.table("readings").select(columns)
+            if patient_id:
+                query = query.eq("patient_id", patient_id)
+            if start:
+                query = query.gte("created_at", start)
+            if end:
+                query = query.lt("created_at", end)
+            response = self._execute(query.order("created_at").order("id").range(offset, offset + limit - 1))
+            return response.data
+        except DependencyUnavailable:
+            raise
+        except Exception as e:
+            print(f"Error fetching readings page: {e}")
+            return None
+    
+    def count_patient_readings(self, patient_id: str, start: str = None, end: str = None):
+        """Count a patient's readings in a range without fetching them"""
+        try:
+            query = self.supabase.table("readings").select("id", count="exact", head=True).eq("patient_id", patient_id)
+            if start:
+                query = query.gte("created_at", start)
+            if end:
+                query = query.lt("created_at", end)
+            response = self._execute(query)
+            return response.count or 0
+        except DependencyUnavailable:
+            raise
+        except Exception as e:
+            print(f"Error counting readings: {e}")
+            return None
+    
+    # Rollup Operations
+    def merge_reading_rollups(self, rows: list, replace: bool = False):
+        """Merge (or with replace, overwrite) pre-aggregated rollup buckets in one call"""
+        try:
+            if not rows:
+                return True
+            self._execute(self.supabase.rpc("merge_reading_rollups", {"p_rows": rows, "p_replace": replace}))
+            return True
+        except DependencyUnavailable:
+            raise
+        except Exception as e:
+            print(f"Error merging reading rollups: {e}")
+            return False
+    
+    def get_reading_rollups(self, patient_id: str, resolution: str, start: str = None, end: str = None,
+                            page_size: int = 1000):
+        """Get hourly or daily rollup buckets for a patient, oldest first.
+
+        Fetched in pages, since PostgREST caps each response at max-rows (1000)
+        and a long range has more buckets than that.
+        """
+        try:
+            rows, offset = [], 0
+            while True:
+                query = self.supabase.table("reading_rollups").select("*").eq("patient_id", patient_id).eq("resolution", resolution)
+                if start:
+                    query = query.gte("bucket_start", start)
+                if end:
+                    query = query.lt("bucket_start", end)
+                response = self._execute(query.order("bucket_start").range(offset, offset + page_size - 1))
+                rows.extend(response.data)
+                if len(response.data) < page_size:
+                    return rows
+                offset += len(response.data)
+        except DependencyUnavailable:
+            raise
+        except Exception as e:
+            print(f"Error fetching reading rollups: {e}")
+            return None
+    
+    def get_patient_ids(self, offset: int = 0, limit: int = 1000, after: str = None):
+        """Page through patient IDs in order, optionally only those after a given ID"""
+        try:
+            query = self.supabase.table("patients").select("id")
+            if after:
+                query = query.gt("id", after)
+            response = self._execute(query.order("id").range(offset, offset + limit - 1))
+            return [row['id'] for row in response.data]
+        except DependencyUnavailable:
+            raise
+        except Exception as e:
+            print(f"Error fetching patient IDs: {e}")
+            return None
+    
+    def get_patients_with_rook_ids(self, offset: int = 0, limit: int = 1000):
+        """Page through patients that have a Rook user ID"""
+        try:
+            response = self._execute(
+                self.supabase.table("patients").select("*")
+                .not_.is_("rook_user_id", "null")
+                .order("id").range(offset, offset + limit - 1)
+            )
+            return response.data or []
+        except DependencyUnavailable:
+            raise
+        except Exception as e:
+            print(f"Error fetching patients with Rook IDs: {e}")
+            return None
+    
+    # Archival Operations
+    def get_archivable_rows(self, table: str, patient_id: str, before: str, offset: int = 0, limit: int = 1000):
+        """Page of a patient's readings or alerts eligible for archiving, oldest first"""
+        try:
+            response = self._execute(self.supabase.rpc(f"archivable_{table}", {
+                "p_patient_id": patient_id,
+                "p_before": before,
+                "p_offset": offset,
+                "p_limit": limit
+            }))
+            return response.data or []
+        except DependencyUnavailable:
+            raise
+        except Exception as e:
+            print(f"Error fetching archivable {table}: {e}")
+            return None
+    
+    def delete_archived_rows(self, table: str, ids: list):
+        """Delete a batch of archived readings or alerts; returns the number deleted"""
+        try:
+            if not ids:
+                return 0
+            response = self._execute(self.supabase.rpc(f"delete_archived_{table}", {"p_ids": ids}))
+            return response.data
+        except DependencyUnavailable:
+            raise
+        except Exception as e:
+            print(f"Error deleting archived {table}: {e}")
+            return None
+    
+    def set_archive_watermarks(self, rows: list):
+        """Raise patients' archive watermarks; rows are {'patient_id', 'readings_archived_before'} dicts"""
+        try:
+            if not rows:
+                return 0
+            response = self._execute(self.supabase.rpc("set_archive_watermarks", {"p_rows": rows}))
+            return response.data
+        except DependencyUnavailable:
+            raise
+        except Exception as e:
+            print(f"Error setting archive watermarks: {e}")
+            return None
+    
+    def get_archive_watermark(self, patient_id: str):
+        """Timestamp before which a patient's readings may be archived; '' if none are"""
+        try:
+            response = self._execute(
+                self.supabase.table("archive_watermarks").select("readings_archived_before").eq("patient_id", patient_id)
+            )
+            return response.data[0]['readings_archived_before'] if response.data else ''
+        except DependencyUnavailable:
+            raise
+        except Exception as e:
+            print(f"Error fetching archive watermark: {e}")
+            return None
+    
+    def get_archive_store(self):
+        """ID of the archive directory archived rows were written to; '' if nothing has been archived"""
+        try:
+            response = self._execute(self.supabase.table("archive_store").select("store_id"))
+            return response.data[0]['store_id'] if response.data else ''
+        except DependencyUnavailable:
+            raise
+        except Exception as e:
+            print(f"Error fetching archive store: {e}")
+            return None
+    
+    def claim_archive_store(self, store_id: str):
+        """Register store_id as the archive directory unless one already is; returns the registered ID"""
+        try:
+            response = self._execute(self.supabase.rpc("claim_archive_store", {"p_store_id": store_id}))
+            return response.data
+        except DependencyUnavailable:
+            raise
+        except Exception as e:
+            print(f"Error claiming archive store: {e}")
+            return None
+    
+    # Measurement Operations
+    def insert_measurements(self, patient_ids: list, metrics: list, recorded_at: list, values: list,
+                            source: str = "rook"):
+        """Bulk insert samples given as parallel columns; duplicates are ignored"""
+        try:
+            if not values:
+                return 0
+            response = self._execute(self.supabase.rpc("insert_measurements", {
+                "p_patient_ids": patient_ids,
+                "p_metrics": metrics,
+                "p_recorded_at": recorded_at,
+                "p_values": values,
+                "p_source": source
+            }))
+            return response.data
+        except DependencyUnavailable:
+            raise
+        except Exception as e:
+            print(f"Error inserting measurements: {e}")
+            return None
+    
+    def get_measurements(self, patient_id: str, metric: str, start: str, end: str,
+                         offset: int = 0, limit: int = 1000):
+        """Raw samples of one metric in [start, end), oldest first"""
+        try:
+            response = self._execute(
+                self.supabase.table("measurements").select("recorded_at, value")
+                .eq("patient_id", patient_id).eq("metric", metric)
+                .gte("recorded_at", start).lt("recorded_at", end)
+                .order("recorded_at").range(offset, offset + limit - 1)
+            )
+            return response.data or []
+        except DependencyUnavailable:
+            raise
+        except Exception as e:
+            print(f"Error fetching measurements: {e}")
+            return None
+    
+    def count_measurements(self, patient_id: str, metric: str, start: str, end: str):
+        """Number of samples of one metric in [start, end)"""
+        try:
+            response = self._execute(
+                self.supabase.table("measurements").select("recorded_at", count="exact", head=True)
+                .eq("patient_id", patient_id).eq("metric", metric)
+                .gte("recorded_at", start).lt("recorded_at", end)
+            )
+            return response.count or 0
+        except DependencyUnavailable:
+            raise
+        except Exception as e:
+            print(f"Error counting measurements: {e}")
+            return None
+    
+    def get_measurement_buckets(self, patient_id: str, metric: str, start: str, end: str, bucket: str):
+        """Samples aggregated into fixed buckets (bucket is a Postgres interval, e.g. '1 hour')"""
+        try:
+            response = self._execute(self.supabase.rpc("measurement_buckets", {
+                "p_patient_id": patient_id,
+                "p_metric": metric,
+                "p_start": start,
+                "p_end": end,
+                "p_bucket": bucket
+            }))
+            return response.data or []
+        except DependencyUnavailable:
+            raise
+        except Exception as e:
+            print(f"Error fetching measurement buckets: {e}")
+            return None
+    
+    def prune_measurements(self, metric: str, before: str, limit: int = 10000):
+        """Delete up to limit of a metric's samples older than before; returns the number deleted"""
+        try:
+            response = self._execute(self.supabase.rpc("prune_measurements", {
+                "p_metric": metric,
+                "p_before": before,
+                "p_batch": limit
+            }))
+            return response.data
+        except DependencyUnavailable:
+            raise
+        except Exception as e:
+            print(f"Error pruning measurements: {e}")
+            return None
     
     # Alert Operations
     def add_alert(self, alert: Alert):
@@ -67,29 +475,125 @@ class SupabaseService:
         try:
             alert_data = alert.to_dict()
             alert_data['id'] = str(uuid.uuid4())
-            response = self.supabase.table("alerts").insert(alert_data).execute()
+            response = self._execute(self.supabase.table("alerts").insert(alert_data))
             return response.data[0] if response.data else None
+        except DependencyUnavailable:
+            raise
         except Exception as e:
             print(f"Error adding alert: {e}")
             return None
     
+    def add_alerts(self, alerts: list):
+        """Create several alerts with a single multi-row insert"""
+        try:
+            rows = []
+            for alert in alerts:
+                alert_data = alert.to_dict()
+                alert_data['id'] = str(uuid.uuid4())
+                rows.append(alert_data)
+            if not rows:
+                return []
+            response = self._execute(self.supabase.table("alerts").insert(rows))
+            return response.data or []
+        except DependencyUnavailable:
+            raise
+        except Exception as e:
+            print(f"Error adding alerts: {e}")
+            return None
+    
     def get_patient_alerts(self, patient_id: str):
-        """Get all alerts for a patient"""
+        """Get all alerts for a patient; None if the read fails"""
         try:
-            response = self.supabase.table("alerts").select("*").eq("patient_id", patient_id).order("created_at", desc=True).execute()
+            response = self._execute(self.supabase.table("alerts").select("*").eq("patient_id", patient_id).order("created_at", desc=True))
             return response.data
+        except DependencyUnavailable:
+            raise
         except Exception as e:
             print(f"Error fetching alerts: {e}")
-            return []      
+            return None      
+        
+    def get_active_alerts(self, patient_id: str, limit: int = None):
+        """Get unresolved alerts for a patient (served by the partial index); None if the read fails"""
+        try:
+            query = self.supabase.table("alerts").select("*").eq("patient_id", patient_id).eq("resolved", False).order("created_at", desc=True)
+            if limit:
+                query = query.limit(limit)
+            response = self._execute(query)
+            return response.data
+        except DependencyUnavailable:
+            raise
+        except Exception as e:
+            print(f"Error fetching active alerts: {e}")
+            return None
+    
+    def count_patient_alerts(self, patient_id: str):
+        """Count all alerts for a patient without fetching them; None if the read fails"""
+        try:
+            response = self._execute(self.supabase.table("alerts").select("id", count="exact", head=True).eq("patient_id", patient_id))
+            return response.count or 0
+        except DependencyUnavailable:
+            raise
+        except Exception as e:
+            print(f"Error counting alerts: {e}")
+            return None
+    
+    def acknowledge_alert(self, alert_id: str, acknowledged_by: str = None):
+        """Mark an alert as seen by a clinician"""
+        try:
+            response = self._execute(self.supabase.table("alerts").update({
+                "acknowledged": True,
+                "acknowledged_at": datetime.now(timezone.utc).isoformat(),
+                "acknowledged_by": acknowledged_by
+            }).eq("id", alert_id))
+            return response.data[0] if response.data else None
+        except DependencyUnavailable:
+            raise
+        except Exception as e:
+            print(f"Error acknowledging alert: {e}")
+            return None
+    
+    def resolve_alerts(self, alert_ids: list, resolved_by: str = None):
+        """Resolve a set of open alerts with a single update"""
+        try:
+            if not alert_ids:
+                return []
+            response = self._execute(self.supabase.table("alerts").update({
+                "resolved": True,
+                "resolved_at": datetime.now(timezone.utc).isoformat(),
+                "resolved_by": resolved_by
+            }).in_("id", alert_ids).eq("resolved", False))
+            return response.data or []
+        except DependencyUnavailable:
+            raise
+        except Exception as e:
+            print(f"Error resolving alerts: {e}")
+            return None
+    
+    def get_unresolved_alert_counts(self, clinician_id: str):
+        """Open alert counts per patient for a clinician's panel"""
+        try:
+            response = self._execute(self.supabase.rpc("unresolved_alert_counts", {"p_clinician_id": clinician_id}))
+            return response.data or []
+        except DependencyUnavailable:
+            raise
+        except Exception as e:
+            print(f"Error counting unresolved alerts: {e}")
+            return None
         
     def get_patient_by_rook_id(self, rook_user_id: str):
+        """Patient with this Rook ID, or None if there isn't one.
+
+        Raises if the lookup itself fails, so callers never mistake an outage
+        for an unknown user.
+        """
         try:
             print(f"DEBUG: Searching for rook_user_id: '{rook_user_id}'")
             
-            response = self.supabase.table("patients") \
-                .select("*") \
-                .eq("rook_user_id", rook_user_id) \
-                .execute()
+            response = self._execute(
+                self.supabase.table("patients")
+                .select("*")
+                .eq("rook_user_id", rook_user_id)
+            )
 
             if not response.data:
                 print(f"DEBUG: Query successful but NO MATCH found for '{rook_user_id}'")
@@ -97,17 +601,34 @@ class SupabaseService:
                 
             print(f"DEBUG: Match found! Patient Name: {response.data[0].get('name')}")
             return response.data[0]
+        except DependencyUnavailable:
+            raise
         except Exception as e:
             print(f"DEBUG: Supabase query crashed! Error: {e}")
+            raise
+
+    def set_patient_rook_ids(self, updates: list):
+        """Set rook_user_id for many patients in one call; updates are {'id', 'rook_user_id'} dicts"""
+        try:
+            if not updates:
+                return 0
+            response = self._execute(self.supabase.rpc("set_patient_rook_ids", {"p_rows": updates}))
+            return response.data
+        except DependencyUnavailable:
+            raise
+        except Exception as e:
+            print(f"Error bulk updating Rook IDs: {e}")
             return None
 
     def update_patient_rook_id(self, patient_id: str, rook_user_id: str):
         """Update patient's Rook user ID"""
         try:
-            response = self.supabase.table("patients").update(
+            response = self._execute(self.supabase.table("patients").update(
                 {"rook_user_id": rook_user_id}
-            ).eq("id", patient_id).execute()
+            ).eq("id", patient_id))
             return response.data[0] if response.data else None
+        except DependencyUnavailable:
+            raise
         except Exception as e:
             print(f"Error updating patient Rook ID: {e}")
             return None    
\ No newline at end of file
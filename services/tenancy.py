@@ -0,0 +1,113 @@
+"""Tenant (clinician practice) awareness for shared caches and background work.
+
+The tenant of a patient is their clinician_id. Background jobs split tenants
+across worker processes with a consistent hash ring, queues hand out work
+round-robin between tenants, and TenantMetrics shows who is using capacity.
+"""
+from bisect import bisect
+from functools import lru_cache
+import hashlib
+import os
+import threading
+
+UNKNOWN_TENANT = 'unknown'
+
+
+def tenant_of(patient: dict):
+    return (patient or {}).get('clinician_id') or UNKNOWN_TENANT
+
+
+class HashRing:
+    """Consistent hashing of tenants onto nodes, with virtual nodes for balance.
+
+    Adding or removing a node only moves the tenants that hashed to it.
+    """
+
+    def __init__(self, nodes, replicas: int = 100):
+        self.nodes = list(nodes)
+        self._ring = sorted(
+            (self._hash(f"{node}#{replica}"), node)
+            for node in self.nodes
+            for replica in range(replicas)
+        )
+        self._keys = [key for key, _ in self._ring]
+
+    @staticmethod
+    def _hash(value: str):
+        return int.from_bytes(hashlib.md5(value.encode()).digest()[:8], 'big')
+
+    def node_for(self, tenant_id: str):
+        if not self._ring:
+            return None
+        index = bisect(self._keys, self._hash(str(tenant_id))) % len(self._ring)
+        return self._ring[index][1]
+
+
+@lru_cache(maxsize=8)
+def shard_ring(count: int):
+    return HashRing(range(count))
+
+
+def owns(tenant_id: str, index: int = None, count: int = None):
+    """Whether worker `index` of `count` (WORKER_INDEX/WORKER_COUNT) handles a tenant's background work"""
+    count = count if count is not None else int(os.getenv("WORKER_COUNT", "1"))
+    index = index if index is not None else int(os.getenv("WORKER_INDEX", "0"))
+    if count <= 1:
+        return True
+    return shard_ring(count).node_for(tenant_id) == index
+
+
+def interleave(items: list, key):
+    """Reorder items round-robin across tenants so no tenant's items all come first"""
+    groups = {}
+    for item in items:
+        groups.setdefault(key(item), []).append(item)
+    queues = list(groups.values())
+    result = []
+    for position in range(max((len(queue) for queue in queues), default=0)):
+        result.extend(queue[position] for queue in queues if position < len(queue))
+    return result
+
+
+class TenantMetrics:
+    """Per-tenant counters and busy time, so large practices are visible"""
+
+    def __init__(self, max_tenants: int = None):
+        self.max_tenants = max_tenants or int(os.getenv("TENANT_METRICS_MAX", "5000"))
+        self._tenants = {}
+        self._lock = threading.Lock()
+
+    def record(self, tenant_id: str, busy_seconds: float = 0.0, **counts):
+        with self._lock:
+            metrics = self._tenants.get(tenant_id)
+            if metrics is None:
+                if len(self._tenants) >= self.max_tenants:
+                    tenant_id = 'other'
+                metrics = self._tenants.setdefault(tenant_id, {'busy_seconds': 0.0})
+            metrics['busy_seconds'] += busy_seconds
+            for name, value in counts.items():
+                metrics[name] = metrics.get(name, 0) + value
+
+    def stats(self, top: int = 20):
+        """Busiest tenants first, with their share of the total busy time"""
+        with self._lock:
+            tenants = {tenant_id: dict(metrics) for tenant_id, metrics in self._tenants.items()}
+        total = sum(metrics['busy_seconds'] for metrics in tenants.values())
+        ranked = sorted(tenants.items(), key=lambda item: item[1]['busy_seconds'], reverse=True)[:top]
+        return {
+            'tenants': len(tenants),
+            'busy_seconds_total': round(total, 3),
+            'top': [
+                {
+                    'tenant': tenant_id,
+                    **metrics,
+                    'busy_seconds': round(metrics['busy_seconds'], 3),
+                    'busy_share': round(metrics['busy_seconds'] / total, 4) if total else 0.0,
+                }
+                for tenant_id, metrics in ranked
+            ]
+        }
+
+
+# Shared by the ingestion paths and the metrics endpoint
+tenant_metrics = TenantMetrics()
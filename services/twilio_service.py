@@ -1,24 +1,160 @@
 from twilio.rest import Client
+from twilio.http.http_client import TwilioHttpClient
+from twilio.base.exceptions import TwilioRestException
+from concurrent.futures import ThreadPoolExecutor
+from services.rate_limiter import RateLimiter
+from services.resilience import get_dependency, BulkheadFullError, DependencyUnavailable
+import requests
+import random
+import threading
+import time
 import os
 
+# HTTP statuses from Twilio that are worth retrying
+TRANSIENT_STATUSES = {429, 500, 502, 503, 504}
+
+
+def _is_twilio_failure(error):
+    """Client errors (bad number, throttling) don't mean Twilio is down"""
+    if isinstance(error, TwilioRestException):
+        return error.status >= 500
+    return True
+
+
+twilio_dependency = get_dependency("twilio", timeout=10, max_concurrent=16, is_failure=_is_twilio_failure)
+# Bulk sends get their own bulkhead (TWILIO_BULK_MAX_CONCURRENT), so a
+# campaign can't take the slots live alerts need
+twilio_bulk_dependency = get_dependency("twilio_bulk", timeout=10, max_concurrent=8,
+                                        is_failure=_is_twilio_failure)
+
+
+class _HttpClient(TwilioHttpClient):
+    """Remembers the Retry-After of throttled (429) responses, per thread.
+
+    TwilioRestException doesn't carry response headers, and the client is
+    shared by the bulk workers, so each thread reads back its own value.
+    Optionally sends API calls to another host, e.g. the local mock server.
+    """
+
+    def __init__(self, base_url: str = None, **kwargs):
+        super().__init__(**kwargs)
+        self.base_url = base_url.rstrip('/') if base_url else None
+        self._local = threading.local()
+
+    def request(self, method, url, *args, **kwargs):
+        if self.base_url:
+            url = url.replace("https://api.twilio.com", self.base_url, 1)
+        self._local.retry_after = None
+        response = super().request(method, url, *args, **kwargs)
+        if response.status_code == 429:
+            try:
+                self._local.retry_after = float((response.headers or {}).get('Retry-After'))
+            except (TypeError, ValueError):
+                pass
+        return response
+
+    def last_retry_after(self):
+        """Retry-After in seconds of this thread's last throttled response, or None"""
+        return getattr(self._local, 'retry_after', None)
+
+
 class TwilioService:
     def __init__(self):
+        timeout = twilio_dependency.timeout
+        api_base_url = os.getenv("TWILIO_API_BASE_URL")
+        self.http_client = _HttpClient(api_base_url, timeout=timeout)
+
         self.client = Client(
             os.getenv("TWILIO_ACCOUNT_SID"),
-            os.getenv("TWILIO_AUTH_TOKEN")
+            os.getenv("TWILIO_AUTH_TOKEN"),
+            http_client=self.http_client
         )
         self.whatsapp_number = os.getenv("TWILIO_WHATSAPP_NUMBER")
-    
+        self.messages_per_second = float(os.getenv("TWILIO_MESSAGES_PER_SECOND", "10"))
+        self.bulk_workers = int(os.getenv("TWILIO_BULK_WORKERS", "8"))
+        self.max_retries = int(os.getenv("TWILIO_MAX_RETRIES", "3"))
+        # Longer throttling than this fails the message rather than parking a worker
+        self.max_retry_after = float(os.getenv("TWILIO_MAX_RETRY_AFTER_SECONDS", "60"))
+
+    def _send(self, phone_number: str, message: str, dependency=twilio_dependency):
+        """Send one WhatsApp message through the breaker and bulkhead, raising on failure"""
+        return dependency.call(
+            self.client.messages.create,
+            from_=f"whatsapp:{self.whatsapp_number}",
+            to=f"whatsapp:{phone_number}",
+            body=message
+        )
+
     def send_whatsapp_alert(self, phone_number: str, message: str):
         """Send WhatsApp message alert"""
         try:
-            msg = self.client.messages.create(
-                from_=f"whatsapp:{self.whatsapp_number}",
-                to=f"whatsapp:{phone_number}",
-                body=message
-            )
+            msg = self._send(phone_number, message)
             print(f"WhatsApp sent: {msg.sid}")
             return True
         except Exception as e:
             print(f"Error sending WhatsApp: {e}")
-            return False
\ No newline at end of file
+            return False
+
+    @staticmethod
+    def is_transient(error: Exception):
+        """Whether a send failure is worth retrying"""
+        if isinstance(error, TwilioRestException):
+            return error.status in TRANSIENT_STATUSES
+        return isinstance(error, (requests.exceptions.ConnectionError, requests.exceptions.Timeout,
+                                  BulkheadFullError))
+
+    def retry_delay(self, error: Exception, attempt: int):
+        """Seconds to wait before retrying a failed send: the server's hint, else jittered backoff"""
+        backoff = min(30, 0.5 * 2 ** attempt) * (0.5 + random.random())
+        hint = None
+        if isinstance(error, TwilioRestException) and error.status == 429:
+            hint = self.http_client.last_retry_after()
+        elif isinstance(error, DependencyUnavailable):
+            hint = error.retry_after
+        return max(backoff, hint) if hint else backoff
+
+    def send_bulk_whatsapp(self, messages: list, messages_per_second: float = None,
+                           max_workers: int = None):
+        """Send many (phone_number, message) pairs concurrently under a rate limit.
+
+        Returns a report with one result per recipient, in input order.
+        """
+        limiter = RateLimiter(messages_per_second or self.messages_per_second)
+        started = time.monotonic()
+
+        def deliver(item):
+            phone_number, message = item
+            result = {'to': phone_number, 'status': 'failed', 'sid': None, 'attempts': 0, 'error': None}
+            for attempt in range(self.max_retries + 1):
+                limiter.acquire()
+                result['attempts'] = attempt + 1
+                try:
+                    msg = self._send(phone_number, message, twilio_bulk_dependency)
+                    result['status'] = 'sent'
+                    result['sid'] = msg.sid
+                    result['error'] = None
+                    return result
+                except Exception as e:
+                    result['error'] = str(e)
+                    if not self.is_transient(e) or attempt == self.max_retries:
+                        return result
+                    delay = self.retry_delay(e, attempt)
+                    if delay > self.max_retry_after:
+                        return result
+                    time.sleep(delay)
+            return result
+
+        with ThreadPoolExecutor(max_workers=max_workers or self.bulk_workers) as executor:
+            results = list(executor.map(deliver, messages))
+
+        elapsed = time.monotonic() - started
+        sent = sum(1 for result in results if result['status'] == 'sent')
+        print(f"Bulk WhatsApp: {sent}/{len(results)} sent in {elapsed:.2f}s")
+        return {
+            'total': len(results),
+            'sent': sent,
+            'failed': len(results) - sent,
+            'elapsed_seconds': round(elapsed, 3),
+            'messages_per_second': round(len(results) / elapsed, 2) if elapsed > 0 else None,
+            'results': results
+        }
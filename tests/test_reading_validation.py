@@ -0,0 +1,150 @@
+import pytest
+
+from services import reading_validation
+from services.reading_validation import ReadingValidator
+
+
+@pytest.fixture
+def validator():
+    return ReadingValidator()
+
+
+def seed(validator, patient_id='p', count=10):
+    for i in range(count):
+        values, _, _ = validator.validate(patient_id, 118 + i % 5, 78 + i % 3, 70)
+        validator.remember([{'patient_id': patient_id, **values}])
+
+
+# Coercion
+def test_numeric_strings_are_coerced(validator):
+    values, errors, warnings = validator.validate('p', ' 120 ', '80', '72')
+    assert values == {'systolic': 120, 'diastolic': 80, 'heart_rate': 72}
+    assert errors == [] and warnings == []
+
+
+def test_missing_heart_rate_is_stored_as_zero(validator):
+    values, errors, _ = validator.validate('p', 120, 80)
+    assert values['heart_rate'] == 0
+    assert errors == []
+
+
+@pytest.mark.parametrize('systolic, diastolic', [(None, 80), (120, ''), ('abc', 80), (True, 80)])
+def test_missing_or_non_numeric_values_are_rejected(validator, systolic, diastolic):
+    values, errors, _ = validator.validate('p', systolic, diastolic, 70)
+    assert values is None
+    assert errors
+
+
+def test_non_numeric_heart_rate_is_rejected(validator):
+    values, errors, _ = validator.validate('p', 120, 80, 'fast')
+    assert values is None
+    assert 'heart rate must be a number' in errors
+
+
+# Swapped values
+def test_swapped_systolic_and_diastolic_are_fixed(validator):
+    values, errors, warnings = validator.validate('p', 80, 120, 70)
+    assert values == {'systolic': 120, 'diastolic': 80, 'heart_rate': 70}
+    assert errors == []
+    assert 'systolic and diastolic were swapped' in warnings
+
+
+# Ranges
+@pytest.mark.parametrize('systolic, diastolic, heart_rate', [
+    (30, 20, 70),     # looks like kPa but isn't declared as such
+    (310, 100, 70),
+    (120, 20, 70),
+    (120, 115, 70),   # pulse pressure under 10
+    (120, 80, 300),
+    (120, 80, 10),
+])
+def test_out_of_range_readings_are_rejected(validator, systolic, diastolic, heart_rate):
+    values, errors, _ = validator.validate('p', systolic, diastolic, heart_rate)
+    assert values is None
+    assert errors
+
+
+# Units
+def test_declared_kpa_is_converted(validator):
+    values, errors, _ = validator.validate('p', 16, 10.7, 70, unit='kPa')
+    assert values == {'systolic': 120, 'diastolic': 80, 'heart_rate': 70}
+    assert errors == []
+
+
+def test_small_values_without_a_unit_are_not_converted(validator):
+    values, errors, warnings = validator.validate('p', 16, 10.7, 70)
+    assert values is None
+    assert not any('kPa' in warning for warning in warnings)
+
+
+# Outliers
+def test_outliers_are_only_warned_about_by_default(validator):
+    seed(validator)
+    values, errors, warnings = validator.validate('p', 220, 130, 70)
+    assert values is not None
+    assert errors == []
+    assert any('far from recent readings' in warning for warning in warnings)
+
+
+def test_outliers_can_be_rejected(validator, monkeypatch):
+    monkeypatch.setattr(reading_validation, 'REJECT_OUTLIERS', True)
+    seed(validator)
+    values, errors, _ = validator.validate('p', 220, 130, 70)
+    assert values is None
+    assert any('far from recent readings' in error for error in errors)
+
+
+def test_no_outlier_check_without_enough_history(validator):
+    seed(validator, count=reading_validation.MIN_HISTORY - 1)
+    _, errors, warnings = validator.validate('p', 220, 130, 70)
+    assert errors == [] and warnings == []
+
+
+def test_history_is_per_patient(validator):
+    seed(validator, 'steady')
+    _, _, warnings = validator.validate('other', 220, 130, 70)
+    assert warnings == []
+
+
+def test_validating_does_not_add_to_history(validator):
+    for _ in range(10):
+        validator.validate('p', 120, 80, 70)
+    assert validator.stats()['patients_tracked'] == 0
+
+
+def test_history_keeps_the_most_recently_seen_patients():
+    validator = ReadingValidator(max_patients=2)
+    seed(validator, 'a')
+    seed(validator, 'b')
+    validator.validate('a', 120, 80, 70)
+    seed(validator, 'c')
+    assert validator.stats()['patients_tracked'] == 2
+    _, _, warnings = validator.validate('a', 220, 130, 70)
+    assert warnings
+    _, _, warnings = validator.validate('b', 220, 130, 70)
+    assert warnings == []
+
+
+def test_untracked_validator_keeps_no_history_and_skips_outliers():
+    validator = ReadingValidator(track_history=False)
+    seed(validator)
+    _, errors, warnings = validator.validate('p', 220, 130, 70)
+    assert errors == [] and warnings == []
+    assert validator.stats()['patients_tracked'] == 0
+
+
+# Batches
+def test_batch_results_line_up_with_inputs(validator):
+    result = validator.validate_batch(['a', 'b', 'c'], [120, 400, 80], [80, 80, 120], [70, 70, None])
+    assert result['accepted'].tolist() == [True, False, True]
+    assert result['values'][0] == {'systolic': 120, 'diastolic': 80, 'heart_rate': 70}
+    assert result['values'][1] is None and result['errors'][1]
+    assert result['values'][2] == {'systolic': 120, 'diastolic': 80, 'heart_rate': 0}
+    assert 'systolic and diastolic were swapped' in result['warnings'][2]
+
+
+def test_stats_count_accepted_and_rejection_reasons(validator):
+    validator.validate_batch(['a', 'b'], [120, 400], [80, 80])
+    stats = validator.stats()
+    assert stats['accepted'] == 1
+    assert sum(stats['rejected'].values()) == 1